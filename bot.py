@@ -1,3582 +1,4503 @@
-import logging
-import os
-import re
-import asyncio
-import json
-import base64
-import time
-import subprocess
-import threading
-from pathlib import Path
-from urllib.parse import parse_qs, urlencode, urlparse, urlunparse
-import urllib.request
-
-from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
-
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, LabeledPrice, Update
-from telegram.error import BadRequest, NetworkError, TimedOut
-from telegram.ext import (
-    Application,
-    CallbackQueryHandler,
-    CommandHandler,
-    ContextTypes,
-    MessageHandler,
-    PreCheckoutQueryHandler,
-    filters,
-)
-from telegram.request import HTTPXRequest
-import yt_dlp
-from yt_dlp.utils import DownloadError
-import imageio_ffmpeg
-
-
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
-logger = logging.getLogger(__name__)
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("httpcore").setLevel(logging.CRITICAL)
-logging.getLogger("telegram").setLevel(logging.CRITICAL)
-logging.getLogger("telegram.ext").setLevel(logging.CRITICAL)
-
-DOWNLOAD_DIR = Path("downloads")
-DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
-
-MAX_FILE_SIZE_BYTES = 50 * 1024 * 1024  # ~50 Mo
-IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "bmp"}
-
-BOT_USERNAME = os.getenv("BOT_USERNAME")
-SHARE_PROMPTED_CHATS: set[int] = set()
-
-TIKTOK_FILE_ID_CACHE: dict[str, str] = {}
-TIKTOK_FILE_ID_CACHE_MAX = 200
-
-USER_STORE_PATH = Path("user_store.json")
-USER_STORE_LOCK = asyncio.Lock()
-
-PREMIUM_DURATION_SECONDS = 30 * 24 * 60 * 60
-PREMIUM_30D_STARS = 299
-CREDITS_10_STARS = 99
-CREDITS_50_STARS = 399
-FREE_EFFECTS_PER_DAY = 2
-AD_EVERY_SUCCESS_COUNT = 5
-
-def _int_env(name: str, default: int) -> int:
-    raw = os.getenv(name)
-    if not raw:
-        return default
-    try:
-        v = int(raw)
-    except ValueError:
-        return default
-    return v if v > 0 else default
-
-MAX_CONCURRENT_DOWNLOADS = _int_env("MAX_CONCURRENT_DOWNLOADS", 1)
-MAX_CONCURRENT_FFMPEG_JOBS = _int_env("MAX_CONCURRENT_FFMPEG_JOBS", 1)
-CLEANUP_DOWNLOADS_MAX_AGE_HOURS = _int_env("CLEANUP_DOWNLOADS_MAX_AGE_HOURS", 72)
-
-DOWNLOAD_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
-FFMPEG_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_FFMPEG_JOBS)
-
-_YTDLP_COOKIEFILE_READY = False
-_YTDLP_COOKIEFILE: str | None = None
-
-
-def _get_ytdlp_cookiefile() -> str | None:
-    global _YTDLP_COOKIEFILE_READY
-    global _YTDLP_COOKIEFILE
-
-    def _split_netscape_fields(line: str) -> list[str] | None:
-        s = line.strip("\r\n")
-        if not s:
-            return None
-        if s.startswith("#HttpOnly_"):
-            s = s[len("#HttpOnly_") :]
-            http_only = True
-        else:
-            http_only = False
-        if s.lstrip().startswith("#"):
-            return None
-        parts = s.split("\t")
-        if len(parts) < 7:
-            parts = re.split(r"\s+", s.strip())
-        if len(parts) < 7:
-            return None
-        if len(parts) > 7:
-            parts = parts[:6] + [" ".join(parts[6:])]
-        if http_only:
-            parts[0] = "#HttpOnly_" + parts[0]
-        return parts
-
-    def _looks_like_netscape(text: str) -> bool:
-        for line in text.splitlines():
-            if _split_netscape_fields(line) is not None:
-                return True
-        return False
-
-    def _normalize_netscape_text(text: str) -> str:
-        stripped = text.lstrip()
-        json_candidate: str | None = None
-
-        if stripped.startswith("\"") or stripped.startswith("'"):
-            q = stripped[0]
-            if stripped.endswith(q) and len(stripped) >= 2:
-                json_candidate = stripped[1:-1]
-        if json_candidate is None:
-            json_candidate = stripped
-
-        data = None
-        if json_candidate.startswith("[") or json_candidate.startswith("{"):
-            try:
-                data = json.loads(json_candidate)
-            except Exception:
-                data = None
-        elif ("[" in json_candidate) or ("{" in json_candidate):
-            idxs = [i for i in (json_candidate.find("["), json_candidate.find("{")) if i >= 0]
-            start = min(idxs) if idxs else -1
-            if start >= 0:
-                try:
-                    data = json.loads(json_candidate[start:])
-                except Exception:
-                    data = None
-
-        if data is not None:
-            cookies: list[dict] = []
-            if isinstance(data, list):
-                cookies = [c for c in data if isinstance(c, dict)]
-            elif isinstance(data, dict):
-                if isinstance(data.get("cookies"), list):
-                    cookies = [c for c in data.get("cookies") if isinstance(c, dict)]
-                else:
-                    cookies = [data] if isinstance(data, dict) else []
-
-            if cookies:
-                lines: list[str] = []
-                for c in cookies:
-                    domain = c.get("domain")
-                    name = c.get("name")
-                    if not isinstance(domain, str) or not domain.strip():
-                        continue
-                    if not isinstance(name, str) or not name:
-                        continue
-                    domain = domain.strip()
-                    include_subdomains = "TRUE" if domain.startswith(".") else "FALSE"
-                    path = c.get("path")
-                    path = path if isinstance(path, str) and path else "/"
-                    secure = "TRUE" if bool(c.get("secure")) else "FALSE"
-                    expiry = c.get("expirationDate")
-                    if not isinstance(expiry, (int, float)):
-                        expiry = c.get("expires")
-                    if not isinstance(expiry, (int, float)):
-                        expiry = 0
-                    value = c.get("value")
-                    value = value if isinstance(value, str) else ""
-                    http_only = bool(c.get("httpOnly") or c.get("httponly") or c.get("http_only"))
-                    domain_field = ("#HttpOnly_" + domain) if http_only else domain
-                    lines.append(
-                        "\t".join(
-                            [
-                                domain_field,
-                                include_subdomains,
-                                path,
-                                secure,
-                                str(int(expiry)),
-                                name,
-                                value,
-                            ]
-                        )
-                    )
-                out_text = "\n".join(lines)
-                if not out_text.endswith("\n"):
-                    out_text += "\n"
-                return out_text
-
-        had_trailing_nl = text.endswith("\n")
-        lines: list[str] = []
-        for line in text.splitlines():
-            if not line:
-                lines.append(line)
-                continue
-            if line.lstrip().startswith("#") and not line.startswith("#HttpOnly_"):
-                lines.append(line)
-                continue
-            parts = _split_netscape_fields(line)
-            if parts is None:
-                lines.append(line)
-                continue
-            lines.append("\t".join(parts))
-        out_text = "\n".join(lines)
-        if had_trailing_nl and not out_text.endswith("\n"):
-            out_text += "\n"
-        return out_text
-
-    if _YTDLP_COOKIEFILE_READY:
-        return _YTDLP_COOKIEFILE
-
-    _YTDLP_COOKIEFILE_READY = True
-
-    cookie_path = os.getenv("YTDLP_COOKIES_PATH")
-    if cookie_path and os.path.exists(cookie_path):
-        try:
-            txt = Path(cookie_path).read_text(encoding="utf-8", errors="ignore")
-            if _looks_like_netscape(txt):
-                _YTDLP_COOKIEFILE = cookie_path
-                return _YTDLP_COOKIEFILE
-            logger.warning("yt-dlp cookies path: invalid Netscape format; ignoring")
-        except OSError:
-            pass
-        _YTDLP_COOKIEFILE = None
-        return None
-
-    raw = os.getenv("YTDLP_COOKIES")
-    if not raw:
-        _YTDLP_COOKIEFILE = None
-        return None
-
-    raw = raw.strip()
-    if raw.lower().startswith("base64:"):
-        b64 = raw.split(":", 1)[1].strip()
-        try:
-            raw = base64.b64decode(b64).decode("utf-8", errors="ignore")
-        except Exception:
-            _YTDLP_COOKIEFILE = None
-            return None
-
-    if "\\n" in raw and "\n" not in raw:
-        raw = raw.replace("\\n", "\n")
-
-    if "\\t" in raw and "\t" not in raw:
-        raw = raw.replace("\\t", "\t")
-
-    raw = _normalize_netscape_text(raw)
-    if "# netscape http cookie file" not in raw.lower():
-        raw = "# Netscape HTTP Cookie File\n" + raw
-
-    out = DOWNLOAD_DIR / "ytdlp_cookies.txt"
-    try:
-        out.write_text(raw, encoding="utf-8")
-    except OSError:
-        _YTDLP_COOKIEFILE = None
-        return None
-
-    try:
-        size = out.stat().st_size
-        sample = out.read_text(encoding="utf-8", errors="ignore")[:20000]
-        lower = sample.lower()
-        has_netscape = _looks_like_netscape(sample)
-        has_youtube = "youtube.com" in lower
-        has_google = "google.com" in lower
-
-        needed = [
-            "sid",
-            "hsid",
-            "ssid",
-            "apisid",
-            "sapisid",
-            "__secure-1psid",
-            "__secure-3psid",
-            "visitor_info1_live",
-        ]
-        present = [k for k in needed if k in lower]
-        has_auth = bool(present)
-        logger.info(
-            "yt-dlp cookies file: size=%d bytes, netscape=%s, youtube=%s, google=%s, auth=%s, auth_keys=%s",
-            int(size),
-            "yes" if has_netscape else "no",
-            "yes" if has_youtube else "no",
-            "yes" if has_google else "no",
-            "yes" if has_auth else "no",
-            ",".join(present) if present else "-",
-        )
-    except OSError:
-        pass
-
-    try:
-        full = out.read_text(encoding="utf-8", errors="ignore")
-        if not _looks_like_netscape(full):
-            logger.warning("yt-dlp cookies: invalid Netscape format; ignoring")
-            try:
-                non_comment: list[str] = []
-                for ln in full.splitlines():
-                    s = ln.strip("\r\n")
-                    if not s:
-                        continue
-                    if s.lstrip().startswith("#") and not s.startswith("#HttpOnly_"):
-                        continue
-                    non_comment.append(s[:300])
-                    if len(non_comment) >= 5:
-                        break
-                if non_comment:
-                    logger.info("yt-dlp cookies: first non-comment lines: %s", " | ".join(non_comment))
-            except Exception:
-                pass
-            try:
-                out.unlink()
-            except OSError:
-                pass
-            _YTDLP_COOKIEFILE = None
-            return None
-    except OSError:
-        _YTDLP_COOKIEFILE = None
-        return None
-
-    _YTDLP_COOKIEFILE = str(out)
-    return _YTDLP_COOKIEFILE
-
-def _safe_remove(path: str | None) -> None:
-    if not isinstance(path, str) or not path:
-        return
-    try:
-        os.remove(path)
-    except OSError:
-        return
-
-def _cleanup_download_dir_if_needed() -> None:
-    if CLEANUP_DOWNLOADS_MAX_AGE_HOURS <= 0:
-        return
-    if not DOWNLOAD_DIR.exists() or not DOWNLOAD_DIR.is_dir():
-        return
-    cutoff = time.time() - (CLEANUP_DOWNLOADS_MAX_AGE_HOURS * 3600)
-    for p in DOWNLOAD_DIR.iterdir():
-        if not p.is_file():
-            continue
-        try:
-            if p.stat().st_mtime >= cutoff:
-                continue
-        except OSError:
-            continue
-        _safe_remove(str(p))
-
-def _start_healthcheck_server_if_needed() -> None:
-    port_raw = os.getenv("PORT")
-    if not port_raw:
-        return
-    try:
-        port = int(port_raw)
-    except ValueError:
-        return
-    if port <= 0:
-        return
-
-    class _HealthHandler(BaseHTTPRequestHandler):
-        def do_GET(self) -> None:  # noqa: N802
-            if self.path in ("/", "/health", "/healthz"):
-                self.send_response(200)
-                self.send_header("Content-Type", "text/plain; charset=utf-8")
-                self.end_headers()
-                self.wfile.write(b"ok")
-                return
-            self.send_response(404)
-            self.end_headers()
-
-        def log_message(self, format: str, *args) -> None:  # noqa: A002
-            return
-
-    try:
-        server = ThreadingHTTPServer(("0.0.0.0", port), _HealthHandler)
-    except OSError:
-        return
-
-    t = threading.Thread(target=server.serve_forever, daemon=True)
-    t.start()
-
-
-def _today_key() -> str:
-    return time.strftime("%Y-%m-%d", time.gmtime())
-
-
-def _load_user_store_sync() -> dict:
-    if not USER_STORE_PATH.exists():
-        return {}
-    try:
-        raw = USER_STORE_PATH.read_text(encoding="utf-8")
-        data = json.loads(raw) if raw else {}
-        return data if isinstance(data, dict) else {}
-    except Exception:
-        return {}
-
-
-def _save_user_store_sync(store: dict) -> None:
-    tmp = USER_STORE_PATH.with_suffix(".tmp")
-    tmp.write_text(json.dumps(store, ensure_ascii=False), encoding="utf-8")
-    os.replace(tmp, USER_STORE_PATH)
-
-
-async def _read_user_store() -> dict:
-    async with USER_STORE_LOCK:
-        return await asyncio.to_thread(_load_user_store_sync)
-
-
-async def _write_user_store(store: dict) -> None:
-    async with USER_STORE_LOCK:
-        await asyncio.to_thread(_save_user_store_sync, store)
-
-
-async def _get_user_record(user_id: int) -> dict:
-    if not isinstance(user_id, int) or user_id <= 0:
-        return {}
-    store = await _read_user_store()
-    key = str(user_id)
-    rec = store.get(key)
-    if not isinstance(rec, dict):
-        rec = {}
-    return rec
-
-
-def _is_premium_now(rec: dict) -> bool:
-    until = rec.get("premium_until")
-    return isinstance(until, (int, float)) and int(until) > int(time.time())
-
-
-def _get_credits(rec: dict) -> int:
-    c = rec.get("credits")
-    return int(c) if isinstance(c, (int, float)) and int(c) > 0 else 0
-
-
-async def _grant_premium(user_id: int, seconds: int) -> None:
-    if seconds <= 0:
-        return
-    async with USER_STORE_LOCK:
-        store = await asyncio.to_thread(_load_user_store_sync)
-        key = str(user_id)
-        rec = store.get(key)
-        if not isinstance(rec, dict):
-            rec = {}
-        now = int(time.time())
-        base = int(rec.get("premium_until")) if isinstance(rec.get("premium_until"), (int, float)) else 0
-        if base < now:
-            base = now
-        rec["premium_until"] = base + int(seconds)
-        store[key] = rec
-        await asyncio.to_thread(_save_user_store_sync, store)
-
-
-async def _add_credits(user_id: int, amount: int) -> None:
-    if amount <= 0:
-        return
-    async with USER_STORE_LOCK:
-        store = await asyncio.to_thread(_load_user_store_sync)
-        key = str(user_id)
-        rec = store.get(key)
-        if not isinstance(rec, dict):
-            rec = {}
-        cur = int(rec.get("credits")) if isinstance(rec.get("credits"), (int, float)) else 0
-        rec["credits"] = max(0, cur + int(amount))
-        store[key] = rec
-        await asyncio.to_thread(_save_user_store_sync, store)
-
-
-async def _plan_effect_entitlement(user_id: int) -> str | None:
-    async with USER_STORE_LOCK:
-        store = await asyncio.to_thread(_load_user_store_sync)
-        key = str(user_id)
-        rec = store.get(key)
-        if not isinstance(rec, dict):
-            rec = {}
-
-        if _is_premium_now(rec):
-            return "premium"
-
-        today = _today_key()
-        used_day = rec.get("effects_free_day")
-        used_count = rec.get("effects_free_used")
-        if used_day != today:
-            used_count = 0
-        used_count = int(used_count) if isinstance(used_count, (int, float)) else 0
-        if used_count < FREE_EFFECTS_PER_DAY:
-            return "free"
-
-        credits = _get_credits(rec)
-        if credits > 0:
-            return "credit"
-
-        return None
-
-
-async def _finalize_effect_entitlement(user_id: int, kind: str | None) -> None:
-    if kind not in ("premium", "free", "credit"):
-        return
-    if kind == "premium":
-        return
-    async with USER_STORE_LOCK:
-        store = await asyncio.to_thread(_load_user_store_sync)
-        key = str(user_id)
-        rec = store.get(key)
-        if not isinstance(rec, dict):
-            rec = {}
-
-        today = _today_key()
-        used_day = rec.get("effects_free_day")
-        used_count = rec.get("effects_free_used")
-        if used_day != today:
-            used_day = today
-            used_count = 0
-        used_count = int(used_count) if isinstance(used_count, (int, float)) else 0
-
-        if kind == "free":
-            rec["effects_free_day"] = used_day
-            rec["effects_free_used"] = used_count + 1
-        elif kind == "credit":
-            credits = _get_credits(rec)
-            rec["credits"] = max(0, credits - 1)
-
-        store[key] = rec
-        await asyncio.to_thread(_save_user_store_sync, store)
-
-
-async def _bump_success_and_should_show_ad(user_id: int) -> bool:
-    if AD_EVERY_SUCCESS_COUNT <= 0:
-        return False
-    async with USER_STORE_LOCK:
-        store = await asyncio.to_thread(_load_user_store_sync)
-        key = str(user_id)
-        rec = store.get(key)
-        if not isinstance(rec, dict):
-            rec = {}
-        cnt = rec.get("success_count")
-        cnt = int(cnt) if isinstance(cnt, (int, float)) else 0
-        cnt += 1
-        rec["success_count"] = cnt
-        store[key] = rec
-        await asyncio.to_thread(_save_user_store_sync, store)
-        return (cnt % AD_EVERY_SUCCESS_COUNT) == 0
-
-
-def _format_premium_until(ts: int, lang: str) -> str:
-    try:
-        dt = time.gmtime(int(ts))
-        return time.strftime("%d/%m/%Y", dt) if lang == "fr" else time.strftime("%Y-%m-%d", dt)
-    except Exception:
-        return ""
-
-
-def _ref_link_for_user(user_id: int) -> str | None:
-    bot_link = _get_bot_link()
-    if not bot_link:
-        return None
-    if not isinstance(user_id, int) or user_id <= 0:
-        return None
-    return bot_link + "?start=" + f"ref_{user_id}"
-
-
-async def _apply_referral(new_user_id: int, ref_user_id: int) -> bool:
-    if not isinstance(new_user_id, int) or not isinstance(ref_user_id, int):
-        return False
-    if new_user_id <= 0 or ref_user_id <= 0:
-        return False
-    if new_user_id == ref_user_id:
-        return False
-
-    async with USER_STORE_LOCK:
-        store = await asyncio.to_thread(_load_user_store_sync)
-
-        new_key = str(new_user_id)
-        new_rec = store.get(new_key)
-        if not isinstance(new_rec, dict):
-            new_rec = {}
-        if new_rec.get("referred_by"):
-            return False
-
-        new_rec["referred_by"] = str(ref_user_id)
-        store[new_key] = new_rec
-
-        ref_key = str(ref_user_id)
-        ref_rec = store.get(ref_key)
-        if not isinstance(ref_rec, dict):
-            ref_rec = {}
-        ref_count = ref_rec.get("ref_count")
-        ref_count = int(ref_count) if isinstance(ref_count, (int, float)) else 0
-        ref_rec["ref_count"] = ref_count + 1
-        ref_credits = _get_credits(ref_rec)
-        ref_rec["credits"] = ref_credits + 5
-        store[ref_key] = ref_rec
-
-        new_credits = _get_credits(new_rec)
-        new_rec["credits"] = new_credits + 2
-        store[new_key] = new_rec
-
-        await asyncio.to_thread(_save_user_store_sync, store)
-        return True
-
-
-class _YtDlpLogger:
-    def debug(self, msg):
-        logger.debug("yt-dlp: %s", msg)
-
-    def info(self, msg):
-        logger.debug("yt-dlp: %s", msg)
-
-    def warning(self, msg):
-        logger.debug("yt-dlp: %s", msg)
-
-    def error(self, msg):
-        logger.error("yt-dlp: %s", msg)
-
-
-COMMON_YDL_OPTS = {
-    "quiet": True,
-    "no_warnings": True,
-    "noprogress": True,
-    "logger": _YtDlpLogger(),
-    "ffmpeg_location": os.getenv("YTDLP_FFMPEG_LOCATION")
-    or imageio_ffmpeg.get_ffmpeg_exe(),
-    "http_headers": {
-        "User-Agent": os.getenv(
-            "YTDLP_USER_AGENT",
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0 Safari/537.36",
-        ),
-        "Accept-Language": os.getenv("YTDLP_ACCEPT_LANGUAGE", "en-US,en;q=0.9,fr;q=0.8"),
-    },
-}
-
-_cookiefile = _get_ytdlp_cookiefile()
-if _cookiefile:
-    COMMON_YDL_OPTS["cookiefile"] = _cookiefile
-    logger.info("yt-dlp cookies: enabled")
-else:
-    logger.info("yt-dlp cookies: not configured")
-
-
-def _is_youtube_antibot_error(error_text: str) -> bool:
-    if not isinstance(error_text, str) or not error_text:
-        return False
-    s = error_text.lower()
-    return (
-        "sign in to confirm" in s
-        or "confirm you’re not a bot" in s
-        or "confirm you're not a bot" in s
-    )
-
-
-def _youtube_antibot_user_message(lang: str) -> str:
-    if lang == "fr":
-        return (
-            "⚠️ YouTube bloque ce serveur (vérification anti-bot).\n\n"
-            "✅ TikTok/Instagram/Facebook/etc. marchent souvent.\n"
-            "❌ Pour YouTube, si tu es l’admin: ajoute des cookies YouTube sur Koyeb "
-            "(variable `YTDLP_COOKIES`, format cookies.txt)."
-        )
-    return (
-        "⚠️ YouTube is blocking this server (anti-bot verification).\n\n"
-        "✅ TikTok/Instagram/Facebook/etc. often work.\n"
-        "❌ For YouTube, if you are the admin: add YouTube cookies on Koyeb "
-        "(env var `YTDLP_COOKIES`, cookies.txt format)."
-    )
-
-
-def get_user_lang(update: Update) -> str:
-    """Retourne 'fr' si l'utilisateur est en français, sinon 'en'."""
-    language_code = None
-    if update.effective_user is not None:
-        language_code = update.effective_user.language_code
-    if language_code and language_code.lower().startswith("fr"):
-        return "fr"
-    return "en"
-
-
-def get_message(key: str, lang: str) -> str:
-    messages = {
-        "start": {
-            "fr": (
-                "🚀 Téléchargeur vidéo & audio\n\n"
-                "🔗 Colle un lien et je m'occupe du reste.\n\n"
-                "🧪 Exemple : https://www.youtube.com/watch?v=abc123"
-            ),
-            "en": (
-                "🚀 Video & audio downloader\n\n"
-                "🔗 Paste a link and I do the rest.\n\n"
-                "🧪 Example: https://www.youtube.com/watch?v=abc123"
-            ),
-        },
-        "help": {
-            "fr": (
-                "ℹ️ Aide\n\n"
-                "✅ Comment télécharger :\n"
-                "1) 🔗 Envoie un lien\n"
-                "2) 🎬 Vidéo / 🎧 Audio (ou ✨ Effets)\n"
-                "3) ⚡ Choisis la qualité (HD/SD)\n"
-                "4) 🌍 Langue audio (si dispo)\n"
-                "5) 📩 Je t'envoie le fichier\n\n"
-                "🆕 Nouvelles fonctionnalités :\n"
-                "- 📶 Progression en direct (%, taille, vitesse, ETA)\n"
-                "- 🌍 Langue audio (🎧 Original / 🇫🇷 FR / 🇬🇧 EN, selon la vidéo)\n"
-                "- ⚡ TikTok rapide: certaines vidéos peuvent partir quasi instant\n"
-                "- ✨ Effets: copie le look (couleurs/contraste/saturation) d'une vidéo\n\n"
-                "📦 Limite : ~50 Mo par fichier."
-            ),
-            "en": (
-                "ℹ️ Help\n\n"
-                "✅ How to download:\n"
-                "1) 🔗 Send a link\n"
-                "2) 🎬 Video / 🎧 Audio (or ✨ Effects)\n"
-                "3) ⚡ Pick quality (HD/SD)\n"
-                "4) 🌍 Pick audio language (if available)\n"
-                "5) 📩 I send you the file\n\n"
-                "🆕 New features:\n"
-                "- 📶 Live progress (%, size, speed, ETA)\n"
-                "- 🌍 Audio language (🎧 Original / 🇫🇷 FR / 🇬🇧 EN, depends on the video)\n"
-                "- ⚡ Fast TikTok: some videos can be sent almost instantly\n"
-                "- ✨ Effects: copy the look (colors/contrast/saturation) from a reference\n\n"
-                "📦 Limit: ~50 MB per file."
-            ),
-        },
-        "menu": {
-            "fr": "🏠 Menu principal :",
-            "en": "🏠 Main menu:",
-        },
-        "supported_sites": {
-            "fr": "🌐 Sites supportés : YouTube, X/Twitter, Instagram, Facebook, TikTok.",
-            "en": "🌐 Supported sites: YouTube, X/Twitter, Instagram, Facebook, TikTok.",
-        },
-        "prompt_send_link": {
-            "fr": "🔗 Envoie un lien pour commencer.",
-            "en": "🔗 Send a link to get started.",
-        },
-        "share_cta": {
-            "fr": "🤝 Si ce bot t'aide, partage-le à un ami :",
-            "en": "🤝 If this bot helps you, share it with a friend:",
-        },
-        "share_button": {
-            "fr": "🚀 Partager le bot",
-            "en": "🚀 Share the bot",
-        },
-        "menu_button": {
-            "fr": "🏠 Menu",
-            "en": "🏠 Menu",
-        },
-        "help_button": {
-            "fr": "ℹ️ Aide",
-            "en": "ℹ️ Help",
-        },
-        "sites_button": {
-            "fr": "🌐 Sites",
-            "en": "🌐 Sites",
-        },
-        "premium_button": {
-            "fr": "⭐ Premium",
-            "en": "⭐ Premium",
-        },
-        "premium_menu_title": {
-            "fr": "⭐ Premium & Crédits",
-            "en": "⭐ Premium & Credits",
-        },
-        "premium_buy_month": {
-            "fr": "⭐ Premium 30j",
-            "en": "⭐ Premium 30d",
-        },
-        "premium_buy_credits10": {
-            "fr": "🎟️ 10 crédits",
-            "en": "🎟️ 10 credits",
-        },
-        "premium_buy_credits50": {
-            "fr": "🎟️ 50 crédits",
-            "en": "🎟️ 50 credits",
-        },
-        "premium_my_ref": {
-            "fr": "🎁 Mon lien parrainage",
-            "en": "🎁 My referral link",
-        },
-        "premium_need_more": {
-            "fr": "🔒 Cette option est Premium (ou nécessite des crédits).",
-            "en": "🔒 This option is Premium (or requires credits).",
-        },
-        "referral_bonus": {
-            "fr": "🎁 Parrainage activé ! Tu gagnes +2 crédits et ton ami +5 crédits.",
-            "en": "🎁 Referral activated! You get +2 credits and your friend gets +5 credits.",
-        },
-        "ad_text": {
-            "fr": (
-                "📢 Sponsorisé\n"
-                "⭐ Passe en Premium pour enlever les pubs + débloquer ✨ Effets illimités."
-            ),
-            "en": (
-                "📢 Sponsored\n"
-                "⭐ Go Premium to remove ads + unlock unlimited ✨ Effects."
-            ),
-        },
-        "retry_button": {
-            "fr": "🔁 Réessayer",
-            "en": "🔁 Retry",
-        },
-        "try_sd_button": {
-            "fr": "⚡ Passer en SD",
-            "en": "⚡ Try SD",
-        },
-        "try_hd_button": {
-            "fr": "✨ Passer en HD",
-            "en": "✨ Try HD",
-        },
-        "choose_audio_lang": {
-            "fr": "🌍 Choisis la langue de l'audio :",
-            "en": "🌍 Choose the audio language:",
-        },
-        "audio_lang_orig": {
-            "fr": "🎧 Original",
-            "en": "🎧 Original",
-        },
-        "audio_lang_fr": {
-            "fr": "🇫🇷 Français",
-            "en": "🇫🇷 French",
-        },
-        "audio_lang_en": {
-            "fr": "🇬🇧 Anglais",
-            "en": "🇬🇧 English",
-        },
-        "audio_lang_unavailable": {
-            "fr": "⚠️ Audio {wanted} indisponible pour cette vidéo. Je garde l'audio 🎧 original.",
-            "en": "⚠️ {wanted} audio not available for this video. Keeping 🎧 original audio.",
-        },
-        "error_try_again": {
-            "fr": "❌ Oups, ça n'a pas marché. Tu peux réessayer.",
-            "en": "❌ Something went wrong. You can try again.",
-        },
-        "invalid_url": {
-            "fr": (
-                "⚠️ Envoie un lien valide (URL commençant par http/https). "
-                "Utilise /help si besoin."
-            ),
-            "en": (
-                "⚠️ Please send a valid link (URL starting with http/https). "
-                "Use /help if needed."
-            ),
-        },
-        "processing": {
-            "fr": "⏳ Téléchargement en cours…",
-            "en": "⏳ Downloading…",
-        },
-        "too_big": {
-            "fr": (
-                "📦 Vidéo trop grande ({size_mb:.1f} Mo). Essaie une vidéo plus "
-                "courte ou de plus basse qualité."
-            ),
-            "en": (
-                "📦 Video is too large ({size_mb:.1f} MB). Try a shorter or "
-                "lower-quality video."
-            ),
-        },
-        "cleaned": {
-            "fr": "🧹 Fichier supprimé de mon côté pour économiser de l'espace.",
-            "en": "🧹 File removed on my side to save space.",
-        },
-        "choose_type": {
-            "fr": "🎛️ Choisis un format :",
-            "en": "🎛️ Choose a format:",
-        },
-        "effects_button": {
-            "fr": "✨ Effets",
-            "en": "✨ Effects",
-        },
-        "effects_intro": {
-            "fr": "✨ Effets Visuels\n\nChoisis ton mode :",
-            "en": "✨ Visual Effects\n\nChoose your mode:",
-        },
-        "effects_mode_preset": {
-            "fr": "🎨 Galerie d'effets",
-            "en": "🎨 Effects Gallery",
-        },
-        "effects_mode_steal": {
-            "fr": "🔥 Voler le style d'une vidéo",
-            "en": "🔥 Steal video style",
-        },
-        "effects_choose_preset": {
-            "fr": "🎨 Choisis ton effet :",
-            "en": "🎨 Choose your effect:",
-        },
-        "effects_preset_selected": {
-            "fr": "✅ Effet sélectionné : {effect_name}\n{effect_desc}\n\n📹 Envoie maintenant ta vidéo pour appliquer l'effet.",
-            "en": "✅ Effect selected: {effect_name}\n{effect_desc}\n\n📹 Now send your video to apply the effect.",
-        },
-        "effects_steal_intro": {
-            "fr": "🔥 Mode Vol de Style\n\nEnvoie le lien d'une vidéo dont tu veux copier le look (couleurs, ambiance, contraste).",
-            "en": "🔥 Style Stealing Mode\n\nSend the link of a video whose look you want to copy (colors, mood, contrast).",
-        },
-        "effects_need_ref": {
-            "fr": "❌ Erreur : impossible de charger la vidéo de référence.",
-            "en": "❌ Error: unable to load reference video.",
-        },
-        "effects_ready": {
-            "fr": "✅ Style capturé ! Envoie maintenant ta vidéo pour appliquer l'effet.",
-            "en": "✅ Style captured! Now send your video to apply the effect.",
-        },
-        "effects_processing": {
-            "fr": "⚙️ Application de l'effet en cours…",
-            "en": "⚙️ Applying effect…",
-        },
-        "effects_done": {
-            "fr": "✨ Effet appliqué avec succès !",
-            "en": "✨ Effect applied successfully!",
-        },
-        "photo_disabled": {
-            "fr": "🚫 Le téléchargement de photos est désactivé sur ce bot.",
-            "en": "🚫 Photo downloading is disabled on this bot.",
-        },
-        "choose_quality": {
-            "fr": "🎚️ Choisis la qualité de la vidéo :",
-            "en": "🎚️ Choose the video quality:",
-        },
-        "no_photo": {
-            "fr": (
-                "🖼️ Aucune photo téléchargeable n'a été trouvée pour ce lien. "
-                "(Ex: post uniquement vidéo ou contenu non supporté.)"
-            ),
-            "en": (
-                "🖼️ No downloadable photo was found for this link. "
-                "(E.g. video-only post or unsupported content.)"
-            ),
-        },
-        "no_video": {
-            "fr": (
-                "🎬 Aucune vidéo téléchargeable n'a été trouvée pour ce lien. "
-                "(Ex: tweet sans vidéo ou contenu non supporté.)"
-            ),
-            "en": (
-                "🎬 No downloadable video was found for this link. "
-                "(E.g. tweet without video or unsupported content.)"
-            ),
-        },
-        "no_url_saved": {
-            "fr": (
-                "🔗 Je n'ai pas de lien enregistré. Envoie-moi d'abord un lien "
-                "vidéo."
-            ),
-            "en": (
-                "🔗 I don't have any link saved. Please send me a video link "
-                "first."
-            ),
-        },
-        "error": {
-            "fr": (
-                "❌ Erreur : {error}\nVérifie le lien ou réessaie. Sites "
-                "supportés : YouTube, Twitter, Instagram, Facebook."
-            ),
-            "en": (
-                "❌ Error: {error}\nCheck the link or try again. Supported "
-                "sites: YouTube, Twitter, Instagram, Facebook."
-            ),
-        },
-    }
-    return messages[key][lang]
-
-
-def _get_bot_link() -> str | None:
-    if not BOT_USERNAME:
-        return None
-    uname = BOT_USERNAME.strip()
-    if uname.startswith("@"):
-        uname = uname[1:]
-    if not uname:
-        return None
-    return f"https://t.me/{uname}"
-
-
-def _maybe_set_bot_username(username: str | None) -> None:
-    global BOT_USERNAME
-    if BOT_USERNAME:
-        return
-    if not username or not isinstance(username, str):
-        return
-    uname = username.strip()
-    if uname.startswith("@"):
-        uname = uname[1:]
-    if not uname:
-        return
-    BOT_USERNAME = uname
-
-
-def _get_share_url(lang: str) -> str | None:
-    bot_link = _get_bot_link()
-    if not bot_link:
-        return None
-    share_text = (
-        "Télécharge tes vidéos facilement ici" if lang == "fr" else "Download videos easily here"
-    )
-    return "https://t.me/share/url?" + urlencode({"url": bot_link, "text": share_text})
-
-
-def _ad_keyboard(lang: str) -> InlineKeyboardMarkup:
-    share_url = _get_share_url(lang)
-    row: list[InlineKeyboardButton] = [
-        InlineKeyboardButton(get_message("premium_button", lang), callback_data="menu_premium")
-    ]
-    if share_url:
-        row.append(InlineKeyboardButton(get_message("share_button", lang), url=share_url))
-    return InlineKeyboardMarkup([row])
-
-
-async def _maybe_send_ad_after_success(message, lang: str) -> None:
-    chat = getattr(message, "chat", None)
-    user_id = None
-    if chat and getattr(chat, "type", None) == "private":
-        user_id = getattr(chat, "id", None)
-    if not isinstance(user_id, int) or user_id <= 0:
-        return
-
-    rec = await _get_user_record(user_id)
-    if _is_premium_now(rec):
-        return
-
-    should = await _bump_success_and_should_show_ad(user_id)
-    if not should:
-        return
-
-    try:
-        await message.reply_text(
-            get_message("ad_text", lang),
-            reply_markup=_ad_keyboard(lang),
-            disable_web_page_preview=True,
-        )
-    except (BadRequest, TimedOut, NetworkError):
-        pass
-
-
-def _main_menu_keyboard(lang: str) -> InlineKeyboardMarkup:
-    share_url = _get_share_url(lang)
-    buttons = [
-        [
-            InlineKeyboardButton(get_message("help_button", lang), callback_data="menu_help"),
-            InlineKeyboardButton(get_message("sites_button", lang), callback_data="menu_sites"),
-        ]
-    ]
-    buttons.append(
-        [InlineKeyboardButton(get_message("premium_button", lang), callback_data="menu_premium")]
-    )
-    if share_url:
-        buttons.append(
-            [
-                InlineKeyboardButton(get_message("share_button", lang), url=share_url),
-                InlineKeyboardButton(get_message("menu_button", lang), callback_data="menu_main"),
-            ]
-        )
-    else:
-        buttons.append(
-            [InlineKeyboardButton(get_message("menu_button", lang), callback_data="menu_main")]
-        )
-    return InlineKeyboardMarkup(buttons)
-
-
-def _action_keyboard(lang: str, action: str, quality: str | None) -> InlineKeyboardMarkup:
-    buttons: list[list[InlineKeyboardButton]] = []
-    if action == "video":
-        retry_data = f"retry_video_{quality or 'hd'}"
-        row: list[InlineKeyboardButton] = [
-            InlineKeyboardButton(get_message("retry_button", lang), callback_data=retry_data)
-        ]
-        if quality == "hd":
-            row.append(
-                InlineKeyboardButton(get_message("try_sd_button", lang), callback_data="retry_video_sd")
-            )
-        elif quality == "sd":
-            row.append(
-                InlineKeyboardButton(get_message("try_hd_button", lang), callback_data="retry_video_hd")
-            )
-        buttons.append(row)
-    elif action == "audio":
-        buttons.append(
-            [InlineKeyboardButton(get_message("retry_button", lang), callback_data="retry_audio")]
-        )
-    buttons.append(
-        [InlineKeyboardButton(get_message("menu_button", lang), callback_data="menu_main")]
-    )
-    return InlineKeyboardMarkup(buttons)
-
-
-async def _maybe_send_share_prompt(message, lang: str) -> None:
-    chat_id = getattr(message, "chat_id", None)
-    if not isinstance(chat_id, int):
-        return
-    if chat_id in SHARE_PROMPTED_CHATS:
-        return
-    keyboard = _main_menu_keyboard(lang)
-    if not _get_bot_link():
-        return
-    await message.reply_text(
-        get_message("share_cta", lang),
-        reply_markup=keyboard,
-        disable_web_page_preview=True,
-    )
-    SHARE_PROMPTED_CHATS.add(chat_id)
-
-
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-    lang = get_user_lang(update)
-    msg = update.message or update.effective_message
-    if not msg:
-        return
-    args = getattr(context, "args", None)
-    if isinstance(args, list) and args:
-        arg0 = args[0]
-        if isinstance(arg0, str) and arg0.startswith("ref_"):
-            ref_part = arg0[4:]
-            try:
-                ref_id = int(ref_part)
-            except Exception:
-                ref_id = 0
-            if ref_id > 0 and update.effective_user:
-                ok = await _apply_referral(update.effective_user.id, ref_id)
-                if ok:
-                    await msg.reply_text(get_message("referral_bonus", lang))
-    await msg.reply_text(
-        get_message("start", lang),
-        reply_markup=_main_menu_keyboard(lang),
-        disable_web_page_preview=True,
-    )
-
-
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-    lang = get_user_lang(update)
-    msg = update.message or update.effective_message
-    if not msg:
-        return
-    await msg.reply_text(
-        get_message("help", lang),
-        reply_markup=_main_menu_keyboard(lang),
-        disable_web_page_preview=True,
-    )
-
-
-async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-    lang = get_user_lang(update)
-    msg = update.message or update.effective_message
-    if not msg:
-        return
-    await msg.reply_text(
-        get_message("menu", lang),
-        reply_markup=_main_menu_keyboard(lang),
-        disable_web_page_preview=True,
-    )
-
-
-async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    if not query:
-        return
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-    try:
-        await query.answer()
-    except (BadRequest, NetworkError, TimedOut):
-        pass
-    lang = get_user_lang(update)
-    data = query.data or ""
-    if data == "menu_main":
-        await query.message.reply_text(
-            get_message("menu", lang),
-            reply_markup=_main_menu_keyboard(lang),
-            disable_web_page_preview=True,
-        )
-        return
-    if data == "menu_help":
-        await query.message.reply_text(
-            get_message("help", lang),
-            reply_markup=_main_menu_keyboard(lang),
-            disable_web_page_preview=True,
-        )
-    elif data == "menu_sites":
-        await query.message.reply_text(
-            get_message("supported_sites", lang),
-            reply_markup=_main_menu_keyboard(lang),
-            disable_web_page_preview=True,
-        )
-    elif data == "menu_premium":
-        await _send_premium_menu(query.message, update, lang)
-
-
-def is_http_url(text: str) -> bool:
-    return text.startswith("http://") or text.startswith("https://")
-
-
-def extract_first_url(text: str) -> str | None:
-    match = re.search(r"https?://\S+", text)
-    if not match:
-        return None
-    url = match.group(0)
-    return url.rstrip(".,;:!?)]}")
-
-
-def normalize_url(url: str) -> str:
-    try:
-        parsed = urlparse(url)
-        host = parsed.netloc.lower()
-        path = parsed.path
-
-        if ("x.com" in host or "twitter.com" in host) and "/status/" in path:
-            return f"{parsed.scheme}://{parsed.netloc}{path}"
-
-        if "tiktok.com" in host and ("/photo/" in path or "/video/" in path):
-            return f"{parsed.scheme}://{parsed.netloc}{path}"
-    except Exception:  # pylint: disable=broad-except
-        return url
-
-    return url
-
-
-_TIKTOK_VIDEO_ID_RE = re.compile(r"/video/(\d+)")
-
-
-def _tiktok_video_id_from_url(url: str) -> str | None:
-    try:
-        path = urlparse(url).path
-    except Exception:  # pylint: disable=broad-except
-        return None
-    m = _TIKTOK_VIDEO_ID_RE.search(path)
-    if not m:
-        return None
-    return m.group(1)
-
-
-def _cache_tiktok_file_id(video_id: str, file_id: str) -> None:
-    if not video_id or not file_id:
-        return
-    if video_id in TIKTOK_FILE_ID_CACHE:
-        TIKTOK_FILE_ID_CACHE.pop(video_id, None)
-    TIKTOK_FILE_ID_CACHE[video_id] = file_id
-    if len(TIKTOK_FILE_ID_CACHE) > TIKTOK_FILE_ID_CACHE_MAX:
-        oldest = next(iter(TIKTOK_FILE_ID_CACHE))
-        TIKTOK_FILE_ID_CACHE.pop(oldest, None)
-
-
-def _ffmpeg_exe() -> str:
-    return imageio_ffmpeg.get_ffmpeg_exe()
-
-
-def _clamp(val: float, lo: float, hi: float) -> float:
-    if val < lo:
-        return lo
-    if val > hi:
-        return hi
-    return val
-
-
-def _extract_video_style(video_path: str) -> dict[str, float]:
-    """Extraction avancée du style visuel: couleurs, contraste, saturation, température, vignette."""
-    exe = _ffmpeg_exe()
-    vf = "select='not(mod(n,50))',signalstats,metadata=print:file=-"
-    cmd = [
-        exe,
-        "-hide_banner",
-        "-i",
-        video_path,
-        "-vf",
-        vf,
-        "-an",
-        "-f",
-        "null",
-        "-",
-    ]
-    p = subprocess.run(cmd, capture_output=True, text=True, check=False)
-    out = (p.stdout or "") + "\n" + (p.stderr or "")
-
-    values: dict[str, list[float]] = {}
-    for m in re.finditer(r"lavfi\.signalstats\.([A-Z]+)=([0-9.]+)", out):
-        k = m.group(1)
-        v = float(m.group(2))
-        values.setdefault(k, []).append(v)
-
-    def _avg(key: str) -> float:
-        arr = values.get(key) or []
-        if not arr:
-            return 0.0
-        return sum(arr) / float(len(arr))
-
-    yavg = _avg("YAVG")
-    ylow = _avg("YLOW")
-    yhigh = _avg("YHIGH")
-    uavg = _avg("UAVG")
-    vavg = _avg("VAVG")
-    ulow = _avg("ULOW")
-    uhigh = _avg("UHIGH")
-    vlow = _avg("VLOW")
-    vhigh = _avg("VHIGH")
-
-    temp = (vavg - 128.0) / 128.0
-    tint = (uavg - 128.0) / 128.0
-
-    return {
-        "yavg": yavg,
-        "yrange": max(1.0, yhigh - ylow),
-        "crange": max(1.0, ((uhigh - ulow) + (vhigh - vlow)) / 2.0),
-        "temp": temp,
-        "tint": tint,
-        "uavg": uavg,
-        "vavg": vavg,
-    }
-
-
-def _extract_signalstats(video_path: str) -> dict[str, float]:
-    return _extract_video_style(video_path)
-
-
-def _compute_eq_params(src: dict[str, float], ref: dict[str, float]) -> tuple[float, float, float]:
-    b = (ref.get("yavg", 0.0) - src.get("yavg", 0.0)) / 255.0
-    b = _clamp(b, -0.35, 0.35)
-
-    c = ref.get("yrange", 1.0) / max(1.0, src.get("yrange", 1.0))
-    c = _clamp(c, 0.7, 1.6)
-
-    s = ref.get("crange", 1.0) / max(1.0, src.get("crange", 1.0))
-    s = _clamp(s, 0.6, 1.8)
-
-    return b, c, s
-
-
-PRESET_EFFECTS = {
-    "cinematic": {
-        "name_fr": "🎬 Cinématique",
-        "name_en": "🎬 Cinematic",
-        "desc_fr": "Teal & Orange, look film",
-        "desc_en": "Teal & Orange, film look",
-        "filters": [
-            "eq=contrast=1.15:saturation=0.9:brightness=-0.02",
-            "colorbalance=rs=0.1:gs=-0.05:bs=-0.15:rm=0.05:bm=-0.1:rh=-0.05:gh=0.02:bh=0.08",
-            "unsharp=5:5:0.8:3:3:0.4",
-        ],
-    },
-    "vintage": {
-        "name_fr": "📼 Vintage",
-        "name_en": "📼 Vintage",
-        "desc_fr": "Rétro années 70",
-        "desc_en": "Retro 70s style",
-        "filters": [
-            "eq=contrast=1.2:saturation=0.7:brightness=0.05:gamma=1.1",
-            "colorbalance=rs=0.15:gs=0.05:bs=-0.1:rm=0.1:bm=-0.05",
-        ],
-    },
-    "neon": {
-        "name_fr": "💎 Néon",
-        "name_en": "💎 Neon",
-        "desc_fr": "Cyberpunk, couleurs explosives",
-        "desc_en": "Cyberpunk, explosive colors",
-        "filters": [
-            "eq=contrast=1.3:saturation=1.8:brightness=-0.08",
-            "colorbalance=rm=0.15:bm=0.2:bs=0.15",
-            "unsharp=7:7:1.2:5:5:0.0",
-        ],
-    },
-    "bw_contrast": {
-        "name_fr": "⬛ N&B Contrasté",
-        "name_en": "⬛ High Contrast B&W",
-        "desc_fr": "Noir & blanc dramatique",
-        "desc_en": "Dramatic black & white",
-        "filters": [
-            "hue=s=0",
-            "eq=contrast=1.4:brightness=-0.03:gamma=0.9",
-        ],
-    },
-    "warm_sunset": {
-        "name_fr": "🌅 Coucher de soleil",
-        "name_en": "🌅 Warm Sunset",
-        "desc_fr": "Ambiance chaude dorée",
-        "desc_en": "Warm golden vibe",
-        "filters": [
-            "eq=contrast=1.1:saturation=1.25:brightness=0.03",
-            "colorbalance=rs=0.2:gs=0.05:bs=-0.15:rm=0.15:gm=0.02:bm=-0.1",
-        ],
-    },
-    "cool_blue": {
-        "name_fr": "❄️ Bleu Glacé",
-        "name_en": "❄️ Icy Blue",
-        "desc_fr": "Ambiance froide bleue",
-        "desc_en": "Cool blue mood",
-        "filters": [
-            "eq=contrast=1.15:saturation=0.85:brightness=-0.02",
-            "colorbalance=rs=-0.15:bs=0.2:rm=-0.1:bm=0.15:rh=-0.05:bh=0.1",
-        ],
-    },
-    "vibrant": {
-        "name_fr": "🌈 Vibrant",
-        "name_en": "🌈 Vibrant",
-        "desc_fr": "Couleurs éclatantes",
-        "desc_en": "Vivid colors boost",
-        "filters": [
-            "eq=contrast=1.2:saturation=1.5:brightness=0.02",
-            "unsharp=5:5:1.0:3:3:0.0",
-        ],
-    },
-    "soft_dream": {
-        "name_fr": "☁️ Doux Rêveur",
-        "name_en": "☁️ Soft Dream",
-        "desc_fr": "Look doux et aérien",
-        "desc_en": "Soft and dreamy look",
-        "filters": [
-            "eq=contrast=0.9:saturation=0.8:brightness=0.05:gamma=1.15",
-            "colorbalance=rs=0.05:gs=0.03:rm=0.03",
-        ],
-    },
-}
-
-
-def _apply_preset_effect(in_path: str, out_path: str, preset: str) -> None:
-    """Applique un effet prédéfini avec filtres ffmpeg avancés."""
-    exe = _ffmpeg_exe()
-    effect = PRESET_EFFECTS.get(preset)
-    if not effect:
-        raise ValueError(f"Unknown preset: {preset}")
-
-    vf = ",".join(effect["filters"])
-    cmd = [
-        exe,
-        "-hide_banner",
-        "-y",
-        "-i",
-        in_path,
-        "-map",
-        "0:v:0",
-        "-map",
-        "0:a?",
-        "-vf",
-        vf,
-        "-c:v",
-        "libx264",
-        "-preset",
-        "veryfast",
-        "-crf",
-        "23",
-        "-c:a",
-        "aac",
-        "-b:a",
-        "128k",
-        "-movflags",
-        "+faststart",
-        out_path,
-    ]
-    subprocess.run(cmd, capture_output=True, text=True, check=True)
-
-
-def _apply_stolen_style(
-    in_path: str, out_path: str, src_style: dict[str, float], ref_style: dict[str, float]
-) -> None:
-    """Applique le style 'volé' d'une vidéo de référence avec color grading avancé."""
-    exe = _ffmpeg_exe()
-
-    b = (ref_style.get("yavg", 0.0) - src_style.get("yavg", 0.0)) / 255.0
-    b = _clamp(b, -0.35, 0.35)
-
-    c = ref_style.get("yrange", 1.0) / max(1.0, src_style.get("yrange", 1.0))
-    c = _clamp(c, 0.7, 1.6)
-
-    s = ref_style.get("crange", 1.0) / max(1.0, src_style.get("crange", 1.0))
-    s = _clamp(s, 0.6, 1.8)
-
-    temp_shift = ref_style.get("temp", 0.0) - src_style.get("temp", 0.0)
-    temp_shift = _clamp(temp_shift, -0.3, 0.3)
-
-    tint_shift = ref_style.get("tint", 0.0) - src_style.get("tint", 0.0)
-    tint_shift = _clamp(tint_shift, -0.3, 0.3)
-
-    rs = temp_shift * 0.4
-    bs = -temp_shift * 0.4
-    gs = tint_shift * 0.3
-
-    filters = [
-        f"eq=brightness={b:.4f}:contrast={c:.4f}:saturation={s:.4f}",
-        f"colorbalance=rs={rs:.3f}:gs={gs:.3f}:bs={bs:.3f}",
-    ]
-
-    vf = ",".join(filters)
-    cmd = [
-        exe,
-        "-hide_banner",
-        "-y",
-        "-i",
-        in_path,
-        "-map",
-        "0:v:0",
-        "-map",
-        "0:a?",
-        "-vf",
-        vf,
-        "-c:v",
-        "libx264",
-        "-preset",
-        "veryfast",
-        "-crf",
-        "23",
-        "-c:a",
-        "aac",
-        "-b:a",
-        "128k",
-        "-movflags",
-        "+faststart",
-        out_path,
-    ]
-    subprocess.run(cmd, capture_output=True, text=True, check=True)
-
-
-def _apply_eq_filter(in_path: str, out_path: str, brightness: float, contrast: float, saturation: float) -> None:
-    exe = _ffmpeg_exe()
-    vf = f"eq=brightness={brightness:.4f}:contrast={contrast:.4f}:saturation={saturation:.4f}"
-    cmd = [
-        exe,
-        "-hide_banner",
-        "-y",
-        "-i",
-        in_path,
-        "-map",
-        "0:v:0",
-        "-map",
-        "0:a?",
-        "-vf",
-        vf,
-        "-c:v",
-        "libx264",
-        "-preset",
-        "veryfast",
-        "-crf",
-        "23",
-        "-c:a",
-        "aac",
-        "-b:a",
-        "128k",
-        "-movflags",
-        "+faststart",
-        out_path,
-    ]
-    subprocess.run(cmd, capture_output=True, text=True, check=True)
-
-
-async def _download_telegram_video_to_file(
-    update: Update, context: ContextTypes.DEFAULT_TYPE, out_path: str
-) -> bool:
-    msg = update.message
-    if not msg:
-        return False
-
-    file_id = None
-    if msg.video:
-        file_id = msg.video.file_id
-    elif msg.document and msg.document.mime_type and msg.document.mime_type.startswith("video/"):
-        file_id = msg.document.file_id
-
-    if not file_id:
-        return False
-
-    tg_file = await context.bot.get_file(file_id)
-    await tg_file.download_to_drive(custom_path=out_path)
-    return os.path.exists(out_path)
-
-
-async def _download_reference_video_for_effects(
-    message,
-    url: str,
-    lang: str,
-) -> tuple[str | None, dict[str, float] | None]:
-    try:
-        parsed = urlparse(url)
-        host = parsed.netloc.lower()
-        if host.endswith("vm.tiktok.com") or host.endswith("vt.tiktok.com"):
-            resolved = await asyncio.to_thread(_resolve_final_url, url)
-            url = normalize_url(resolved)
-    except Exception:
-        pass
-
-    ydl_opts = {
-        **COMMON_YDL_OPTS,
-        "format": "bv*[height<=720]+ba/b[height<=720]/best[height<=720]/worst",
-        "outtmpl": str(DOWNLOAD_DIR / "effects_ref_%(id)s.%(ext)s"),
-        "noplaylist": True,
-        "merge_output_format": "mp4",
-        "socket_timeout": 60,
-        "retries": 3,
-        "fragment_retries": 3,
-        "extractor_retries": 3,
-    }
-
-    filename = None
-    progress_message = await message.reply_text(
-        "⬇️ Démarrage du téléchargement…" if lang == "fr" else "⬇️ Starting download…"
-    )
-    loop = asyncio.get_running_loop()
-    ydl_opts["progress_hooks"] = [
-        _make_progress_hook(loop, progress_message, lang, "video")
-    ]
-
-    def _download() -> str | None:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            fname = ydl.prepare_filename(info)
-            ydl.download([url])
-            return fname
-
-    try:
-        async with DOWNLOAD_SEMAPHORE:
-            filename = await asyncio.to_thread(_download)
-    except DownloadError as e:
-        error_text = str(e)
-        logger.info("Download error while fetching effects reference: %s", error_text)
-        try:
-            await progress_message.edit_text("❌ Erreur" if lang == "fr" else "❌ Error")
-        except Exception:
-            pass
-        if _is_youtube_antibot_error(error_text):
-            try:
-                await message.reply_text(_youtube_antibot_user_message(lang))
-            except Exception:
-                pass
-        return None, None
-    except Exception:
-        logger.exception("Unexpected error while fetching effects reference")
-        try:
-            await progress_message.edit_text("❌ Erreur" if lang == "fr" else "❌ Error")
-        except Exception:
-            pass
-        return None, None
-
-    if not filename or not os.path.exists(filename):
-        try:
-            await progress_message.edit_text("❌ Erreur" if lang == "fr" else "❌ Error")
-        except Exception:
-            pass
-        return None, None
-
-    try:
-        await progress_message.edit_text(
-            "🔎 Analyse de la vidéo…" if lang == "fr" else "🔎 Analyzing video…"
-        )
-    except Exception:
-        pass
-
-    async with FFMPEG_SEMAPHORE:
-        stats = await asyncio.to_thread(_extract_signalstats, filename)
-
-    try:
-        await progress_message.edit_text("✅ Terminé" if lang == "fr" else "✅ Done")
-    except Exception:
-        pass
-
-    return filename, stats
-
-
-def _format_bytes(num: int | float | None) -> str:
-    if not isinstance(num, (int, float)) or num <= 0:
-        return "?"
-    step = 1024.0
-    units = ["B", "KB", "MB", "GB", "TB"]
-    n = float(num)
-    u = 0
-    while n >= step and u < len(units) - 1:
-        n /= step
-        u += 1
-    if u == 0:
-        return f"{int(n)} {units[u]}"
-    return f"{n:.1f} {units[u]}"
-
-
-def _format_eta(seconds: int | float | None) -> str:
-    if not isinstance(seconds, (int, float)) or seconds <= 0:
-        return "?"
-    s = int(seconds)
-    m, s = divmod(s, 60)
-    h, m = divmod(m, 60)
-    if h:
-        return f"{h:d}h{m:02d}m"
-    if m:
-        return f"{m:d}m{s:02d}s"
-    return f"{s:d}s"
-
-
-def _make_progress_hook(loop, progress_message, lang: str, kind: str):
-    last = {"t": 0.0, "text": ""}
-
-    def _schedule(text: str) -> None:
-        if not text or text == last["text"]:
-            return
-        now = time.monotonic()
-        if now - last["t"] < 1.0:
-            return
-        last["t"] = now
-        last["text"] = text
-
-        try:
-            fut = asyncio.run_coroutine_threadsafe(
-                progress_message.edit_text(text), loop
-            )
-
-            def _done(f):
-                try:
-                    f.result()
-                except Exception:
-                    pass
-
-            fut.add_done_callback(_done)
-        except Exception:
-            return
-
-    def hook(d: dict) -> None:
-        status = d.get("status")
-        if status == "downloading":
-            downloaded = d.get("downloaded_bytes")
-            total = d.get("total_bytes")
-            if total is None:
-                total = d.get("total_bytes_estimate")
-            speed = d.get("speed")
-            eta = d.get("eta")
-
-            pct = None
-            if isinstance(downloaded, (int, float)) and isinstance(total, (int, float)) and total > 0:
-                pct = int((float(downloaded) / float(total)) * 100)
-            pct_txt = f"{pct}%" if pct is not None else "?%"
-
-            if lang == "fr":
-                title = "⬇️ Téléchargement vidéo…" if kind == "video" else "⬇️ Téléchargement audio…"
-                line1 = f"{pct_txt} • {_format_bytes(downloaded)} / {_format_bytes(total)}"
-                line2 = f"⚡ {_format_bytes(speed)}/s • ⏱️ {_format_eta(eta)}"
-            else:
-                title = "⬇️ Downloading video…" if kind == "video" else "⬇️ Downloading audio…"
-                line1 = f"{pct_txt} • {_format_bytes(downloaded)} / {_format_bytes(total)}"
-                line2 = f"⚡ {_format_bytes(speed)}/s • ⏱️ {_format_eta(eta)}"
-            _schedule("\n".join([title, line1, line2]))
-            return
-
-        if status == "finished":
-            text = (
-                "✅ Téléchargement terminé. 📦 Préparation…"
-                if lang == "fr"
-                else "✅ Download finished. 📦 Preparing…"
-            )
-            _schedule(text)
-
-    return hook
-
-
-def _extract_tiktok_direct_candidate(
-    url: str, quality: str
-) -> tuple[str | None, str | None, str | None]:
-    ydl_opts = {
-        **COMMON_YDL_OPTS,
-        "skip_download": True,
-        "noplaylist": True,
-    }
-
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(url, download=False)
-
-    if not isinstance(info, dict):
-        return None, None, None
-
-    title = info.get("title") if isinstance(info.get("title"), str) else None
-    video_id = info.get("id") if isinstance(info.get("id"), str) else None
-
-    formats = info.get("formats") or []
-    if not isinstance(formats, list):
-        formats = []
-
-    candidates: list[dict] = []
-    for f in formats:
-        if not isinstance(f, dict):
-            continue
-        u = f.get("url")
-        if not (isinstance(u, str) and u.startswith("http")):
-            continue
-        protocol = (f.get("protocol") or "").lower()
-        if "m3u8" in protocol:
-            continue
-        ext = (f.get("ext") or "").lower()
-        if ext and ext != "mp4":
-            continue
-        vcodec = f.get("vcodec")
-        if vcodec in (None, "none"):
-            continue
-        candidates.append(f)
-
-    def _score(fmt: dict) -> tuple[int, float]:
-        h = fmt.get("height")
-        height = h if isinstance(h, int) else 0
-        t = fmt.get("tbr")
-        tbr = float(t) if isinstance(t, (int, float)) else 0.0
-        return height, tbr
-
-    if quality == "sd":
-        filtered = [c for c in candidates if isinstance(c.get("height"), int) and c["height"] <= 720]
-        if filtered:
-            candidates = filtered
-
-    def _pick(require_audio: bool) -> str | None:
-        pool = candidates
-        if require_audio:
-            pool = [c for c in pool if c.get("acodec") not in (None, "none")]
-        if not pool:
-            return None
-        best = max(pool, key=_score)
-        u = best.get("url")
-        return u if isinstance(u, str) else None
-
-    direct_url = _pick(require_audio=True) or _pick(require_audio=False)
-    return direct_url, title, video_id
-
-
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    if not update.message:
-        return
-
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-
-    lang = get_user_lang(update)
-    raw_text = (update.message.text or update.message.caption or "").strip()
-
-    if context.user_data.get("effects_waiting_ref_url"):
-        url = extract_first_url(raw_text)
-        if not url:
-            await update.message.reply_text(get_message("effects_steal_intro", lang))
-            return
-
-        context.user_data.pop("effects_waiting_ref_url", None)
-
-        old_ref = context.user_data.get("effects_ref_file")
-        if isinstance(old_ref, str) and os.path.exists(old_ref):
-            _safe_remove(old_ref)
-
-        ref_file, ref_stats = await _download_reference_video_for_effects(update.message, url, lang)
-        if not ref_file or not ref_stats:
-            context.user_data.pop("effects_entitlement_kind", None)
-            context.user_data.pop("effects_mode", None)
-            await update.message.reply_text(get_message("error_try_again", lang))
-            return
-
-        context.user_data["effects_ref_file"] = ref_file
-        context.user_data["effects_ref_stats"] = ref_stats
-        context.user_data["effects_waiting_video"] = True
-        await update.message.reply_text(get_message("effects_ready", lang))
-        return
-
-    if context.user_data.get("effects_waiting_video"):
-        if extract_first_url(raw_text):
-            context.user_data.pop("effects_waiting_video", None)
-            context.user_data.pop("effects_ref_stats", None)
-            context.user_data.pop("effects_preset_id", None)
-            context.user_data.pop("effects_mode", None)
-            context.user_data.pop("effects_entitlement_kind", None)
-            old_ref = context.user_data.pop("effects_ref_file", None)
-            if isinstance(old_ref, str) and os.path.exists(old_ref):
-                _safe_remove(old_ref)
-
-        has_video = bool(update.message.video) or bool(
-            update.message.document
-            and update.message.document.mime_type
-            and update.message.document.mime_type.startswith("video/")
-        )
-        if not has_video:
-            preset_id = context.user_data.get("effects_preset_id")
-            if preset_id:
-                preset = PRESET_EFFECTS.get(preset_id)
-                if preset:
-                    effect_name = preset[f"name_{lang}"]
-                    effect_desc = preset[f"desc_{lang}"]
-                    await update.message.reply_text(
-                        get_message("effects_preset_selected", lang).format(
-                            effect_name=effect_name, effect_desc=effect_desc
-                        )
-                    )
-                    return
-            await update.message.reply_text(get_message("effects_ready", lang))
-            return
-
-        chat_id = update.effective_chat.id if update.effective_chat else 0
-        ts = int(time.time())
-        user_path = str(DOWNLOAD_DIR / f"effects_user_{chat_id}_{ts}.mp4")
-        out_path = str(DOWNLOAD_DIR / f"effects_out_{chat_id}_{ts}.mp4")
-
-        ok = False
-        try:
-            ok = await _download_telegram_video_to_file(update, context, user_path)
-        except Exception:
-            ok = False
-
-        if not ok:
-            await update.message.reply_text(get_message("error_try_again", lang))
-            return
-
-        progress = await update.message.reply_text(get_message("effects_processing", lang))
-
-        entitlement_kind = context.user_data.get("effects_entitlement_kind")
-        if not isinstance(entitlement_kind, str):
-            entitlement_kind = None
-        sent_ok = False
-
-        effects_mode = context.user_data.get("effects_mode")
-        preset_id = context.user_data.get("effects_preset_id")
-        ref_stats = context.user_data.get("effects_ref_stats")
-
-        try:
-            if effects_mode == "preset" and preset_id:
-                async with FFMPEG_SEMAPHORE:
-                    await asyncio.to_thread(_apply_preset_effect, user_path, out_path, preset_id)
-            elif effects_mode == "steal" and isinstance(ref_stats, dict):
-                async with FFMPEG_SEMAPHORE:
-                    src_stats = await asyncio.to_thread(_extract_video_style, user_path)
-                    await asyncio.to_thread(_apply_stolen_style, user_path, out_path, src_stats, ref_stats)
-            else:
-                context.user_data.pop("effects_waiting_video", None)
-                context.user_data.pop("effects_entitlement_kind", None)
-                await update.message.reply_text(get_message("error_try_again", lang))
-                return
-
-            if os.path.exists(out_path):
-                file_size = os.path.getsize(out_path)
-                if file_size > MAX_FILE_SIZE_BYTES:
-                    size_mb = file_size / (1024 * 1024)
-                    await update.message.reply_text(
-                        get_message("too_big", lang).format(size_mb=size_mb)
-                    )
-                    return
-
-                sent = False
-                for attempt in range(2):
-                    try:
-                        with open(out_path, "rb") as retry_file:
-                            try:
-                                await update.message.reply_video(
-                                    video=retry_file,
-                                    read_timeout=600.0,
-                                    write_timeout=600.0,
-                                )
-                            except TypeError:
-                                await update.message.reply_video(video=retry_file)
-                        sent = True
-                        break
-                    except TimedOut:
-                        if attempt == 0:
-                            await asyncio.sleep(2)
-                            continue
-                        sent = False
-
-                if not sent:
-                    with open(out_path, "rb") as doc_file:
-                        try:
-                            await update.message.reply_document(
-                                document=doc_file,
-                                read_timeout=600.0,
-                                write_timeout=600.0,
-                            )
-                        except TypeError:
-                            await update.message.reply_document(document=doc_file)
-                    sent = True
-                await update.message.reply_text(get_message("effects_done", lang))
-                sent_ok = True
-
-        except Exception:
-            logger.exception("Error while applying effects")
-            await update.message.reply_text(get_message("error_try_again", lang))
-        finally:
-            context.user_data.pop("effects_waiting_video", None)
-            context.user_data.pop("effects_mode", None)
-            context.user_data.pop("effects_preset_id", None)
-            context.user_data.pop("effects_entitlement_kind", None)
-            if sent_ok and update.effective_user:
-                try:
-                    await _finalize_effect_entitlement(update.effective_user.id, entitlement_kind)
-                except Exception:
-                    pass
-            for p in (user_path, out_path):
-                if p and os.path.exists(p):
-                    _safe_remove(p)
-            try:
-                await progress.edit_text("✅" if lang == "fr" else "✅")
-            except Exception:
-                pass
-        return
-
-    if not raw_text:
-        return
-
-    url = extract_first_url(raw_text)
-    if not url:
-        await update.message.reply_text(
-            get_message("prompt_send_link", lang),
-            reply_markup=_main_menu_keyboard(lang),
-            disable_web_page_preview=True,
-        )
-        return
-
-    url = normalize_url(url)
-
-    logger.info("Received URL: %s", url)
-
-    if not is_http_url(url):
-        await update.message.reply_text(get_message("invalid_url", lang))
-        return
-
-    # Sauvegarde le dernier lien et propose un choix Vidéo / Audio
-    context.user_data["last_url"] = url
-
-    buttons = [
-        [
-            InlineKeyboardButton("🎬 Vidéo", callback_data="type_video"),
-            InlineKeyboardButton("🎧 Audio", callback_data="type_audio"),
-        ]
-    ]
-    buttons.append(
-        [InlineKeyboardButton(get_message("effects_button", lang), callback_data="type_effects")]
-    )
-    share_url = _get_share_url(lang)
-    if share_url:
-        buttons.append(
-            [
-                InlineKeyboardButton(get_message("share_button", lang), url=share_url),
-                InlineKeyboardButton(get_message("menu_button", lang), callback_data="menu_main"),
-            ]
-        )
-    else:
-        buttons.append(
-            [InlineKeyboardButton(get_message("menu_button", lang), callback_data="menu_main")]
-        )
-    keyboard = InlineKeyboardMarkup(buttons)
-
-    await update.message.reply_text(
-        get_message("choose_type", lang),
-        reply_markup=keyboard,
-        disable_web_page_preview=True,
-    )
-
-
-async def process_url(message, url: str, lang: str, quality: str, audio_lang: str = "orig") -> None:
-    """Télécharge l'URL donnée avec la qualité choisie et envoie la vidéo."""
-
-    if not isinstance(audio_lang, str) or audio_lang not in ("orig", "fr", "en"):
-        audio_lang = "orig"
-
-    tiktok_video_id = None
-    try:
-        parsed = urlparse(url)
-        host = parsed.netloc.lower()
-        if host.endswith("vm.tiktok.com") or host.endswith("vt.tiktok.com"):
-            try:
-                resolved = await asyncio.to_thread(_resolve_final_url, url)
-                url = normalize_url(resolved)
-            except Exception:  # pylint: disable=broad-except
-                pass
-            parsed = urlparse(url)
-            host = parsed.netloc.lower()
-
-        if "tiktok.com" in host and "/video/" in parsed.path and audio_lang == "orig":
-            tiktok_video_id = _tiktok_video_id_from_url(url)
-            if tiktok_video_id:
-                cached = TIKTOK_FILE_ID_CACHE.get(tiktok_video_id)
-                if cached:
-                    try:
-                        sent = await message.reply_video(video=cached)
-                        video_obj = getattr(sent, "video", None)
-                        file_id = getattr(video_obj, "file_id", None) if video_obj else None
-                        if file_id:
-                            _cache_tiktok_file_id(tiktok_video_id, file_id)
-                        await _maybe_send_ad_after_success(message, lang)
-                        await _maybe_send_share_prompt(message, lang)
-                        return
-                    except (BadRequest, TimedOut, NetworkError):
-                        pass
-
-            direct_url = None
-            title_direct = None
-            vid_from_info = None
-            try:
-                async with DOWNLOAD_SEMAPHORE:
-                    direct_url, title_direct, vid_from_info = await asyncio.to_thread(
-                        _extract_tiktok_direct_candidate, url, quality
-                    )
-            except DownloadError as e:
-                logger.info("TikTok direct extract failed: %s", e)
-            except Exception as e:  # pylint: disable=broad-except
-                logger.debug("TikTok direct extract failed: %s", e)
-
-            if direct_url:
-                try:
-                    sent = await message.reply_video(
-                        video=direct_url,
-                        caption=title_direct or "",
-                    )
-                    vid_key = tiktok_video_id or vid_from_info
-                    video_obj = getattr(sent, "video", None)
-                    file_id = getattr(video_obj, "file_id", None) if video_obj else None
-                    if vid_key and file_id:
-                        _cache_tiktok_file_id(vid_key, file_id)
-                    await _maybe_send_ad_after_success(message, lang)
-                    await _maybe_send_share_prompt(message, lang)
-                    return
-                except (BadRequest, TimedOut, NetworkError):
-                    pass
-    except Exception as e:  # pylint: disable=broad-except
-        logger.debug("TikTok instant mode skipped: %s", e)
-
-    wanted_label = None
-    if audio_lang == "fr":
-        wanted_label = "🇫🇷 Français" if lang == "fr" else "🇫🇷 French"
-    elif audio_lang == "en":
-        wanted_label = "🇬🇧 Anglais" if lang == "fr" else "🇬🇧 English"
-
-    audio_pref = "ba"
-    if audio_lang == "fr":
-        audio_pref = "ba[language~='^fr']"
-    elif audio_lang == "en":
-        audio_pref = "ba[language~='^en']"
-
-    if quality == "sd":
-        # SD: max 480p pour un bon compromis qualité / taille
-        video_format = (
-            f"bv*[height<=720]+{audio_pref}/"
-            "bv*[height<=720]+ba/b[height<=720]/best[height<=720]/worst"
-        )
-    else:  # hd par défaut
-        # HD: max 1080p pour la meilleure qualité tout en respectant la limite de taille
-        video_format = (
-            f"bv*[height<=1080]+{audio_pref}/"
-            "bv*[height<=1080]+ba/b[height<=1080]/best[height<=1080]/best"
-        )
-
-    ydl_opts = {
-        **COMMON_YDL_OPTS,
-        "format": video_format,
-        "outtmpl": str(DOWNLOAD_DIR / "%(title)s.%(ext)s"),
-        "noplaylist": True,
-        "merge_output_format": "mp4",
-    }
-
-    filename = None
-    progress_message = None
-    try:
-        progress_message = await message.reply_text(
-            "⬇️ Démarrage du téléchargement…" if lang == "fr" else "⬇️ Starting download…"
-        )
-        loop = asyncio.get_running_loop()
-        ydl_opts["progress_hooks"] = [
-            _make_progress_hook(loop, progress_message, lang, "video")
-        ]
-
-        def _download() -> tuple[str | None, bool]:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                has_requested_audio = True
-                if audio_lang in ("fr", "en"):
-                    has_requested_audio = False
-                    formats = info.get("formats") or []
-                    if isinstance(formats, list):
-                        for f in formats:
-                            if not isinstance(f, dict):
-                                continue
-                            acodec = f.get("acodec")
-                            if acodec in (None, "none"):
-                                continue
-                            vcodec = f.get("vcodec")
-                            if vcodec not in (None, "none"):
-                                continue
-                            flang = f.get("language")
-                            if isinstance(flang, str) and flang.lower().startswith(audio_lang):
-                                has_requested_audio = True
-                                break
-                fname = ydl.prepare_filename(info)
-                ydl.download([url])
-                return fname, has_requested_audio
-
-        async with DOWNLOAD_SEMAPHORE:
-            filename, has_requested_audio = await asyncio.to_thread(_download)
-
-        if wanted_label and not has_requested_audio:
-            await message.reply_text(
-                get_message("audio_lang_unavailable", lang).format(wanted=wanted_label)
-            )
-
-        try:
-            await progress_message.edit_text(
-                "📤 Envoi vers Telegram…" if lang == "fr" else "📤 Sending to Telegram…"
-            )
-        except Exception:
-            pass
-
-        if not filename or not os.path.exists(filename):
-            raise RuntimeError("Downloaded file not found")
-
-        file_size = os.path.getsize(filename)
-        if file_size > MAX_FILE_SIZE_BYTES:
-            size_mb = file_size / (1024 * 1024)
-            await message.reply_text(
-                get_message("too_big", lang).format(size_mb=size_mb),
-                reply_markup=_action_keyboard(lang, "video", quality),
-            )
-            if progress_message is not None:
-                try:
-                    await progress_message.edit_text(
-                        "📦 Fichier trop gros" if lang == "fr" else "📦 File too large"
-                    )
-                except Exception:
-                    pass
-            _safe_remove(filename)
-            return
-
-        title = os.path.basename(filename)
-        sent = None
-        try:
-            with open(filename, "rb") as video_file:
-                try:
-                    await message.reply_video(
-                        video=video_file,
-                        caption=title,
-                        read_timeout=600.0,
-                        write_timeout=600.0,
-                    )
-                except TypeError:
-                    await message.reply_video(video=video_file, caption=title)
-        except (TimedOut, NetworkError):
-            # L'envoi peut quand même réussir côté Telegram, on log juste pour debug
-            logger.debug("Timed out while sending video; it may still have been delivered.")
-
-        if tiktok_video_id and sent is not None:
-            video_obj = getattr(sent, "video", None)
-            file_id = getattr(video_obj, "file_id", None) if video_obj else None
-            if file_id:
-                _cache_tiktok_file_id(tiktok_video_id, file_id)
-
-        _safe_remove(filename)
-        await message.reply_text(get_message("cleaned", lang))
-        await _maybe_send_ad_after_success(message, lang)
-        await _maybe_send_share_prompt(message, lang)
-
-        try:
-            await progress_message.edit_text("✅ Terminé" if lang == "fr" else "✅ Done")
-        except Exception:
-            pass
-
-    except DownloadError as e:
-        error_text = str(e)
-        logger.info("Download error while processing URL: %s", error_text)
-        if progress_message is not None:
-            try:
-                await progress_message.edit_text(
-                    "❌ Échec du téléchargement" if lang == "fr" else "❌ Download failed"
-                )
-            except Exception:
-                pass
-        if _is_youtube_antibot_error(error_text):
-            await message.reply_text(
-                _youtube_antibot_user_message(lang),
-                reply_markup=_action_keyboard(lang, "video", quality),
-            )
-        elif "No video could be found" in error_text:
-            await message.reply_text(
-                get_message("no_video", lang),
-                reply_markup=_action_keyboard(lang, "video", quality),
-            )
-        else:
-            await message.reply_text(
-                get_message("error_try_again", lang),
-                reply_markup=_action_keyboard(lang, "video", quality),
-            )
-        if filename and os.path.exists(filename):
-            _safe_remove(filename)
-
-    except Exception as e:  # pylint: disable=broad-except
-        logger.exception("Error while processing URL: %s", e)
-        if progress_message is not None:
-            try:
-                await progress_message.edit_text(
-                    "❌ Erreur" if lang == "fr" else "❌ Error"
-                )
-            except Exception:
-                pass
-        await message.reply_text(
-            get_message("error_try_again", lang),
-            reply_markup=_action_keyboard(lang, "video", quality),
-        )
-        if filename and os.path.exists(filename):
-            _safe_remove(filename)
-
-
-async def process_audio_url(message, url: str, lang: str) -> None:
-    """Télécharge uniquement l'audio et l'envoie."""
-
-    ydl_opts = {
-        **COMMON_YDL_OPTS,
-        "format": "bestaudio/best",
-        "outtmpl": str(DOWNLOAD_DIR / "%(title)s.%(ext)s"),
-        "noplaylist": True,
-        # Évite la correction de conteneur m4a qui peut poser problème sous Windows
-        "fixup": "never",
-    }
-
-    filename = None
-    progress_message = None
-    try:
-        progress_message = await message.reply_text(
-            "⬇️ Démarrage du téléchargement…" if lang == "fr" else "⬇️ Starting download…"
-        )
-        loop = asyncio.get_running_loop()
-        ydl_opts["progress_hooks"] = [
-            _make_progress_hook(loop, progress_message, lang, "audio")
-        ]
-
-        def _download() -> str | None:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                fname = ydl.prepare_filename(info)
-                ydl.download([url])
-                return fname
-
-        async with DOWNLOAD_SEMAPHORE:
-            filename = await asyncio.to_thread(_download)
-
-        try:
-            await progress_message.edit_text(
-                "📤 Envoi vers Telegram…" if lang == "fr" else "📤 Sending to Telegram…"
-            )
-        except Exception:
-            pass
-
-        if not filename or not os.path.exists(filename):
-            raise RuntimeError("Downloaded file not found")
-
-        file_size = os.path.getsize(filename)
-        if file_size > MAX_FILE_SIZE_BYTES:
-            size_mb = file_size / (1024 * 1024)
-            await message.reply_text(
-                get_message("too_big", lang).format(size_mb=size_mb),
-                reply_markup=_action_keyboard(lang, "audio", None),
-            )
-            if progress_message is not None:
-                try:
-                    await progress_message.edit_text(
-                        "📦 Fichier trop gros" if lang == "fr" else "📦 File too large"
-                    )
-                except Exception:
-                    pass
-            _safe_remove(filename)
-            return
-
-        title = os.path.basename(filename)
-        try:
-            with open(filename, "rb") as audio_file:
-                await message.reply_audio(
-                    audio=audio_file,
-                    caption=title,
-                )
-        except (TimedOut, NetworkError):
-            logger.debug(
-                "Timed out while sending audio; it may still have been delivered."
-            )
-
-        _safe_remove(filename)
-        await message.reply_text(get_message("cleaned", lang))
-        await _maybe_send_ad_after_success(message, lang)
-        await _maybe_send_share_prompt(message, lang)
-
-        if progress_message is not None:
-            try:
-                await progress_message.edit_text("✅ Terminé" if lang == "fr" else "✅ Done")
-            except Exception:
-                pass
-
-    except DownloadError as e:
-        error_text = str(e)
-        logger.info("Download error while processing audio URL: %s", error_text)
-        if progress_message is not None:
-            try:
-                await progress_message.edit_text(
-                    "❌ Échec du téléchargement" if lang == "fr" else "❌ Download failed"
-                )
-            except Exception:
-                pass
-        if _is_youtube_antibot_error(error_text):
-            await message.reply_text(
-                _youtube_antibot_user_message(lang),
-                reply_markup=_action_keyboard(lang, "audio", None),
-            )
-        elif "No video could be found" in error_text:
-            await message.reply_text(
-                get_message("no_video", lang),
-                reply_markup=_action_keyboard(lang, "audio", None),
-            )
-        else:
-            await message.reply_text(
-                get_message("error_try_again", lang),
-                reply_markup=_action_keyboard(lang, "audio", None),
-            )
-        if filename and os.path.exists(filename):
-            _safe_remove(filename)
-
-    except Exception as e:  # pylint: disable=broad-except
-        logger.exception("Error while processing audio URL")
-        if progress_message is not None:
-            try:
-                await progress_message.edit_text(
-                    "❌ Erreur" if lang == "fr" else "❌ Error"
-                )
-            except Exception:
-                pass
-        await message.reply_text(
-            get_message("error_try_again", lang),
-            reply_markup=_action_keyboard(lang, "audio", None),
-        )
-        if filename and os.path.exists(filename):
-            _safe_remove(filename)
-
-
-def _extract_image_info_from_html(page_url: str) -> tuple[str | None, str | None]:
-    try:
-        req = urllib.request.Request(
-            page_url,
-            headers={
-                "User-Agent": (
-                    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                    "AppleWebKit/537.36 (KHTML, like Gecko) "
-                    "Chrome/122.0 Safari/537.36"
-                ),
-                "Accept-Language": "en-US,en;q=0.9,fr;q=0.8",
-            },
-        )
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            content_type = resp.headers.get("Content-Type", "")
-            charset = "utf-8"
-            if "charset=" in content_type:
-                charset = content_type.split("charset=")[-1].split(";")[0].strip()
-            html_bytes = resp.read()
-            html_text = html_bytes.decode(charset, errors="ignore")
-    except Exception:  # pylint: disable=broad-except
-        logger.exception("Error fetching HTML for image extraction")
-        return None, None
-
-    image_url = None
-    metas = re.findall(r"<meta[^>]+>", html_text, flags=re.IGNORECASE)
-    for meta in metas:
-        lower_meta = meta.lower()
-        if "og:image" in lower_meta or "twitter:image" in lower_meta:
-            m = re.search(r'content=["\']([^"\']+)["\']', meta, re.IGNORECASE)
-            if m:
-                image_url = m.group(1)
-                break
-
-    if not image_url:
-        return None, None
-
-    title_match = re.search(
-        r"<title[^>]*>(.*?)</title>",
-        html_text,
-        re.IGNORECASE | re.DOTALL,
-    )
-    title = title_match.group(1).strip() if title_match else None
-    return image_url, title
-
-
-def _download_url_to_file(download_url: str, filename: str) -> None:
-    req = urllib.request.Request(
-        download_url,
-        headers={
-            "User-Agent": (
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                "AppleWebKit/537.36 (KHTML, like Gecko) "
-                "Chrome/122.0 Safari/537.36"
-            ),
-        },
-    )
-    with urllib.request.urlopen(req, timeout=30) as resp, open(
-        filename, "wb"
-    ) as out_file:
-        out_file.write(resp.read())
-
-
-def _download_url_to_file_with_referer(
-    download_url: str, filename: str, referer_url: str | None
-) -> None:
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/122.0 Safari/537.36"
-        )
-    }
-    if referer_url:
-        headers["Referer"] = referer_url
-
-    req = urllib.request.Request(download_url, headers=headers)
-    with urllib.request.urlopen(req, timeout=30) as resp, open(
-        filename, "wb"
-    ) as out_file:
-        out_file.write(resp.read())
-
-
-def _extract_tiktok_photo_urls_from_html(page_url: str) -> tuple[list[str], str | None]:
-    try:
-        req = urllib.request.Request(
-            page_url,
-            headers={
-                "User-Agent": (
-                    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                    "AppleWebKit/537.36 (KHTML, like Gecko) "
-                    "Chrome/122.0 Safari/537.36"
-                ),
-                "Accept-Language": "en-US,en;q=0.9,fr;q=0.8",
-                "Accept-Encoding": "identity",
-            },
-        )
-        with urllib.request.urlopen(req, timeout=20) as resp:
-            content_type = resp.headers.get("Content-Type", "")
-            charset = "utf-8"
-            if "charset=" in content_type:
-                charset = content_type.split("charset=")[-1].split(";")[0].strip()
-            html_text = resp.read().decode(charset, errors="ignore")
-    except Exception:  # pylint: disable=broad-except
-        logger.exception("Error fetching TikTok HTML")
-        return [], None
-
-    script_id = None
-    script_match = re.search(
-        r'<script[^>]+id=["\']__UNIVERSAL_DATA_FOR_REHYDRATION__["\'][^>]*>(.*?)</script>',
-        html_text,
-        re.IGNORECASE | re.DOTALL,
-    )
-    if not script_match:
-        script_match = re.search(
-            r'<script[^>]+id=["\']SIGI_STATE["\'][^>]*>(.*?)</script>',
-            html_text,
-            re.IGNORECASE | re.DOTALL,
-        )
-        if script_match:
-            script_id = "SIGI_STATE"
-    else:
-        script_id = "__UNIVERSAL_DATA_FOR_REHYDRATION__"
-    if not script_match:
-        return [], None
-
-    json_text = script_match.group(1).strip()
-
-    def _strip_js_assignment(text: str) -> str:
-        t = text.strip()
-        t = re.sub(
-            r'^\s*window\[(?:"|\")?SIGI_STATE(?:"|\")?\]\s*=\s*',
-            "",
-            t,
-            flags=re.IGNORECASE,
-        )
-        t = re.sub(
-            r"^\s*window\[(?:'|\")?SIGI_STATE(?:'|\")?\]\s*=\s*",
-            "",
-            t,
-            flags=re.IGNORECASE,
-        )
-        t = re.sub(
-            r"^\s*window\[(?:'|\")?__UNIVERSAL_DATA_FOR_REHYDRATION__(?:'|\")?\]\s*=\s*",
-            "",
-            t,
-            flags=re.IGNORECASE,
-        )
-        t = re.sub(
-            r"^\s*window\.(?:SIGI_STATE|__UNIVERSAL_DATA_FOR_REHYDRATION__)\s*=\s*",
-            "",
-            t,
-            flags=re.IGNORECASE,
-        )
-        t = t.strip()
-        if t.endswith(";"):
-            t = t[:-1]
-        t = t.strip()
-        if not (t.startswith("{") or t.startswith("[")):
-            start = t.find("{")
-            end = t.rfind("}")
-            if start != -1 and end != -1 and end > start:
-                t = t[start : end + 1]
-        return t.strip()
-
-    json_text = _strip_js_assignment(json_text)
-    logger.info(
-        "TikTok embedded JSON candidate (type=%s, chars=%d)",
-        script_id,
-        len(json_text),
-    )
-    try:
-        data = json.loads(json_text)
-    except Exception:  # pylint: disable=broad-except
-        logger.exception("Error parsing TikTok embedded JSON")
-        return [], None
-
-    def _urls_from_image_post_dict(image_post: dict) -> list[str]:
-        images = image_post.get("images")
-        if not isinstance(images, list):
-            return []
-        urls: list[str] = []
-        for img in images:
-            if not isinstance(img, dict):
-                continue
-            candidates = []
-            for k in ("imageURL", "displayImage", "cover", "staticImage"):
-                v = img.get(k)
-                if isinstance(v, dict):
-                    candidates.append(v)
-            for candidate in candidates:
-                url_list = candidate.get("urlList")
-                if isinstance(url_list, list):
-                    for u in url_list:
-                        if isinstance(u, str) and u.startswith("http"):
-                            urls.append(u)
-                            break
-        return urls
-
-    def _walk(obj) -> tuple[list[str], str | None]:
-        if isinstance(obj, dict):
-            if "imagePost" in obj and isinstance(obj.get("imagePost"), dict):
-                urls = _urls_from_image_post_dict(obj["imagePost"])
-                desc = obj.get("desc") if isinstance(obj.get("desc"), str) else None
-                if urls:
-                    return urls, desc
-            for v in obj.values():
-                urls, desc = _walk(v)
-                if urls:
-                    return urls, desc
-        elif isinstance(obj, list):
-            for it in obj:
-                urls, desc = _walk(it)
-                if urls:
-                    return urls, desc
-        return [], None
-
-    urls, desc = _walk(data)
-    if urls:
-        deduped: list[str] = []
-        seen = set()
-        for u in urls:
-            if u not in seen:
-                deduped.append(u)
-                seen.add(u)
-        return deduped, desc
-
-    return [], None
-
-
-async def process_photo_url(message, url: str, lang: str) -> None:
-    """Télécharge une photo (si disponible) et l'envoie."""
-
-    await message.reply_text(get_message("photo_disabled", lang))
-    return
-
-    filename = None
-    try:
-        parsed = urlparse(url)
-        host = parsed.netloc.lower()
-        logger.info("Processing photo URL (host=%s): %s", host, url)
-
-        # Cas spécial X/Twitter
-        if "x.com" in host or "twitter.com" in host:
-            info = None
-
-            def _extract_twitter_info() -> dict | None:
-                ydl_opts = {
-                    "skip_download": True,
-                    "ignore_no_formats_error": True,
-                }
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    return ydl.extract_info(url, download=False)
-
-            try:
-                info = await asyncio.to_thread(_extract_twitter_info)
-            except DownloadError:
-                info = None
-
-            image_url = None
-            title = None
-
-            if info:
-                thumbs = info.get("thumbnails") or []
-                if thumbs:
-                    best = max(thumbs, key=lambda t: t.get("width") or 0)
-                    image_url = best.get("url")
-                title = info.get("title")
-
-            if image_url:
-                image_url = _twitter_image_url_to_orig(image_url)
-
-            if not image_url:
-                image_url, title_html = await asyncio.to_thread(
-                    _extract_image_info_from_html, url
-                )
-                title = title or title_html
-
-            if not image_url:
-                photo_urls, title_syn = await asyncio.to_thread(
-                    _extract_twitter_photo_urls_from_syndication, url
-                )
-                if photo_urls:
-                    title = title_syn or title or "image"
-                    safe_title = re.sub(r"[\\/:*?\"<>|]", "_", title)
-
-                    downloaded_files: list[str] = []
-                    try:
-                        for idx, photo_url in enumerate(photo_urls[:10]):
-                            parsed_img = urlparse(photo_url)
-                            img_ext = os.path.splitext(parsed_img.path)[1].lower().lstrip(".")
-                            image_ext = img_ext if img_ext in IMAGE_EXTENSIONS else "jpg"
-                            out_path = str(
-                                DOWNLOAD_DIR / f"{safe_title}_{idx + 1}.{image_ext}"
-                            )
-                            await asyncio.to_thread(
-                                _download_url_to_file_with_referer,
-                                photo_url,
-                                out_path,
-                                url,
-                            )
-                            downloaded_files.append(out_path)
-
-                        if not downloaded_files:
-                            await message.reply_text(get_message("no_photo", lang))
-                            return
-
-                        media = []
-                        handles = []
-                        try:
-                            for i, fpath in enumerate(downloaded_files):
-                                photo_file = open(fpath, "rb")
-                                handles.append(photo_file)
-                                media.append(
-                                    InputMediaPhoto(
-                                        media=photo_file,
-                                        caption=title if i == 0 else None,
-                                    )
-                                )
-                            await message.reply_media_group(media=media)
-                        finally:
-                            for h in handles:
-                                try:
-                                    h.close()
-                                except OSError:
-                                    pass
-
-                        for fpath in downloaded_files:
-                            try:
-                                os.remove(fpath)
-                            except OSError:
-                                pass
-                        await message.reply_text(get_message("cleaned", lang))
-                        return
-                    except Exception:  # pylint: disable=broad-except
-                        for fpath in downloaded_files:
-                            try:
-                                os.remove(fpath)
-                            except OSError:
-                                pass
-                        raise
-
-            if not image_url:
-                await message.reply_text(get_message("no_photo", lang))
-                return
-
-            title = title or "image"
-            parsed_img = urlparse(image_url)
-            img_ext = os.path.splitext(parsed_img.path)[1].lower().lstrip(".")
-            image_ext = img_ext if img_ext in IMAGE_EXTENSIONS else "jpg"
-            safe_title = re.sub(r"[\\/:*?\"<>|]", "_", title)
-            filename = str(DOWNLOAD_DIR / f"{safe_title}.{image_ext}")
-
-            await asyncio.to_thread(_download_url_to_file, image_url, filename)
-
-            if not os.path.exists(filename):
-                raise RuntimeError("Downloaded image not found")
-
-            file_size = os.path.getsize(filename)
-            if file_size > MAX_FILE_SIZE_BYTES:
-                size_mb = file_size / (1024 * 1024)
-                await message.reply_text(
-                    get_message("too_big", lang).format(size_mb=size_mb)
-                )
-                os.remove(filename)
-                return
-
-            with open(filename, "rb") as photo_file:
-                await message.reply_photo(photo=photo_file, caption=title)
-
-            os.remove(filename)
-            await message.reply_text(get_message("cleaned", lang))
-            return
-
-        # TikTok liens courts
-        if host.endswith("vm.tiktok.com") or host.endswith("vt.tiktok.com"):
-            resolved = await asyncio.to_thread(_resolve_final_url, url)
-            resolved = normalize_url(resolved)
-            logger.info("Resolved TikTok short link: %s -> %s", url, resolved)
-            url = resolved
-            parsed = urlparse(url)
-            host = parsed.netloc.lower()
-
-        # TikTok canonique
-        if "tiktok.com" in host:
-            tiktok_path = urlparse(url).path
-            photo_urls, title_tk = await asyncio.to_thread(
-                _extract_tiktok_photo_urls_from_html, url
-            )
-            if photo_urls:
-                logger.info("TikTok photo extraction: %d image(s)", len(photo_urls))
-                title = title_tk or "image"
-                safe_title = re.sub(r"[\\/:*?\"<>|]", "_", title)
-
-                downloaded_files: list[str] = []
-                try:
-                    for idx, photo_url in enumerate(photo_urls[:10]):
-                        parsed_img = urlparse(photo_url)
-                        img_ext = os.path.splitext(parsed_img.path)[1].lower().lstrip(".")
-                        image_ext = img_ext if img_ext in IMAGE_EXTENSIONS else "jpg"
-                        out_path = str(
-                            DOWNLOAD_DIR / f"{safe_title}_{idx + 1}.{image_ext}"
-                        )
-                        await asyncio.to_thread(
-                            _download_url_to_file_with_referer,
-                            photo_url,
-                            out_path,
-                            url,
-                        )
-                        downloaded_files.append(out_path)
-
-                    if not downloaded_files:
-                        await message.reply_text(get_message("no_photo", lang))
-                        return
-
-                    media = []
-                    handles = []
-                    try:
-                        for i, fpath in enumerate(downloaded_files):
-                            photo_file = open(fpath, "rb")
-                            handles.append(photo_file)
-                            media.append(
-                                InputMediaPhoto(
-                                    media=photo_file,
-                                    caption=title if i == 0 else None,
-                                )
-                            )
-                        await message.reply_media_group(media=media)
-                    finally:
-                        for h in handles:
-                            try:
-                                h.close()
-                            except OSError:
-                                pass
-
-                    for fpath in downloaded_files:
-                        try:
-                            os.remove(fpath)
-                        except OSError:
-                            pass
-                    await message.reply_text(get_message("cleaned", lang))
-                    return
-                except Exception:  # pylint: disable=broad-except
-                    for fpath in downloaded_files:
-                        try:
-                            os.remove(fpath)
-                        except OSError:
-                            pass
-                    raise
-
-            if "/photo/" in tiktok_path:
-                image_url, title_html = await asyncio.to_thread(
-                    _extract_image_info_from_html, url
-                )
-                if image_url:
-                    title = title_html or "image"
-                    safe_title = re.sub(r"[\\/:*?\"<>|]", "_", title)
-                    parsed_img = urlparse(image_url)
-                    img_ext = os.path.splitext(parsed_img.path)[1].lower().lstrip(".")
-                    image_ext = img_ext if img_ext in IMAGE_EXTENSIONS else "jpg"
-                    filename = str(DOWNLOAD_DIR / f"{safe_title}.{image_ext}")
-
-                    await asyncio.to_thread(_download_url_to_file, image_url, filename)
-
-                    if not os.path.exists(filename):
-                        raise RuntimeError("Downloaded image not found")
-
-                    file_size = os.path.getsize(filename)
-                    if file_size > MAX_FILE_SIZE_BYTES:
-                        size_mb = file_size / (1024 * 1024)
-                        await message.reply_text(
-                            get_message("too_big", lang).format(size_mb=size_mb)
-                        )
-                        os.remove(filename)
-                        return
-
-                    with open(filename, "rb") as photo_file:
-                        await message.reply_photo(photo=photo_file, caption=title)
-
-                    os.remove(filename)
-                    await message.reply_text(get_message("cleaned", lang))
-                    return
-
-                logger.info("TikTok photo extraction returned 0 images for photo URL")
-                await message.reply_text(get_message("no_photo", lang))
-                return
-
-        # Autres sites : tentative via yt-dlp
-        info = None
-
-        def _extract_other_info() -> dict | None:
-            ydl_opts = {
-                "skip_download": True,
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                return ydl.extract_info(url, download=False)
-
-        info = await asyncio.to_thread(_extract_other_info)
-
-        if not info:
-            await message.reply_text(get_message("no_photo", lang))
-            return
-
-        image_url = None
-        image_ext = "jpg"
-
-        # 1) Cas d'une URL qui pointe déjà directement vers une image
-        parsed = urlparse(url)
-        direct_ext = os.path.splitext(parsed.path)[1].lower().lstrip(".")
-        if direct_ext in IMAGE_EXTENSIONS:
-            image_url = url
-            image_ext = direct_ext
-        else:
-            # 2) Utiliser l'URL et l'extension issues des métadonnées yt-dlp
-            info_url = info.get("url")
-            info_ext = (info.get("ext") or "").lower()
-            if info_url and info_ext in IMAGE_EXTENSIONS:
-                image_url = info_url
-                image_ext = info_ext
-            else:
-                # 3) Chercher dans les miniatures et prendre la plus grande
-                thumbs = info.get("thumbnails") or []
-                if thumbs:
-                    best = max(thumbs, key=lambda t: t.get("width") or 0)
-                    image_url = best.get("url")
-                    if image_url:
-                        thumb_path = urlparse(image_url).path
-                        thumb_ext = os.path.splitext(thumb_path)[1].lower().lstrip(".")
-                        if thumb_ext in IMAGE_EXTENSIONS:
-                            image_ext = thumb_ext
-
-        if not image_url:
-            await message.reply_text(get_message("no_photo", lang))
-            return
-
-        title = info.get("title") or "image"
-        safe_title = re.sub(r"[\\/:*?\"<>|]", "_", title)
-        filename = str(DOWNLOAD_DIR / f"{safe_title}.{image_ext}")
-
-        await asyncio.to_thread(_download_url_to_file, image_url, filename)
-
-        if not os.path.exists(filename):
-            raise RuntimeError("Downloaded image not found")
-
-        file_size = os.path.getsize(filename)
-        if file_size > MAX_FILE_SIZE_BYTES:
-            size_mb = file_size / (1024 * 1024)
-            await message.reply_text(
-                get_message("too_big", lang).format(size_mb=size_mb)
-            )
-            os.remove(filename)
-            return
-
-        with open(filename, "rb") as photo_file:
-            await message.reply_photo(photo=photo_file, caption=title)
-
-        os.remove(filename)
-        await message.reply_text(get_message("cleaned", lang))
-
-    except DownloadError as e:
-        logger.exception("Download error while processing photo URL")
-        error_text = str(e)
-        if "Unsupported URL" in error_text:
-            # Dernière tentative : lecture directe du HTML pour récupérer une image
-            image_url, title_html = await asyncio.to_thread(
-                _extract_image_info_from_html, url
-            )
-            if not image_url:
-                await message.reply_text(get_message("no_photo", lang))
-            else:
-                image_ext = "jpg"
-                parsed_img = urlparse(image_url)
-                img_ext = os.path.splitext(parsed_img.path)[1].lower().lstrip(".")
-                if img_ext in IMAGE_EXTENSIONS:
-                    image_ext = img_ext
-
-                title = title_html or "image"
-                safe_title = re.sub(r"[\\/:*?\"<>|]", "_", title)
-                filename = str(DOWNLOAD_DIR / f"{safe_title}.{image_ext}")
-
-                try:
-                    await asyncio.to_thread(
-                        _download_url_to_file, image_url, filename
-                    )
-
-                    if not os.path.exists(filename):
-                        raise RuntimeError("Downloaded image not found")
-
-                    file_size = os.path.getsize(filename)
-                    if file_size > MAX_FILE_SIZE_BYTES:
-                        size_mb = file_size / (1024 * 1024)
-                        await message.reply_text(
-                            get_message("too_big", lang).format(size_mb=size_mb)
-                        )
-                        os.remove(filename)
-                        return
-
-                    with open(filename, "rb") as photo_file:
-                        await message.reply_photo(photo=photo_file, caption=title)
-
-                    os.remove(filename)
-                    await message.reply_text(get_message("cleaned", lang))
-
-                except Exception as inner_e:  # pylint: disable=broad-except
-                    logger.exception("Error while processing HTML photo fallback")
-                    await message.reply_text(
-                        get_message("error", lang).format(error=str(inner_e))
-                    )
-                    if filename and os.path.exists(filename):
-                        try:
-                            os.remove(filename)
-                        except OSError:
-                            pass
-        else:
-            await message.reply_text(
-                get_message("error", lang).format(error=error_text)
-            )
-            if filename and os.path.exists(filename):
-                try:
-                    os.remove(filename)
-                except OSError:
-                    pass
-
-    except Exception as e:  # pylint: disable=broad-except
-        logger.exception("Error while processing photo URL")
-        await message.reply_text(
-            get_message("error", lang).format(error=str(e))
-        )
-        if filename and os.path.exists(filename):
-            try:
-                os.remove(filename)
-            except OSError:
-                pass
-
-
-async def quality_callback(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
-    """Callback pour le choix de qualité HD/SD."""
-
-    query = update.callback_query
-    if not query:
-        return
-
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-
-    try:
-        await query.answer()
-    except (BadRequest, NetworkError, TimedOut):
-        pass
-
-    lang = get_user_lang(update)
-    url = context.user_data.get("last_url")
-    if not url:
-        await query.message.reply_text(get_message("no_url_saved", lang))
-        return
-
-    data = query.data or ""
-    quality = "hd" if data == "quality_hd" else "sd"
-
-    context.user_data["last_action"] = "video"
-    context.user_data["last_quality"] = quality
-    context.user_data.setdefault("last_audio_lang", "orig")
-
-    keyboard = InlineKeyboardMarkup(
-        [
-            [
-                InlineKeyboardButton(get_message("audio_lang_orig", lang), callback_data="alang_orig"),
-                InlineKeyboardButton(get_message("audio_lang_fr", lang), callback_data="alang_fr"),
-                InlineKeyboardButton(get_message("audio_lang_en", lang), callback_data="alang_en"),
-            ]
-        ]
-    )
-    await query.message.reply_text(
-        get_message("choose_audio_lang", lang),
-        reply_markup=keyboard,
-        disable_web_page_preview=True,
-    )
-
-
-async def audio_lang_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    if not query:
-        return
-
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-
-    try:
-        await query.answer()
-    except (BadRequest, NetworkError, TimedOut):
-        pass
-
-    lang = get_user_lang(update)
-    url = context.user_data.get("last_url")
-    if not url:
-        await query.message.reply_text(get_message("no_url_saved", lang))
-        return
-
-    quality = context.user_data.get("last_quality")
-    if quality not in ("hd", "sd"):
-        quality = "hd"
-
-    data = query.data or ""
-    audio_lang = "orig"
-    if data == "alang_fr":
-        audio_lang = "fr"
-    elif data == "alang_en":
-        audio_lang = "en"
-
-    context.user_data["last_audio_lang"] = audio_lang
-    await process_url(query.message, url, lang, quality, audio_lang)
-
-
-async def type_callback(
-    update: Update, context: ContextTypes.DEFAULT_TYPE
-) -> None:
-    """Callback pour le choix Vidéo / Audio."""
-
-    query = update.callback_query
-    if not query:
-        return
-
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-
-    try:
-        await query.answer()
-    except (BadRequest, NetworkError, TimedOut):
-        pass
-
-    lang = get_user_lang(update)
-    url = context.user_data.get("last_url")
-    if not url:
-        await query.message.reply_text(get_message("no_url_saved", lang))
-        return
-
-    data = query.data or ""
-    logger.info("Type callback: %s (url=%s)", data, url)
-    if data == "type_video":
-        context.user_data["last_action"] = "video"
-        keyboard = InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton("🔼 HD (meilleure qualité)", callback_data="quality_hd"),
-                    InlineKeyboardButton("🔽 SD (rapide)", callback_data="quality_sd"),
-                ]
-            ]
-        )
-        await query.message.reply_text(
-            get_message("choose_quality", lang), reply_markup=keyboard
-        )
-    elif data == "type_audio":
-        context.user_data["last_action"] = "audio"
-        context.user_data.pop("last_quality", None)
-        await process_audio_url(query.message, url, lang)
-    elif data == "type_effects":
-        if update.effective_user:
-            kind = await _plan_effect_entitlement(update.effective_user.id)
-            if kind is None:
-                await query.message.reply_text(
-                    get_message("premium_need_more", lang),
-                    reply_markup=_premium_keyboard(lang),
-                )
-                return
-            context.user_data["effects_entitlement_kind"] = kind
-        
-        keyboard = InlineKeyboardMarkup(
-            [
-                [
-                    InlineKeyboardButton(
-                        get_message("effects_mode_preset", lang), callback_data="effect_mode_preset"
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        get_message("effects_mode_steal", lang), callback_data="effect_mode_steal"
-                    )
-                ],
-            ]
-        )
-        await query.message.reply_text(get_message("effects_intro", lang), reply_markup=keyboard)
-    elif data == "type_photo":
-        await query.message.reply_text(get_message("photo_disabled", lang))
-
-
-async def effect_mode_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Callback pour choix du mode effet: preset ou vol de style."""
-    query = update.callback_query
-    if not query:
-        return
-
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-
-    try:
-        await query.answer()
-    except (BadRequest, NetworkError, TimedOut):
-        pass
-
-    lang = get_user_lang(update)
-    data = query.data or ""
-
-    if data == "effect_mode_preset":
-        buttons = []
-        for preset_id, preset in PRESET_EFFECTS.items():
-            name = preset[f"name_{lang}"]
-            buttons.append(
-                [InlineKeyboardButton(name, callback_data=f"effect_preset_{preset_id}")]
-            )
-        keyboard = InlineKeyboardMarkup(buttons)
-        await query.message.reply_text(get_message("effects_choose_preset", lang), reply_markup=keyboard)
-
-    elif data == "effect_mode_steal":
-        context.user_data["effects_mode"] = "steal"
-        context.user_data["effects_waiting_ref_url"] = True
-        await query.message.reply_text(get_message("effects_steal_intro", lang))
-
-
-async def effect_preset_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Callback pour sélection d'un effet prédéfini."""
-    query = update.callback_query
-    if not query:
-        return
-
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-
-    try:
-        await query.answer()
-    except (BadRequest, NetworkError, TimedOut):
-        pass
-
-    lang = get_user_lang(update)
-    data = query.data or ""
-
-    if not data.startswith("effect_preset_"):
-        return
-
-    preset_id = data.split("_", 2)[2]
-    preset = PRESET_EFFECTS.get(preset_id)
-    if not preset:
-        await query.message.reply_text(get_message("error_try_again", lang))
-        return
-
-    context.user_data["effects_mode"] = "preset"
-    context.user_data["effects_preset_id"] = preset_id
-    context.user_data["effects_waiting_video"] = True
-
-    effect_name = preset[f"name_{lang}"]
-    effect_desc = preset[f"desc_{lang}"]
-    await query.message.reply_text(
-        get_message("effects_preset_selected", lang).format(
-            effect_name=effect_name, effect_desc=effect_desc
-        )
-    )
-
-
-async def retry_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    if not query:
-        return
-
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-
-    try:
-        await query.answer()
-    except (BadRequest, NetworkError, TimedOut):
-        pass
-
-    lang = get_user_lang(update)
-    url = context.user_data.get("last_url")
-    if not url:
-        await query.message.reply_text(get_message("no_url_saved", lang))
-        return
-
-    data = query.data or ""
-    if data.startswith("retry_video_"):
-        quality = data.split("_", 2)[2]
-        if quality not in ("hd", "sd"):
-            quality = "hd"
-        context.user_data["last_action"] = "video"
-        context.user_data["last_quality"] = quality
-        audio_lang = context.user_data.get("last_audio_lang")
-        if not isinstance(audio_lang, str) or audio_lang not in ("orig", "fr", "en"):
-            audio_lang = "orig"
-        await process_url(query.message, url, lang, quality, audio_lang)
-        return
-
-    if data == "retry_audio":
-        context.user_data["last_action"] = "audio"
-        context.user_data.pop("last_quality", None)
-        await process_audio_url(query.message, url, lang)
-        return
-
-
-def _premium_keyboard(lang: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(
-        [
-            [
-                InlineKeyboardButton(
-                    get_message("premium_buy_month", lang), callback_data="premium_buy_month"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    get_message("premium_buy_credits10", lang),
-                    callback_data="premium_buy_credits10",
-                ),
-                InlineKeyboardButton(
-                    get_message("premium_buy_credits50", lang),
-                    callback_data="premium_buy_credits50",
-                ),
-            ],
-            [
-                InlineKeyboardButton(
-                    get_message("premium_my_ref", lang), callback_data="premium_my_ref"
-                )
-            ],
-            [InlineKeyboardButton(get_message("menu_button", lang), callback_data="menu_main")],
-        ]
-    )
-
-
-async def _send_premium_menu(message, update: Update, lang: str) -> None:
-    if not message or not update.effective_user:
-        return
-    rec = await _get_user_record(update.effective_user.id)
-    now = int(time.time())
-    until = rec.get("premium_until")
-    until_i = int(until) if isinstance(until, (int, float)) else 0
-    credits = _get_credits(rec)
-    if until_i > now:
-        status_line = (
-            f"✅ Premium actif jusqu'au {_format_premium_until(until_i, lang)}"
-            if lang == "fr"
-            else f"✅ Premium active until {_format_premium_until(until_i, lang)}"
-        )
-    else:
-        status_line = "🆓 Mode gratuit" if lang == "fr" else "🆓 Free mode"
-    credits_line = (
-        f"🎟️ Crédits: {credits}" if lang == "fr" else f"🎟️ Credits: {credits}"
-    )
-    ref_link = _ref_link_for_user(update.effective_user.id)
-    ref_line = (
-        ("🎁 Ton lien parrainage: " + ref_link)
-        if (lang == "fr" and ref_link)
-        else (("🎁 Your referral link: " + ref_link) if ref_link else "")
-    )
-    text = get_message("premium_menu_title", lang) + "\n\n" + status_line + "\n" + credits_line
-    if ref_line:
-        text += "\n\n" + ref_line
-    await message.reply_text(text, reply_markup=_premium_keyboard(lang), disable_web_page_preview=True)
-
-
-async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-    lang = get_user_lang(update)
-    msg = update.message or update.effective_message
-    if not msg:
-        return
-    await _send_premium_menu(msg, update, lang)
-
-
-async def premium_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    if not query:
-        return
-    _maybe_set_bot_username(getattr(context.bot, "username", None))
-    try:
-        await query.answer()
-    except (BadRequest, NetworkError, TimedOut):
-        pass
-    lang = get_user_lang(update)
-    data = query.data or ""
-    user = update.effective_user
-    chat = update.effective_chat
-    if not user or not chat:
-        return
-
-    if data == "premium_my_ref":
-        ref_link = _ref_link_for_user(user.id)
-        if not ref_link:
-            await query.message.reply_text(get_message("error_try_again", lang))
-            return
-        await query.message.reply_text(ref_link, disable_web_page_preview=True)
-        return
-
-    if data == "premium_buy_month":
-        payload = f"cx|premium_30d|{user.id}"
-        prices = [LabeledPrice(label="Premium 30d", amount=PREMIUM_30D_STARS)]
-        await context.bot.send_invoice(
-            chat_id=chat.id,
-            title=("⭐ Premium 30 jours" if lang == "fr" else "⭐ Premium 30 days"),
-            description=(
-                "Sans pubs + Effets illimités + priorité"
-                if lang == "fr"
-                else "No ads + unlimited Effects + priority"
-            ),
-            payload=payload,
-            provider_token="",
-            currency="XTR",
-            prices=prices,
-        )
-        return
-
-    if data == "premium_buy_credits10":
-        payload = f"cx|credits_10|{user.id}"
-        prices = [LabeledPrice(label="10 credits", amount=CREDITS_10_STARS)]
-        await context.bot.send_invoice(
-            chat_id=chat.id,
-            title=("🎟️ Pack 10 crédits" if lang == "fr" else "🎟️ 10 credits pack"),
-            description=(
-                "Utilise-les pour ✨ Effets et options premium"
-                if lang == "fr"
-                else "Use them for ✨ Effects and premium options"
-            ),
-            payload=payload,
-            provider_token="",
-            currency="XTR",
-            prices=prices,
-        )
-        return
-
-    if data == "premium_buy_credits50":
-        payload = f"cx|credits_50|{user.id}"
-        prices = [LabeledPrice(label="50 credits", amount=CREDITS_50_STARS)]
-        await context.bot.send_invoice(
-            chat_id=chat.id,
-            title=("🎟️ Pack 50 crédits" if lang == "fr" else "🎟️ 50 credits pack"),
-            description=(
-                "Utilise-les pour ✨ Effets et options premium"
-                if lang == "fr"
-                else "Use them for ✨ Effects and premium options"
-            ),
-            payload=payload,
-            provider_token="",
-            currency="XTR",
-            prices=prices,
-        )
-        return
-
-
-async def precheckout_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = getattr(update, "pre_checkout_query", None)
-    if not query:
-        return
-    payload = getattr(query, "invoice_payload", None)
-    ok = isinstance(payload, str) and payload.startswith("cx|")
-    try:
-        await query.answer(ok=ok, error_message=(None if ok else "Invalid invoice"))
-    except Exception:
-        pass
-
-
-async def successful_payment_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    msg = update.message or update.effective_message
-    if not msg or not update.effective_user:
-        return
-    sp = getattr(msg, "successful_payment", None)
-    if not sp:
-        return
-    payload = getattr(sp, "invoice_payload", None)
-    if not isinstance(payload, str) or not payload.startswith("cx|"):
-        return
-    parts = payload.split("|")
-    if len(parts) < 3:
-        return
-    product = parts[1]
-    try:
-        target_user_id = int(parts[2])
-    except Exception:
-        target_user_id = update.effective_user.id
-
-    lang = get_user_lang(update)
-    if target_user_id != update.effective_user.id:
-        target_user_id = update.effective_user.id
-
-    if product == "premium_30d":
-        await _grant_premium(target_user_id, PREMIUM_DURATION_SECONDS)
-        await msg.reply_text(
-            "✅ Premium activé !" if lang == "fr" else "✅ Premium activated!",
-            reply_markup=_main_menu_keyboard(lang),
-        )
-        return
-
-    if product == "credits_10":
-        await _add_credits(target_user_id, 10)
-        await msg.reply_text(
-            "✅ +10 crédits ajoutés !" if lang == "fr" else "✅ +10 credits added!",
-            reply_markup=_main_menu_keyboard(lang),
-        )
-        return
-
-    if product == "credits_50":
-        await _add_credits(target_user_id, 50)
-        await msg.reply_text(
-            "✅ +50 crédits ajoutés !" if lang == "fr" else "✅ +50 credits added!",
-            reply_markup=_main_menu_keyboard(lang),
-        )
-        return
-
-
-def main() -> None:
-    token = os.getenv("TELEGRAM_BOT_TOKEN")
-    if not token:
-        raise RuntimeError(
-            "TELEGRAM_BOT_TOKEN environment variable is not set. "
-            "Please set it to your bot token from BotFather."
-        )
-
-    _start_healthcheck_server_if_needed()
-    try:
-        _cleanup_download_dir_if_needed()
-    except Exception:
-        logger.exception("Startup cleanup failed")
-
-    async def _post_init(app: Application) -> None:
-        try:
-            me = await app.bot.get_me()
-            _maybe_set_bot_username(getattr(me, "username", None))
-        except Exception:
-            logger.exception("Bot post_init failed")
-
-    request = HTTPXRequest(
-        read_timeout=600.0,
-        write_timeout=600.0,
-        connect_timeout=10.0,
-        pool_timeout=10.0,
-    )
-
-    application = (
-        Application.builder()
-        .token(token)
-        .request(request)
-        .post_init(_post_init)
-        .build()
-    )
-
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("menu", menu_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("premium", premium_command))
-    application.add_handler(CallbackQueryHandler(menu_callback, pattern="^menu_"))
-    application.add_handler(CallbackQueryHandler(retry_callback, pattern="^retry_"))
-    application.add_handler(CallbackQueryHandler(audio_lang_callback, pattern="^alang_"))
-    application.add_handler(CallbackQueryHandler(type_callback, pattern="^type_"))
-    application.add_handler(CallbackQueryHandler(effect_mode_callback, pattern="^effect_mode_"))
-    application.add_handler(CallbackQueryHandler(effect_preset_callback, pattern="^effect_preset_"))
-    application.add_handler(CallbackQueryHandler(quality_callback, pattern="^quality_"))
-    application.add_handler(CallbackQueryHandler(premium_callback, pattern="^premium_"))
-    application.add_handler(PreCheckoutQueryHandler(precheckout_callback))
-    application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_handler))
-    application.add_handler(
-        MessageHandler(filters.ALL & ~filters.COMMAND, handle_message)
-    )
-
-    async def _error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-        _ = update
-        err = getattr(context, "error", None)
-        if err is None:
-            return
-        if isinstance(err, (TimedOut, NetworkError, BadRequest)):
-            logger.debug("Telegram error suppressed: %s", err.__class__.__name__)
-            return
-        logger.error("Telegram handler error: %s", err, exc_info=err)
-
-    application.add_error_handler(_error_handler)
-
-    logger.info("Bot started. Press Ctrl+C to stop.")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
-
-
-if __name__ == "__main__":
-    main()
+import functools
+import io
+import logging
+import math
+import mmap
+import os
+import re
+import asyncio
+import concurrent.futures
+import contextlib
+import json
+import base64
+import time
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from urllib.parse import urlencode, urlparse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, LabeledPrice, Update
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.ext import (
+    Application,
+    CallbackQueryHandler,
+    CommandHandler,
+    ContextTypes,
+    MessageHandler,
+    PreCheckoutQueryHandler,
+    filters,
+)
+from telegram.request import HTTPXRequest
+import requests
+from requests.adapters import HTTPAdapter
+import yt_dlp
+from yt_dlp.utils import DownloadError
+import imageio_ffmpeg
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson est optionnel
+    orjson = None
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:  # pragma: no cover - selectolax est optionnel
+    HTMLParser = None
+
+# HTTP/2 pour l'API Telegram si l'extra httpx[http2] est présent.
+try:
+    import h2  # noqa: F401  # pylint: disable=unused-import
+
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy est optionnel
+    np = None
+
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO,
+)
+logger = logging.getLogger(__name__)
+for _name, _level in (
+    ("httpx", logging.WARNING),
+    ("httpcore", logging.CRITICAL),
+    ("telegram", logging.CRITICAL),
+    ("telegram.ext", logging.CRITICAL),
+):
+    _lg = logging.getLogger(_name)
+    _lg.setLevel(_level)
+    _lg.propagate = False
+    _lg.addHandler(logging.NullHandler())
+
+# Déplaçable vers un tmpfs / répertoire temporaire via l'env (ex. sous
+# TMPDIR) pour profiter des politiques de purge du système.
+DOWNLOAD_DIR = Path(os.getenv("DOWNLOAD_DIR", "downloads"))
+DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+MAX_FILE_SIZE_BYTES = 50 * 1024 * 1024  # ~50 Mo
+IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "bmp"}
+
+BOT_USERNAME = os.getenv("BOT_USERNAME")
+SHARE_PROMPTED_CHATS: OrderedDict[int, None] = OrderedDict()
+SHARE_PROMPTED_CHATS_MAX = 10_000
+
+TIKTOK_FILE_ID_CACHE: OrderedDict[str, str] = OrderedDict()
+TIKTOK_FILE_ID_CACHE_MAX = 200
+
+# file_id Telegram par (url, qualité, langue audio): sur un lien déjà traité,
+# renvoyer le file_id évite yt-dlp, l'écriture disque et le re-upload complet.
+MEDIA_FILE_ID_CACHE: OrderedDict[tuple[str, str, str], tuple[float, str]] = OrderedDict()
+MEDIA_FILE_ID_CACHE_MAX = 2000
+MEDIA_FILE_ID_TTL = 24 * 3600.0
+
+USER_STORE_PATH = Path("user_store.json")
+USER_STORE_LOCK = asyncio.Lock()
+
+PREMIUM_DURATION_SECONDS = 30 * 24 * 60 * 60
+PREMIUM_30D_STARS = 299
+CREDITS_10_STARS = 99
+CREDITS_50_STARS = 399
+FREE_EFFECTS_PER_DAY = 2
+AD_EVERY_SUCCESS_COUNT = 5
+
+def _int_env(name: str, default: int) -> int:
+    raw = os.getenv(name)
+    if not raw:
+        return default
+    try:
+        v = int(raw)
+    except ValueError:
+        return default
+    return v if v > 0 else default
+
+MAX_CONCURRENT_DOWNLOADS = _int_env("MAX_CONCURRENT_DOWNLOADS", 1)
+# La moitié des cœurs par défaut: avec -threads 2 par processus ffmpeg,
+# le total de threads d'encodage reste proche du nombre de cœurs.
+MAX_CONCURRENT_FFMPEG_JOBS = _int_env(
+    "MAX_CONCURRENT_FFMPEG_JOBS", max(1, (os.cpu_count() or 4) // 2)
+)
+CLEANUP_DOWNLOADS_MAX_AGE_HOURS = _int_env("CLEANUP_DOWNLOADS_MAX_AGE_HOURS", 72)
+CLEANUP_DOWNLOADS_INTERVAL_SECONDS = _int_env("CLEANUP_DOWNLOADS_INTERVAL_SECONDS", 300)
+CLEANUP_DOWNLOADS_MAX_BYTES = _int_env(
+    "CLEANUP_DOWNLOADS_MAX_BYTES", 2 * 1024 * 1024 * 1024
+)
+
+DOWNLOAD_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+# Pool dédié aux téléchargements yt-dlp: les rafales n'affament pas le pool
+# par défaut d'asyncio.to_thread (résolution de liens, scraping, I/O store).
+_DOWNLOAD_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=8, thread_name_prefix="ydl"
+)
+FFMPEG_SEMAPHORE = asyncio.Semaphore(MAX_CONCURRENT_FFMPEG_JOBS)
+
+# Porte d'envoi globale: un 429 de Telegram la ferme pour tout le monde
+# jusqu'à la fin de la fenêtre retry_after; le sémaphore borne les envois
+# simultanés sous la limite de l'API.
+SEND_GATE = asyncio.Event()
+SEND_GATE.set()
+SEND_BUCKET = asyncio.Semaphore(25)
+
+
+async def _ack(query) -> None:
+    """Accuse réception d'un callback sans bloquer le handler sur le RTT."""
+    try:
+        await query.answer()
+    except (BadRequest, NetworkError, TimedOut):
+        pass
+
+
+@dataclass(slots=True)
+class UserState:
+    """État par utilisateur du flux de téléchargement et d'effets.
+
+    Slotté: l'accès attribut évite le hachage de clé du dict user_data à
+    chaque lecture et l'empreinte mémoire par utilisateur est plus faible
+    que des entrées éparses."""
+
+    lang: str = "en"
+    last_url: str | None = None
+    last_action: str | None = None
+    last_quality: str | None = None
+    last_audio_lang: str | None = None
+    effects_mode: str | None = None
+    effects_preset_id: str | None = None
+    effects_ref_file: str | None = None
+    effects_ref_stats: dict | None = None
+    effects_user_file: str | None = None
+    effects_waiting_ref_url: bool = False
+    effects_waiting_video: bool = False
+    effects_entitlement_kind: str | None = None
+
+
+def _state(context) -> UserState:
+    s = context.user_data.get("_s")
+    if s is None:
+        s = UserState()
+        context.user_data["_s"] = s
+    return s
+
+
+_INFLIGHT_TTL = 60.0
+
+
+def _begin_inflight(context, key: str) -> bool:
+    """Marque une action comme en cours pour cet utilisateur; False si déjà en vol.
+
+    Un double-tap (ou un callback relivré par Telegram) lancerait sinon deux
+    téléchargements identiques. Le marqueur expire après _INFLIGHT_TTL au cas
+    où un crash du handler l'aurait laissé en place.
+    """
+    now = time.monotonic()
+    started = context.user_data.get(key)
+    if isinstance(started, float) and now - started < _INFLIGHT_TTL:
+        return False
+    context.user_data[key] = now
+    return True
+
+
+def _end_inflight(context, key: str) -> None:
+    context.user_data.pop(key, None)
+
+
+async def _send(method, *args, **kwargs):
+    """Exécute un envoi Telegram sous le jeton global et la porte 429."""
+    await SEND_GATE.wait()
+    async with SEND_BUCKET:
+        try:
+            return await method(*args, **kwargs)
+        except RetryAfter as e:
+            SEND_GATE.clear()
+            asyncio.get_running_loop().call_later(
+                float(e.retry_after) + 0.5, SEND_GATE.set
+            )
+            raise
+
+_YTDLP_COOKIEFILE_READY = False
+_YTDLP_COOKIEFILE: str | None = None
+
+
+def _get_ytdlp_cookiefile() -> str | None:
+    global _YTDLP_COOKIEFILE_READY
+    global _YTDLP_COOKIEFILE
+
+    def _split_netscape_fields(line: str) -> list[str] | None:
+        s = line.strip("\r\n")
+        if not s:
+            return None
+        if s.startswith("#HttpOnly_"):
+            s = s[len("#HttpOnly_") :]
+            http_only = True
+        else:
+            http_only = False
+        if s.lstrip().startswith("#"):
+            return None
+        parts = s.split("\t")
+        if len(parts) < 7:
+            parts = re.split(r"\s+", s.strip())
+        if len(parts) < 7:
+            return None
+        if len(parts) > 7:
+            parts = parts[:6] + [" ".join(parts[6:])]
+        if http_only:
+            parts[0] = "#HttpOnly_" + parts[0]
+        return parts
+
+    def _looks_like_netscape(text: str) -> bool:
+        for line in text.splitlines():
+            if _split_netscape_fields(line) is not None:
+                return True
+        return False
+
+    def _normalize_netscape_text(text: str) -> str:
+        stripped = text.lstrip()
+        json_candidate: str | None = None
+
+        if stripped.startswith("\"") or stripped.startswith("'"):
+            q = stripped[0]
+            if stripped.endswith(q) and len(stripped) >= 2:
+                json_candidate = stripped[1:-1]
+        if json_candidate is None:
+            json_candidate = stripped
+
+        data = None
+        if json_candidate.startswith("[") or json_candidate.startswith("{"):
+            try:
+                data = json.loads(json_candidate)
+            except Exception:
+                data = None
+        elif ("[" in json_candidate) or ("{" in json_candidate):
+            idxs = [i for i in (json_candidate.find("["), json_candidate.find("{")) if i >= 0]
+            start = min(idxs) if idxs else -1
+            if start >= 0:
+                try:
+                    data = json.loads(json_candidate[start:])
+                except Exception:
+                    data = None
+
+        if data is not None:
+            cookies: list[dict] = []
+            if isinstance(data, list):
+                cookies = [c for c in data if isinstance(c, dict)]
+            elif isinstance(data, dict):
+                if isinstance(data.get("cookies"), list):
+                    cookies = [c for c in data.get("cookies") if isinstance(c, dict)]
+                else:
+                    cookies = [data] if isinstance(data, dict) else []
+
+            if cookies:
+                lines: list[str] = []
+                for c in cookies:
+                    domain = c.get("domain")
+                    name = c.get("name")
+                    if not isinstance(domain, str) or not domain.strip():
+                        continue
+                    if not isinstance(name, str) or not name:
+                        continue
+                    domain = domain.strip()
+                    include_subdomains = "TRUE" if domain.startswith(".") else "FALSE"
+                    path = c.get("path")
+                    path = path if isinstance(path, str) and path else "/"
+                    secure = "TRUE" if bool(c.get("secure")) else "FALSE"
+                    expiry = c.get("expirationDate")
+                    if not isinstance(expiry, (int, float)):
+                        expiry = c.get("expires")
+                    if not isinstance(expiry, (int, float)):
+                        expiry = 0
+                    value = c.get("value")
+                    value = value if isinstance(value, str) else ""
+                    http_only = bool(c.get("httpOnly") or c.get("httponly") or c.get("http_only"))
+                    domain_field = ("#HttpOnly_" + domain) if http_only else domain
+                    lines.append(
+                        "\t".join(
+                            [
+                                domain_field,
+                                include_subdomains,
+                                path,
+                                secure,
+                                str(int(expiry)),
+                                name,
+                                value,
+                            ]
+                        )
+                    )
+                out_text = "\n".join(lines)
+                if not out_text.endswith("\n"):
+                    out_text += "\n"
+                return out_text
+
+        had_trailing_nl = text.endswith("\n")
+        lines: list[str] = []
+        for line in text.splitlines():
+            if not line:
+                lines.append(line)
+                continue
+            if line.lstrip().startswith("#") and not line.startswith("#HttpOnly_"):
+                lines.append(line)
+                continue
+            parts = _split_netscape_fields(line)
+            if parts is None:
+                lines.append(line)
+                continue
+            lines.append("\t".join(parts))
+        out_text = "\n".join(lines)
+        if had_trailing_nl and not out_text.endswith("\n"):
+            out_text += "\n"
+        return out_text
+
+    if _YTDLP_COOKIEFILE_READY:
+        return _YTDLP_COOKIEFILE
+
+    _YTDLP_COOKIEFILE_READY = True
+
+    cookie_path = os.getenv("YTDLP_COOKIES_PATH")
+    if cookie_path and os.path.exists(cookie_path):
+        try:
+            txt = Path(cookie_path).read_text(encoding="utf-8", errors="ignore")
+            if _looks_like_netscape(txt):
+                _YTDLP_COOKIEFILE = cookie_path
+                return _YTDLP_COOKIEFILE
+            logger.warning("yt-dlp cookies path: invalid Netscape format; ignoring")
+        except OSError:
+            pass
+        _YTDLP_COOKIEFILE = None
+        return None
+
+    raw = os.getenv("YTDLP_COOKIES")
+    if not raw:
+        _YTDLP_COOKIEFILE = None
+        return None
+
+    raw = raw.strip()
+    if raw.lower().startswith("base64:"):
+        b64 = raw.split(":", 1)[1].strip()
+        try:
+            raw = base64.b64decode(b64).decode("utf-8", errors="ignore")
+        except Exception:
+            _YTDLP_COOKIEFILE = None
+            return None
+
+    if "\\n" in raw and "\n" not in raw:
+        raw = raw.replace("\\n", "\n")
+
+    if "\\t" in raw and "\t" not in raw:
+        raw = raw.replace("\\t", "\t")
+
+    raw = _normalize_netscape_text(raw)
+    if "# netscape http cookie file" not in raw.lower():
+        raw = "# Netscape HTTP Cookie File\n" + raw
+
+    out = DOWNLOAD_DIR / "ytdlp_cookies.txt"
+    try:
+        out.write_text(raw, encoding="utf-8")
+    except OSError:
+        _YTDLP_COOKIEFILE = None
+        return None
+
+    try:
+        size = out.stat().st_size
+        sample = out.read_text(encoding="utf-8", errors="ignore")[:20000]
+        lower = sample.lower()
+        has_netscape = _looks_like_netscape(sample)
+        has_youtube = "youtube.com" in lower
+        has_google = "google.com" in lower
+
+        needed = [
+            "sid",
+            "hsid",
+            "ssid",
+            "apisid",
+            "sapisid",
+            "__secure-1psid",
+            "__secure-3psid",
+            "visitor_info1_live",
+        ]
+        present = [k for k in needed if k in lower]
+        has_auth = bool(present)
+        logger.info(
+            "yt-dlp cookies file: size=%d bytes, netscape=%s, youtube=%s, google=%s, auth=%s, auth_keys=%s",
+            int(size),
+            "yes" if has_netscape else "no",
+            "yes" if has_youtube else "no",
+            "yes" if has_google else "no",
+            "yes" if has_auth else "no",
+            ",".join(present) if present else "-",
+        )
+    except OSError:
+        pass
+
+    try:
+        full = out.read_text(encoding="utf-8", errors="ignore")
+        if not _looks_like_netscape(full):
+            logger.warning("yt-dlp cookies: invalid Netscape format; ignoring")
+            try:
+                non_comment: list[str] = []
+                for ln in full.splitlines():
+                    s = ln.strip("\r\n")
+                    if not s:
+                        continue
+                    if s.lstrip().startswith("#") and not s.startswith("#HttpOnly_"):
+                        continue
+                    non_comment.append(s[:300])
+                    if len(non_comment) >= 5:
+                        break
+                if non_comment:
+                    logger.info("yt-dlp cookies: first non-comment lines: %s", " | ".join(non_comment))
+            except Exception:
+                pass
+            try:
+                out.unlink()
+            except OSError:
+                pass
+            _YTDLP_COOKIEFILE = None
+            return None
+    except OSError:
+        _YTDLP_COOKIEFILE = None
+        return None
+
+    _YTDLP_COOKIEFILE = str(out)
+    return _YTDLP_COOKIEFILE
+
+def _safe_remove(path: str | None) -> None:
+    # os.unlink échoue déjà proprement si le fichier n'existe pas: inutile
+    # de payer un stat() supplémentaire avec os.path.exists avant.
+    with contextlib.suppress(OSError, TypeError):
+        if path:
+            os.unlink(path)
+
+def _rm_all(paths) -> None:
+    """Supprime une liste de fichiers en un seul saut de thread."""
+    for p in paths:
+        _safe_remove(p)
+
+
+async def _aio_remove(path: str | None) -> None:
+    """Supprime un fichier depuis le threadpool: un unlink sur un volume lent
+    (NFS, disque conteneurisé) bloquerait sinon tout l'event loop."""
+    if path:
+        await asyncio.to_thread(_safe_remove, path)
+
+
+# Artefacts persistants qui vivent dans DOWNLOAD_DIR sans être des
+# téléchargements: le cookiefile y est écrit au chargement du module et
+# COMMON_YDL_OPTS le référence pour toute la vie du process — le balayer
+# casserait silencieusement l'authentification yt-dlp.
+_CLEANUP_KEEP_NAMES = frozenset({"ytdlp_cookies.txt"})
+
+
+def _cleanup_download_dir_if_needed() -> None:
+    """Purge downloads/: fichiers trop vieux, puis quota d'octets total.
+
+    Un handler tué en plein téléchargement (crash, SIGKILL, NetworkError
+    pendant la réponse) laisse son fichier derrière lui: sans balayage
+    périodique le répertoire grossit jusqu'à l'ENOSPC.
+    """
+    if CLEANUP_DOWNLOADS_MAX_AGE_HOURS <= 0:
+        return
+    cutoff = time.time() - (CLEANUP_DOWNLOADS_MAX_AGE_HOURS * 3600)
+    entries: list[tuple[float, int, str]] = []
+    try:
+        with os.scandir(DOWNLOAD_DIR) as it:
+            for entry in it:
+                if entry.name in _CLEANUP_KEEP_NAMES:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if st.st_mtime < cutoff:
+                    _safe_remove(entry.path)
+                else:
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+    except OSError:
+        return
+
+    if CLEANUP_DOWNLOADS_MAX_BYTES <= 0:
+        return
+    total = sum(size for _, size, _ in entries)
+    if total <= CLEANUP_DOWNLOADS_MAX_BYTES:
+        return
+    entries.sort()  # les plus anciens d'abord
+    for _, size, path in entries:
+        _safe_remove(path)
+        total -= size
+        if total <= CLEANUP_DOWNLOADS_MAX_BYTES:
+            break
+
+
+async def _periodic_download_cleanup() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(CLEANUP_DOWNLOADS_INTERVAL_SECONDS)
+        try:
+            await loop.run_in_executor(None, _cleanup_download_dir_if_needed)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Periodic download cleanup failed")
+
+def _start_healthcheck_server_if_needed() -> None:
+    port_raw = os.getenv("PORT")
+    if not port_raw:
+        return
+    try:
+        port = int(port_raw)
+    except ValueError:
+        return
+    if port <= 0:
+        return
+
+    class _HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # noqa: N802
+            if self.path in ("/", "/health", "/healthz"):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.end_headers()
+                self.wfile.write(b"ok")
+                return
+            self.send_response(404)
+            self.end_headers()
+
+        def log_message(self, format: str, *args) -> None:  # noqa: A002
+            return
+
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _HealthHandler)
+    except OSError:
+        return
+
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+
+
+_DAY_KEY_CACHE: tuple[int, str] | None = None
+
+
+def _today_key() -> str:
+    global _DAY_KEY_CACHE
+    day = int(time.time()) // 86400
+    cached = _DAY_KEY_CACHE
+    if cached is not None and cached[0] == day:
+        return cached[1]
+    key = time.strftime("%Y-%m-%d", time.gmtime(day * 86400))
+    _DAY_KEY_CACHE = (day, key)
+    return key
+
+
+_USER_STORE_MMAP_THRESHOLD = 64_000
+
+# Champs numériques coercés en int une fois au chargement, pour que les chemins
+# chauds lisent des valeurs déjà propres au lieu de revalider à chaque accès.
+_USER_STORE_INT_FIELDS = (
+    "credits",
+    "premium_until",
+    "success_count",
+    "effects_free_used",
+    "ref_count",
+)
+
+
+def _normalize_user_store(data: dict) -> dict:
+    for key, rec in list(data.items()):
+        if not isinstance(rec, dict):
+            data[key] = {}
+            continue
+        for field in _USER_STORE_INT_FIELDS:
+            v = rec.get(field)
+            if v is None:
+                continue
+            rec[field] = int(v) if isinstance(v, (int, float)) and v > 0 else 0
+    return data
+
+
+def _load_user_store_sync() -> dict:
+    if not USER_STORE_PATH.exists():
+        return {}
+    try:
+        if orjson is not None:
+            with open(USER_STORE_PATH, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    return {}
+                if size < _USER_STORE_MMAP_THRESHOLD:
+                    data = orjson.loads(f.read())
+                else:
+                    # Gros store: mmap évite la copie intermédiaire en mémoire.
+                    with mmap.mmap(f.fileno(), size, prot=mmap.PROT_READ) as mm:
+                        mv = memoryview(mm)
+                        try:
+                            data = orjson.loads(mv)
+                        finally:
+                            mv.release()
+        else:
+            raw = USER_STORE_PATH.read_bytes()
+            if not raw:
+                return {}
+            data = json.loads(raw)
+        return _normalize_user_store(data) if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def _dump_user_store(store: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(store)
+    return json.dumps(store, ensure_ascii=False).encode("utf-8")
+
+
+def _atomic_write_user_store(payload: bytes) -> None:
+    tmp = USER_STORE_PATH.with_suffix(".tmp")
+    tmp.write_bytes(payload)
+    os.replace(tmp, USER_STORE_PATH)
+
+
+_USER_STORE_CACHE: dict | None = None
+# Les champs durables (credits, premium_until, ...) déclenchent une écriture
+# rapide; les compteurs jetables (success_count, quota effets) peuvent attendre.
+_STORE_DIRTY = asyncio.Event()
+_STORE_DIRTY_EPHEMERAL = asyncio.Event()
+_STORE_FLUSH_INTERVAL = 0.5
+_STORE_EPHEMERAL_FLUSH_INTERVAL = 300.0
+
+
+async def _ensure_store_loaded() -> dict:
+    """Charge user_store.json une seule fois; le dict en mémoire fait foi ensuite.
+
+    Le store vit dans l'event loop (mono-thread): les mutations sans await
+    entre lecture et écriture n'ont pas besoin de verrou. Seuls le premier
+    chargement et le couple instantané+écriture des flushers sont sérialisés
+    par USER_STORE_LOCK.
+    """
+    global _USER_STORE_CACHE
+    if _USER_STORE_CACHE is None:
+        async with USER_STORE_LOCK:
+            if _USER_STORE_CACHE is None:
+                _USER_STORE_CACHE = await asyncio.to_thread(_load_user_store_sync)
+    return _USER_STORE_CACHE
+
+
+async def _flush_user_store_now() -> None:
+    store = _USER_STORE_CACHE
+    if store is None:
+        return
+    _STORE_DIRTY.clear()
+    _STORE_DIRTY_EPHEMERAL.clear()
+    async with USER_STORE_LOCK:
+        # Instantané synchrone: aucune mutation ne peut s'intercaler avant l'await.
+        # L'écriture reste sous le verrou: deux flushers (durable, éphémère,
+        # arrêt) ne doivent jamais toucher user_store.tmp en parallèle, sinon
+        # un os.replace peut publier un fichier tronqué ou un instantané
+        # périmé par-dessus un plus récent.
+        payload = _dump_user_store(store)
+        await asyncio.to_thread(_atomic_write_user_store, payload)
+
+
+async def _store_flusher() -> None:
+    """Coalesce les écritures du store: au plus une écriture disque par intervalle."""
+    while True:
+        await _STORE_DIRTY.wait()
+        await asyncio.sleep(_STORE_FLUSH_INTERVAL)
+        try:
+            await _flush_user_store_now()
+        except Exception:
+            logger.exception("User store flush failed")
+
+
+async def _ephemeral_store_flusher() -> None:
+    """Persiste les compteurs jetables à intervalle long; leur perte est bénigne."""
+    while True:
+        await _STORE_DIRTY_EPHEMERAL.wait()
+        await asyncio.sleep(_STORE_EPHEMERAL_FLUSH_INTERVAL)
+        try:
+            await _flush_user_store_now()
+        except Exception:
+            logger.exception("User store flush failed")
+
+
+# Sentinelle immuable pour les utilisateurs inconnus: évite d'allouer un dict
+# jetable à chaque rendu de menu. Réservée aux chemins en lecture seule.
+_EMPTY_REC: MappingProxyType = MappingProxyType({})
+
+
+async def _get_user_record(user_id: int) -> dict | MappingProxyType:
+    if not isinstance(user_id, int) or user_id <= 0:
+        return _EMPTY_REC
+    store = await _ensure_store_loaded()
+    rec = store.get(str(user_id))
+    if not isinstance(rec, dict):
+        return _EMPTY_REC
+    return rec
+
+
+def _int_or(rec: dict, key: str, default: int = 0) -> int:
+    """Lit un champ numérique du store en un seul accès, avec défaut si absent/invalide."""
+    v = rec.get(key)
+    if isinstance(v, int):
+        return v if v > 0 else default
+    if isinstance(v, float):
+        return int(v) if v > 0 else default
+    return default
+
+
+def _is_premium_now(rec: dict) -> bool:
+    return _int_or(rec, "premium_until") > int(time.time())
+
+
+def _get_credits(rec: dict) -> int:
+    return _int_or(rec, "credits")
+
+
+async def _grant_premium(user_id: int, seconds: int) -> None:
+    if seconds <= 0:
+        return
+    store = await _ensure_store_loaded()
+    key = str(user_id)
+    rec = store.get(key)
+    if not isinstance(rec, dict):
+        rec = {}
+    now = int(time.time())
+    base = _int_or(rec, "premium_until")
+    if base < now:
+        base = now
+    rec["premium_until"] = base + int(seconds)
+    store[key] = rec
+    _STORE_DIRTY.set()
+
+
+async def _add_credits(user_id: int, amount: int) -> None:
+    if amount <= 0:
+        return
+    store = await _ensure_store_loaded()
+    key = str(user_id)
+    rec = store.get(key)
+    if not isinstance(rec, dict):
+        rec = {}
+    rec["credits"] = max(0, _get_credits(rec) + int(amount))
+    store[key] = rec
+    _STORE_DIRTY.set()
+
+
+async def _plan_effect_entitlement(user_id: int) -> str | None:
+    store = await _ensure_store_loaded()
+    key = str(user_id)
+    rec = store.get(key)
+    if not isinstance(rec, dict):
+        rec = {}
+
+    if _is_premium_now(rec):
+        return "premium"
+
+    today = _today_key()
+    used_count = 0 if rec.get("effects_free_day") != today else _int_or(rec, "effects_free_used")
+    if used_count < FREE_EFFECTS_PER_DAY:
+        return "free"
+
+    credits = _get_credits(rec)
+    if credits > 0:
+        return "credit"
+
+    return None
+
+
+async def _finalize_effect_entitlement(user_id: int, kind: str | None) -> None:
+    if kind not in ("premium", "free", "credit"):
+        return
+    if kind == "premium":
+        return
+    store = await _ensure_store_loaded()
+    key = str(user_id)
+    rec = store.get(key)
+    if not isinstance(rec, dict):
+        rec = {}
+
+    today = _today_key()
+    used_count = 0 if rec.get("effects_free_day") != today else _int_or(rec, "effects_free_used")
+
+    if kind == "free":
+        rec["effects_free_day"] = today
+        rec["effects_free_used"] = used_count + 1
+        _STORE_DIRTY_EPHEMERAL.set()
+    elif kind == "credit":
+        credits = _get_credits(rec)
+        rec["credits"] = max(0, credits - 1)
+        _STORE_DIRTY.set()
+
+    store[key] = rec
+
+
+async def _bump_success_and_should_show_ad(user_id: int) -> bool:
+    if AD_EVERY_SUCCESS_COUNT <= 0:
+        return False
+    store = await _ensure_store_loaded()
+    # Incrément atomique du point de vue de l'event loop: aucun await entre la
+    # lecture et l'écriture, donc pas de comptes faussés sous trafic en rafale.
+    rec = store.setdefault(str(user_id), {})
+    if not isinstance(rec, dict):
+        rec = store[str(user_id)] = {}
+    cnt = _int_or(rec, "success_count") + 1
+    rec["success_count"] = cnt
+    _STORE_DIRTY_EPHEMERAL.set()
+    return (cnt % AD_EVERY_SUCCESS_COUNT) == 0
+
+
+def _format_premium_until(ts: int, lang: str) -> str:
+    try:
+        dt = time.gmtime(int(ts))
+        return time.strftime("%d/%m/%Y", dt) if lang == "fr" else time.strftime("%Y-%m-%d", dt)
+    except Exception:
+        return ""
+
+
+def _ref_link_for_user(user_id: int) -> str | None:
+    bot_link = _get_bot_link()
+    if not bot_link:
+        return None
+    if not isinstance(user_id, int) or user_id <= 0:
+        return None
+    return bot_link + "?start=" + f"ref_{user_id}"
+
+
+async def _apply_referral(new_user_id: int, ref_user_id: int) -> bool:
+    if not isinstance(new_user_id, int) or not isinstance(ref_user_id, int):
+        return False
+    if new_user_id <= 0 or ref_user_id <= 0:
+        return False
+    if new_user_id == ref_user_id:
+        return False
+
+    store = await _ensure_store_loaded()
+
+    new_rec = store.setdefault(str(new_user_id), {})
+    if not isinstance(new_rec, dict):
+        new_rec = store[str(new_user_id)] = {}
+    if new_rec.get("referred_by"):
+        return False
+
+    ref_rec = store.setdefault(str(ref_user_id), {})
+    if not isinstance(ref_rec, dict):
+        ref_rec = store[str(ref_user_id)] = {}
+
+    new_rec["referred_by"] = str(ref_user_id)
+    new_rec["credits"] = _get_credits(new_rec) + 2
+
+    ref_rec["ref_count"] = _int_or(ref_rec, "ref_count") + 1
+    ref_rec["credits"] = _get_credits(ref_rec) + 5
+
+    _STORE_DIRTY.set()
+    return True
+
+
+# Figé à l'import: yt-dlp appelle debug() pour chaque ligne de progression, un
+# simple test de booléen évite isEnabledFor + formatage sur ce chemin très chaud.
+_DEBUG_ENABLED = logger.isEnabledFor(logging.DEBUG)
+
+
+class _YtDlpLogger:
+    def debug(self, msg):
+        if _DEBUG_ENABLED:
+            logger.debug("yt-dlp: %s", msg)
+
+    info = debug
+    warning = debug
+
+    def error(self, msg):
+        logger.error("yt-dlp: %s", msg)
+
+
+# En-têtes navigateur partagés par la session HTTP et yt-dlp; surchargés
+# par YTDLP_USER_AGENT / YTDLP_ACCEPT_LANGUAGE.
+_USER_AGENT = os.getenv(
+    "YTDLP_USER_AGENT",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0 Safari/537.36",
+)
+_ACCEPT_LANGUAGE = os.getenv("YTDLP_ACCEPT_LANGUAGE", "en-US,en;q=0.9,fr;q=0.8")
+
+# Session HTTP partagée: keep-alive TLS + gzip pour les petites requêtes
+# (résolution de liens courts, API de syndication Twitter).
+_HTTP = requests.Session()
+_HTTP.headers.update(
+    {
+        "User-Agent": _USER_AGENT,
+        "Accept-Language": _ACCEPT_LANGUAGE,
+        "Accept-Encoding": "gzip, deflate",
+    }
+)
+_HTTP_ADAPTER = HTTPAdapter(pool_connections=16, pool_maxsize=64)
+_HTTP.mount("https://", _HTTP_ADAPTER)
+_HTTP.mount("http://", _HTTP_ADAPTER)
+
+
+# Le même lien court est souvent cliqué par plusieurs utilisateurs coup sur
+# coup: petit cache TTL pour éviter de rejouer la chasse aux redirections.
+_RESOLVE_URL_CACHE: OrderedDict[str, tuple[float, str]] = OrderedDict()
+_RESOLVE_URL_CACHE_MAX = 1024
+_RESOLVE_URL_TTL = 3600.0
+
+
+def _resolve_final_url(url: str) -> str:
+    """Suit les redirections (liens courts TikTok) et retourne l'URL finale.
+
+    Une requête HEAD suffit pour connaître l'URL finale sans télécharger la
+    page d'atterrissage; certains fournisseurs refusent HEAD, auquel cas on
+    retombe sur un GET streamé fermé sans lire le corps.
+    """
+    key = url.split("#", 1)[0]
+    hit = _RESOLVE_URL_CACHE.get(key)
+    if hit is not None and time.monotonic() - hit[0] < _RESOLVE_URL_TTL:
+        return hit[1]
+
+    resp = _HTTP.head(url, allow_redirects=True, timeout=20)
+    if resp.status_code in (403, 405):
+        resp = _HTTP.get(url, allow_redirects=True, timeout=20, stream=True)
+        resp.close()
+
+    _RESOLVE_URL_CACHE[key] = (time.monotonic(), resp.url)
+    if len(_RESOLVE_URL_CACHE) > _RESOLVE_URL_CACHE_MAX:
+        _RESOLVE_URL_CACHE.popitem(last=False)
+    return resp.url
+
+
+_RE_TWEET_ID = re.compile(r"/status/(\d+)")
+_RE_NAME_PARAM = re.compile(r"([?&])name=[^&]*")
+
+
+def _twitter_image_url_to_orig(u: str) -> str:
+    """Force name=orig sur une URL twimg pour obtenir l'image pleine résolution.
+
+    Simple épissure de querystring: pas besoin du détour
+    urlparse/parse_qs/urlencode pour remplacer un seul paramètre.
+    """
+    if "twimg.com" not in u:
+        return u
+    if "name=" in u:
+        return _RE_NAME_PARAM.sub(r"\1name=orig", u, count=1)
+    sep = "&" if "?" in u else "?"
+    return f"{u}{sep}name=orig"
+
+
+def _extract_twitter_photo_urls_from_syndication(tweet_url: str) -> tuple[list[str], str | None]:
+    """Récupère les photos d'un tweet via l'API de syndication publique."""
+    try:
+        m = _RE_TWEET_ID.search(urlparse(tweet_url).path)
+    except Exception:  # pylint: disable=broad-except
+        return [], None
+    if not m:
+        return [], None
+    api_url = "https://cdn.syndication.twimg.com/tweet-result?" + urlencode(
+        {"id": m.group(1), "lang": "en", "token": "x"}
+    )
+    try:
+        resp = _HTTP.get(api_url, timeout=20)
+        resp.raise_for_status()
+        # Parse directement les octets (orjson, sinon json qui accepte
+        # aussi bytes) au lieu du détour décodage -> str de resp.json().
+        if orjson is not None:
+            data = orjson.loads(resp.content)
+        else:
+            data = json.loads(resp.content)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Error fetching tweet syndication data")
+        return [], None
+    if not isinstance(data, dict):
+        return [], None
+
+    urls: list[str] = []
+    photos = data.get("photos")
+    if isinstance(photos, list):
+        for p in photos:
+            if isinstance(p, dict):
+                u = p.get("url")
+                if isinstance(u, str) and u.startswith("http"):
+                    urls.append(u)
+    if not urls:
+        media = data.get("mediaDetails")
+        if isinstance(media, list):
+            for p in media:
+                if isinstance(p, dict) and p.get("type") == "photo":
+                    u = p.get("media_url_https")
+                    if isinstance(u, str) and u.startswith("http"):
+                        urls.append(u)
+
+    title = data.get("text") if isinstance(data.get("text"), str) else None
+    return list(dict.fromkeys(urls)), title
+
+
+@functools.lru_cache(maxsize=1)
+def _ffmpeg_exe() -> str:
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+COMMON_YDL_OPTS = {
+    "quiet": True,
+    "no_warnings": True,
+    "noprogress": True,
+    "logger": _YtDlpLogger(),
+    "ffmpeg_location": os.getenv("YTDLP_FFMPEG_LOCATION") or _ffmpeg_exe(),
+    "http_headers": {
+        "User-Agent": _USER_AGENT,
+        "Accept-Language": _ACCEPT_LANGUAGE,
+    },
+}
+
+_cookiefile = _get_ytdlp_cookiefile()
+if _cookiefile:
+    COMMON_YDL_OPTS["cookiefile"] = _cookiefile
+    logger.info("yt-dlp cookies: enabled")
+else:
+    logger.info("yt-dlp cookies: not configured")
+
+
+def _is_youtube_antibot_error(error_text: str) -> bool:
+    if not isinstance(error_text, str) or not error_text:
+        return False
+    s = error_text.lower()
+    return (
+        "sign in to confirm" in s
+        or "confirm you’re not a bot" in s
+        or "confirm you're not a bot" in s
+    )
+
+
+def _youtube_antibot_user_message(lang: str) -> str:
+    if lang == "fr":
+        return (
+            "⚠️ YouTube bloque ce serveur (vérification anti-bot).\n\n"
+            "✅ TikTok/Instagram/Facebook/etc. marchent souvent.\n"
+            "❌ Pour YouTube, si tu es l’admin: ajoute des cookies YouTube sur Koyeb "
+            "(variable `YTDLP_COOKIES`, format cookies.txt)."
+        )
+    return (
+        "⚠️ YouTube is blocking this server (anti-bot verification).\n\n"
+        "✅ TikTok/Instagram/Facebook/etc. often work.\n"
+        "❌ For YouTube, if you are the admin: add YouTube cookies on Koyeb "
+        "(env var `YTDLP_COOKIES`, cookies.txt format)."
+    )
+
+
+def get_user_lang(update: Update) -> str:
+    """Retourne 'fr' si l'utilisateur est en français, sinon 'en'."""
+    language_code = None
+    if update.effective_user is not None:
+        language_code = update.effective_user.language_code
+    if language_code and language_code.lower().startswith("fr"):
+        return "fr"
+    return "en"
+
+
+_MESSAGES = {
+    "start": {
+        "fr": (
+            "🚀 Téléchargeur vidéo & audio\n\n"
+            "🔗 Colle un lien et je m'occupe du reste.\n\n"
+            "🧪 Exemple : https://www.youtube.com/watch?v=abc123"
+        ),
+        "en": (
+            "🚀 Video & audio downloader\n\n"
+            "🔗 Paste a link and I do the rest.\n\n"
+            "🧪 Example: https://www.youtube.com/watch?v=abc123"
+        ),
+    },
+    "help": {
+        "fr": (
+            "ℹ️ Aide\n\n"
+            "✅ Comment télécharger :\n"
+            "1) 🔗 Envoie un lien\n"
+            "2) 🎬 Vidéo / 🎧 Audio (ou ✨ Effets)\n"
+            "3) ⚡ Choisis la qualité (HD/SD)\n"
+            "4) 🌍 Langue audio (si dispo)\n"
+            "5) 📩 Je t'envoie le fichier\n\n"
+            "🆕 Nouvelles fonctionnalités :\n"
+            "- 📶 Progression en direct (%, taille, vitesse, ETA)\n"
+            "- 🌍 Langue audio (🎧 Original / 🇫🇷 FR / 🇬🇧 EN, selon la vidéo)\n"
+            "- ⚡ TikTok rapide: certaines vidéos peuvent partir quasi instant\n"
+            "- ✨ Effets: copie le look (couleurs/contraste/saturation) d'une vidéo\n\n"
+            "📦 Limite : ~50 Mo par fichier."
+        ),
+        "en": (
+            "ℹ️ Help\n\n"
+            "✅ How to download:\n"
+            "1) 🔗 Send a link\n"
+            "2) 🎬 Video / 🎧 Audio (or ✨ Effects)\n"
+            "3) ⚡ Pick quality (HD/SD)\n"
+            "4) 🌍 Pick audio language (if available)\n"
+            "5) 📩 I send you the file\n\n"
+            "🆕 New features:\n"
+            "- 📶 Live progress (%, size, speed, ETA)\n"
+            "- 🌍 Audio language (🎧 Original / 🇫🇷 FR / 🇬🇧 EN, depends on the video)\n"
+            "- ⚡ Fast TikTok: some videos can be sent almost instantly\n"
+            "- ✨ Effects: copy the look (colors/contrast/saturation) from a reference\n\n"
+            "📦 Limit: ~50 MB per file."
+        ),
+    },
+    "menu": {
+        "fr": "🏠 Menu principal :",
+        "en": "🏠 Main menu:",
+    },
+    "supported_sites": {
+        "fr": "🌐 Sites supportés : YouTube, X/Twitter, Instagram, Facebook, TikTok.",
+        "en": "🌐 Supported sites: YouTube, X/Twitter, Instagram, Facebook, TikTok.",
+    },
+    "prompt_send_link": {
+        "fr": "🔗 Envoie un lien pour commencer.",
+        "en": "🔗 Send a link to get started.",
+    },
+    "share_cta": {
+        "fr": "🤝 Si ce bot t'aide, partage-le à un ami :",
+        "en": "🤝 If this bot helps you, share it with a friend:",
+    },
+    "share_button": {
+        "fr": "🚀 Partager le bot",
+        "en": "🚀 Share the bot",
+    },
+    "menu_button": {
+        "fr": "🏠 Menu",
+        "en": "🏠 Menu",
+    },
+    "help_button": {
+        "fr": "ℹ️ Aide",
+        "en": "ℹ️ Help",
+    },
+    "sites_button": {
+        "fr": "🌐 Sites",
+        "en": "🌐 Sites",
+    },
+    "premium_button": {
+        "fr": "⭐ Premium",
+        "en": "⭐ Premium",
+    },
+    "premium_menu_title": {
+        "fr": "⭐ Premium & Crédits",
+        "en": "⭐ Premium & Credits",
+    },
+    "premium_buy_month": {
+        "fr": "⭐ Premium 30j",
+        "en": "⭐ Premium 30d",
+    },
+    "premium_buy_credits10": {
+        "fr": "🎟️ 10 crédits",
+        "en": "🎟️ 10 credits",
+    },
+    "premium_buy_credits50": {
+        "fr": "🎟️ 50 crédits",
+        "en": "🎟️ 50 credits",
+    },
+    "premium_my_ref": {
+        "fr": "🎁 Mon lien parrainage",
+        "en": "🎁 My referral link",
+    },
+    "premium_need_more": {
+        "fr": "🔒 Cette option est Premium (ou nécessite des crédits).",
+        "en": "🔒 This option is Premium (or requires credits).",
+    },
+    "referral_bonus": {
+        "fr": "🎁 Parrainage activé ! Tu gagnes +2 crédits et ton ami +5 crédits.",
+        "en": "🎁 Referral activated! You get +2 credits and your friend gets +5 credits.",
+    },
+    "ad_text": {
+        "fr": (
+            "📢 Sponsorisé\n"
+            "⭐ Passe en Premium pour enlever les pubs + débloquer ✨ Effets illimités."
+        ),
+        "en": (
+            "📢 Sponsored\n"
+            "⭐ Go Premium to remove ads + unlock unlimited ✨ Effects."
+        ),
+    },
+    "retry_button": {
+        "fr": "🔁 Réessayer",
+        "en": "🔁 Retry",
+    },
+    "try_sd_button": {
+        "fr": "⚡ Passer en SD",
+        "en": "⚡ Try SD",
+    },
+    "try_hd_button": {
+        "fr": "✨ Passer en HD",
+        "en": "✨ Try HD",
+    },
+    "choose_audio_lang": {
+        "fr": "🌍 Choisis la langue de l'audio :",
+        "en": "🌍 Choose the audio language:",
+    },
+    "audio_lang_orig": {
+        "fr": "🎧 Original",
+        "en": "🎧 Original",
+    },
+    "audio_lang_fr": {
+        "fr": "🇫🇷 Français",
+        "en": "🇫🇷 French",
+    },
+    "audio_lang_en": {
+        "fr": "🇬🇧 Anglais",
+        "en": "🇬🇧 English",
+    },
+    "audio_lang_unavailable": {
+        "fr": "⚠️ Audio {wanted} indisponible pour cette vidéo. Je garde l'audio 🎧 original.",
+        "en": "⚠️ {wanted} audio not available for this video. Keeping 🎧 original audio.",
+    },
+    "error_try_again": {
+        "fr": "❌ Oups, ça n'a pas marché. Tu peux réessayer.",
+        "en": "❌ Something went wrong. You can try again.",
+    },
+    "invalid_url": {
+        "fr": (
+            "⚠️ Envoie un lien valide (URL commençant par http/https). "
+            "Utilise /help si besoin."
+        ),
+        "en": (
+            "⚠️ Please send a valid link (URL starting with http/https). "
+            "Use /help if needed."
+        ),
+    },
+    "processing": {
+        "fr": "⏳ Téléchargement en cours…",
+        "en": "⏳ Downloading…",
+    },
+    "too_big": {
+        "fr": (
+            "📦 Vidéo trop grande ({size_mb:.1f} Mo). Essaie une vidéo plus "
+            "courte ou de plus basse qualité."
+        ),
+        "en": (
+            "📦 Video is too large ({size_mb:.1f} MB). Try a shorter or "
+            "lower-quality video."
+        ),
+    },
+    "cleaned": {
+        "fr": "🧹 Fichier supprimé de mon côté pour économiser de l'espace.",
+        "en": "🧹 File removed on my side to save space.",
+    },
+    "choose_type": {
+        "fr": "🎛️ Choisis un format :",
+        "en": "🎛️ Choose a format:",
+    },
+    "effects_button": {
+        "fr": "✨ Effets",
+        "en": "✨ Effects",
+    },
+    "effects_intro": {
+        "fr": "✨ Effets Visuels\n\nChoisis ton mode :",
+        "en": "✨ Visual Effects\n\nChoose your mode:",
+    },
+    "effects_mode_preset": {
+        "fr": "🎨 Galerie d'effets",
+        "en": "🎨 Effects Gallery",
+    },
+    "effects_mode_steal": {
+        "fr": "🔥 Voler le style d'une vidéo",
+        "en": "🔥 Steal video style",
+    },
+    "effects_choose_preset": {
+        "fr": "🎨 Choisis ton effet :",
+        "en": "🎨 Choose your effect:",
+    },
+    "effects_preset_selected": {
+        "fr": "✅ Effet sélectionné : {effect_name}\n{effect_desc}\n\n📹 Envoie maintenant ta vidéo pour appliquer l'effet.",
+        "en": "✅ Effect selected: {effect_name}\n{effect_desc}\n\n📹 Now send your video to apply the effect.",
+    },
+    "effects_steal_intro": {
+        "fr": "🔥 Mode Vol de Style\n\nEnvoie le lien d'une vidéo dont tu veux copier le look (couleurs, ambiance, contraste).",
+        "en": "🔥 Style Stealing Mode\n\nSend the link of a video whose look you want to copy (colors, mood, contrast).",
+    },
+    "effects_need_ref": {
+        "fr": "❌ Erreur : impossible de charger la vidéo de référence.",
+        "en": "❌ Error: unable to load reference video.",
+    },
+    "effects_ready": {
+        "fr": "✅ Style capturé ! Envoie maintenant ta vidéo pour appliquer l'effet.",
+        "en": "✅ Style captured! Now send your video to apply the effect.",
+    },
+    "effects_processing": {
+        "fr": "⚙️ Application de l'effet en cours…",
+        "en": "⚙️ Applying effect…",
+    },
+    "effects_done": {
+        "fr": "✨ Effet appliqué avec succès !",
+        "en": "✨ Effect applied successfully!",
+    },
+    "photo_disabled": {
+        "fr": "🚫 Le téléchargement de photos est désactivé sur ce bot.",
+        "en": "🚫 Photo downloading is disabled on this bot.",
+    },
+    "choose_quality": {
+        "fr": "🎚️ Choisis la qualité de la vidéo :",
+        "en": "🎚️ Choose the video quality:",
+    },
+    "no_photo": {
+        "fr": (
+            "🖼️ Aucune photo téléchargeable n'a été trouvée pour ce lien. "
+            "(Ex: post uniquement vidéo ou contenu non supporté.)"
+        ),
+        "en": (
+            "🖼️ No downloadable photo was found for this link. "
+            "(E.g. video-only post or unsupported content.)"
+        ),
+    },
+    "no_video": {
+        "fr": (
+            "🎬 Aucune vidéo téléchargeable n'a été trouvée pour ce lien. "
+            "(Ex: tweet sans vidéo ou contenu non supporté.)"
+        ),
+        "en": (
+            "🎬 No downloadable video was found for this link. "
+            "(E.g. tweet without video or unsupported content.)"
+        ),
+    },
+    "no_url_saved": {
+        "fr": (
+            "🔗 Je n'ai pas de lien enregistré. Envoie-moi d'abord un lien "
+            "vidéo."
+        ),
+        "en": (
+            "🔗 I don't have any link saved. Please send me a video link "
+            "first."
+        ),
+    },
+    "error": {
+        "fr": (
+            "❌ Erreur : {error}\nVérifie le lien ou réessaie. Sites "
+            "supportés : YouTube, Twitter, Instagram, Facebook."
+        ),
+        "en": (
+            "❌ Error: {error}\nCheck the link or try again. Supported "
+            "sites: YouTube, Twitter, Instagram, Facebook."
+        ),
+    },
+    "premium_status_active": {
+        "fr": "✅ Premium actif jusqu'au {until}",
+        "en": "✅ Premium active until {until}",
+    },
+    "premium_status_free": {
+        "fr": "🆓 Mode gratuit",
+        "en": "🆓 Free mode",
+    },
+    "premium_credits_line": {
+        "fr": "🎟️ Crédits: {credits}",
+        "en": "🎟️ Credits: {credits}",
+    },
+    "premium_ref_line": {
+        "fr": "🎁 Ton lien parrainage: {link}",
+        "en": "🎁 Your referral link: {link}",
+    },
+    "premium_activated": {
+        "fr": "✅ Premium activé !",
+        "en": "✅ Premium activated!",
+    },
+    "credits_added_10": {
+        "fr": "✅ +10 crédits ajoutés !",
+        "en": "✅ +10 credits added!",
+    },
+    "credits_added_50": {
+        "fr": "✅ +50 crédits ajoutés !",
+        "en": "✅ +50 credits added!",
+    },
+    "invoice_premium_title": {
+        "fr": "⭐ Premium 30 jours",
+        "en": "⭐ Premium 30 days",
+    },
+    "invoice_premium_desc": {
+        "fr": "Sans pubs + Effets illimités + priorité",
+        "en": "No ads + unlimited Effects + priority",
+    },
+    "invoice_credits10_title": {
+        "fr": "🎟️ Pack 10 crédits",
+        "en": "🎟️ 10 credits pack",
+    },
+    "invoice_credits50_title": {
+        "fr": "🎟️ Pack 50 crédits",
+        "en": "🎟️ 50 credits pack",
+    },
+    "invoice_credits_desc": {
+        "fr": "Utilise-les pour ✨ Effets et options premium",
+        "en": "Use them for ✨ Effects and premium options",
+    },
+}
+
+
+def get_message(key: str, lang: str) -> str:
+    return _MESSAGES[key][lang]
+
+
+def _format_msg(key: str, lang: str, **kwargs) -> str:
+    # format_map évite la construction du dict intermédiaire de str.format.
+    return _MESSAGES[key][lang].format_map(kwargs)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_bot_link() -> str | None:
+    if not BOT_USERNAME:
+        return None
+    uname = BOT_USERNAME.strip()
+    if uname.startswith("@"):
+        uname = uname[1:]
+    if not uname:
+        return None
+    return f"https://t.me/{uname}"
+
+
+def _maybe_set_bot_username(username: str | None) -> None:
+    global BOT_USERNAME
+    if BOT_USERNAME:
+        return
+    if not username or not isinstance(username, str):
+        return
+    uname = username.strip()
+    if uname.startswith("@"):
+        uname = uname[1:]
+    if not uname:
+        return
+    BOT_USERNAME = uname
+    # Les caches dérivés du username (lien, partage, claviers) sont invalidés.
+    _get_bot_link.cache_clear()
+    _get_share_url.cache_clear()
+    _main_menu_keyboard.cache_clear()
+    _ad_keyboard.cache_clear()
+
+
+@functools.lru_cache(maxsize=4)
+def _get_share_url(lang: str) -> str | None:
+    bot_link = _get_bot_link()
+    if not bot_link:
+        return None
+    share_text = (
+        "Télécharge tes vidéos facilement ici" if lang == "fr" else "Download videos easily here"
+    )
+    return "https://t.me/share/url?" + urlencode({"url": bot_link, "text": share_text})
+
+
+@functools.lru_cache(maxsize=None)
+def _ad_keyboard(lang: str) -> InlineKeyboardMarkup:
+    share_url = _get_share_url(lang)
+    row: list[InlineKeyboardButton] = [
+        InlineKeyboardButton(get_message("premium_button", lang), callback_data="menu_premium")
+    ]
+    if share_url:
+        row.append(InlineKeyboardButton(get_message("share_button", lang), url=share_url))
+    return InlineKeyboardMarkup([row])
+
+
+async def _maybe_send_ad_after_success(message, lang: str) -> None:
+    chat = getattr(message, "chat", None)
+    user_id = None
+    if chat and getattr(chat, "type", None) == "private":
+        user_id = getattr(chat, "id", None)
+    if not isinstance(user_id, int) or user_id <= 0:
+        return
+
+    rec = await _get_user_record(user_id)
+    if _is_premium_now(rec):
+        return
+
+    should = await _bump_success_and_should_show_ad(user_id)
+    if not should:
+        return
+
+    try:
+        await message.reply_text(
+            get_message("ad_text", lang),
+            reply_markup=_ad_keyboard(lang),
+            disable_web_page_preview=True,
+        )
+    except (BadRequest, TimedOut, NetworkError):
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def _main_menu_keyboard(lang: str) -> InlineKeyboardMarkup:
+    share_url = _get_share_url(lang)
+    buttons = [
+        [
+            InlineKeyboardButton(get_message("help_button", lang), callback_data="menu_help"),
+            InlineKeyboardButton(get_message("sites_button", lang), callback_data="menu_sites"),
+        ]
+    ]
+    buttons.append(
+        [InlineKeyboardButton(get_message("premium_button", lang), callback_data="menu_premium")]
+    )
+    if share_url:
+        buttons.append(
+            [
+                InlineKeyboardButton(get_message("share_button", lang), url=share_url),
+                InlineKeyboardButton(get_message("menu_button", lang), callback_data="menu_main"),
+            ]
+        )
+    else:
+        buttons.append(
+            [InlineKeyboardButton(get_message("menu_button", lang), callback_data="menu_main")]
+        )
+    return InlineKeyboardMarkup(buttons)
+
+
+# Claviers purement statiques: construits une seule fois et partagés entre
+# toutes les requêtes (InlineKeyboardMarkup est immuable une fois envoyé).
+_QUALITY_KEYBOARD = InlineKeyboardMarkup(
+    [
+        [
+            InlineKeyboardButton("🔼 HD (meilleure qualité)", callback_data="quality_hd"),
+            InlineKeyboardButton("🔽 SD (rapide)", callback_data="quality_sd"),
+        ]
+    ]
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _audio_lang_keyboard(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(get_message("audio_lang_orig", lang), callback_data="alang_orig"),
+                InlineKeyboardButton(get_message("audio_lang_fr", lang), callback_data="alang_fr"),
+                InlineKeyboardButton(get_message("audio_lang_en", lang), callback_data="alang_en"),
+            ]
+        ]
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _effects_mode_keyboard(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    get_message("effects_mode_preset", lang), callback_data="effect_mode_preset"
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    get_message("effects_mode_steal", lang), callback_data="effect_mode_steal"
+                )
+            ],
+        ]
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _effect_preset_keyboard(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton(preset[f"name_{lang}"], callback_data=f"effect_preset_{preset_id}")]
+            for preset_id, preset in PRESET_EFFECTS.items()
+        ]
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _action_keyboard(lang: str, action: str, quality: str | None) -> InlineKeyboardMarkup:
+    buttons: list[list[InlineKeyboardButton]] = []
+    if action == "video":
+        retry_data = f"retry_video_{quality or 'hd'}"
+        row: list[InlineKeyboardButton] = [
+            InlineKeyboardButton(get_message("retry_button", lang), callback_data=retry_data)
+        ]
+        if quality == "hd":
+            row.append(
+                InlineKeyboardButton(get_message("try_sd_button", lang), callback_data="retry_video_sd")
+            )
+        elif quality == "sd":
+            row.append(
+                InlineKeyboardButton(get_message("try_hd_button", lang), callback_data="retry_video_hd")
+            )
+        buttons.append(row)
+    elif action == "audio":
+        buttons.append(
+            [InlineKeyboardButton(get_message("retry_button", lang), callback_data="retry_audio")]
+        )
+    buttons.append(
+        [InlineKeyboardButton(get_message("menu_button", lang), callback_data="menu_main")]
+    )
+    return InlineKeyboardMarkup(buttons)
+
+
+async def _maybe_send_share_prompt(message, lang: str) -> None:
+    chat_id = getattr(message, "chat_id", None)
+    if not isinstance(chat_id, int):
+        return
+    if chat_id in SHARE_PROMPTED_CHATS:
+        return
+    keyboard = _main_menu_keyboard(lang)
+    if not _get_bot_link():
+        return
+    await message.reply_text(
+        get_message("share_cta", lang),
+        reply_markup=keyboard,
+        disable_web_page_preview=True,
+    )
+    SHARE_PROMPTED_CHATS[chat_id] = None
+    if len(SHARE_PROMPTED_CHATS) > SHARE_PROMPTED_CHATS_MAX:
+        SHARE_PROMPTED_CHATS.popitem(last=False)
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not BOT_USERNAME:
+        _maybe_set_bot_username(getattr(context.bot, "username", None))
+    lang = get_user_lang(update)
+    msg = update.message or update.effective_message
+    if not msg:
+        return
+    args = getattr(context, "args", None)
+    if isinstance(args, list) and args:
+        arg0 = args[0]
+        if isinstance(arg0, str) and arg0.startswith("ref_"):
+            ref_part = arg0[4:]
+            try:
+                ref_id = int(ref_part)
+            except Exception:
+                ref_id = 0
+            if ref_id > 0 and update.effective_user:
+                ok = await _apply_referral(update.effective_user.id, ref_id)
+                if ok:
+                    await msg.reply_text(get_message("referral_bonus", lang))
+    await msg.reply_text(
+        get_message("start", lang),
+        reply_markup=_main_menu_keyboard(lang),
+        disable_web_page_preview=True,
+    )
+
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not BOT_USERNAME:
+        _maybe_set_bot_username(getattr(context.bot, "username", None))
+    lang = get_user_lang(update)
+    msg = update.message or update.effective_message
+    if not msg:
+        return
+    await msg.reply_text(
+        get_message("help", lang),
+        reply_markup=_main_menu_keyboard(lang),
+        disable_web_page_preview=True,
+    )
+
+
+async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not BOT_USERNAME:
+        _maybe_set_bot_username(getattr(context.bot, "username", None))
+    lang = get_user_lang(update)
+    msg = update.message or update.effective_message
+    if not msg:
+        return
+    await msg.reply_text(
+        get_message("menu", lang),
+        reply_markup=_main_menu_keyboard(lang),
+        disable_web_page_preview=True,
+    )
+
+
+def callback_preamble(fn):
+    """Préambule commun des callbacks boutons.
+
+    Fait une seule fois par update ce que chaque handler répétait: garde sur
+    callback_query, propagation du username du bot, ack en tâche de fond et
+    détection de la langue, rangée dans l'état utilisateur slotté.
+    """
+
+    @functools.wraps(fn)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        query = update.callback_query
+        if not query:
+            return
+        if not BOT_USERNAME:
+            _maybe_set_bot_username(getattr(context.bot, "username", None))
+        asyncio.create_task(_ack(query))
+        _state(context).lang = get_user_lang(update)
+        await fn(update, context)
+
+    return wrapper
+
+
+@callback_preamble
+async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    lang = _state(context).lang
+    data = query.data or ""
+    if data == "menu_main":
+        await query.message.reply_text(
+            get_message("menu", lang),
+            reply_markup=_main_menu_keyboard(lang),
+            disable_web_page_preview=True,
+        )
+        return
+    if data == "menu_help":
+        await query.message.reply_text(
+            get_message("help", lang),
+            reply_markup=_main_menu_keyboard(lang),
+            disable_web_page_preview=True,
+        )
+    elif data == "menu_sites":
+        await query.message.reply_text(
+            get_message("supported_sites", lang),
+            reply_markup=_main_menu_keyboard(lang),
+            disable_web_page_preview=True,
+        )
+    elif data == "menu_premium":
+        await _send_premium_menu(query.message, update, lang)
+
+
+_HTTP_URL_RE = re.compile(r"https?://\S+")
+
+
+def is_http_url(text: str) -> bool:
+    return text.startswith(("http://", "https://"))
+
+
+def extract_first_url(text: str) -> str | None:
+    match = _HTTP_URL_RE.search(text)
+    if not match:
+        return None
+    url = match.group(0)
+    return url.rstrip(".,;:!?)]}")
+
+
+def normalize_url(url: str) -> str:
+    try:
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        path = parsed.path
+
+        if ("x.com" in host or "twitter.com" in host) and "/status/" in path:
+            return f"{parsed.scheme}://{parsed.netloc}{path}"
+
+        if "tiktok.com" in host and ("/photo/" in path or "/video/" in path):
+            return f"{parsed.scheme}://{parsed.netloc}{path}"
+    except Exception:  # pylint: disable=broad-except
+        return url
+
+    return url
+
+
+_TIKTOK_VIDEO_ID_RE = re.compile(r"/video/(\d+)")
+
+
+def _tiktok_video_id_from_url(url: str) -> str | None:
+    try:
+        path = urlparse(url).path
+    except Exception:  # pylint: disable=broad-except
+        return None
+    m = _TIKTOK_VIDEO_ID_RE.search(path)
+    if not m:
+        return None
+    return m.group(1)
+
+
+def _cache_tiktok_file_id(video_id: str, file_id: str) -> None:
+    if not video_id or not file_id:
+        return
+    TIKTOK_FILE_ID_CACHE[video_id] = file_id
+    TIKTOK_FILE_ID_CACHE.move_to_end(video_id)
+    if len(TIKTOK_FILE_ID_CACHE) > TIKTOK_FILE_ID_CACHE_MAX:
+        TIKTOK_FILE_ID_CACHE.popitem(last=False)
+
+
+def _lookup_tiktok_file_id(video_id: str) -> str | None:
+    file_id = TIKTOK_FILE_ID_CACHE.get(video_id)
+    if file_id is not None:
+        TIKTOK_FILE_ID_CACHE.move_to_end(video_id)
+    return file_id
+
+
+def _cache_media_file_id(url: str, quality: str, audio_lang: str, file_id: str) -> None:
+    if not url or not file_id:
+        return
+    key = (normalize_url(url), quality, audio_lang)
+    MEDIA_FILE_ID_CACHE[key] = (time.monotonic(), file_id)
+    MEDIA_FILE_ID_CACHE.move_to_end(key)
+    if len(MEDIA_FILE_ID_CACHE) > MEDIA_FILE_ID_CACHE_MAX:
+        MEDIA_FILE_ID_CACHE.popitem(last=False)
+
+
+def _lookup_media_file_id(url: str, quality: str, audio_lang: str) -> str | None:
+    key = (normalize_url(url), quality, audio_lang)
+    hit = MEDIA_FILE_ID_CACHE.get(key)
+    if hit is None:
+        return None
+    if time.monotonic() - hit[0] >= MEDIA_FILE_ID_TTL:
+        del MEDIA_FILE_ID_CACHE[key]
+        return None
+    MEDIA_FILE_ID_CACHE.move_to_end(key)
+    return hit[1]
+
+
+def _drop_media_file_id(url: str, quality: str, audio_lang: str) -> None:
+    MEDIA_FILE_ID_CACHE.pop((normalize_url(url), quality, audio_lang), None)
+
+
+async def _run_ffmpeg_async(cmd: list[str], check: bool = False) -> int:
+    """Exécute ffmpeg sans bloquer ni thread ni event loop; sortie ignorée."""
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    rc = await proc.wait()
+    if check and rc != 0:
+        raise subprocess.CalledProcessError(rc, cmd)
+    return rc
+
+
+def _clamp(val: float, lo: float, hi: float) -> float:
+    if val < lo:
+        return lo
+    if val > hi:
+        return hi
+    return val
+
+
+_RE_SIGSTATS = re.compile(r"lavfi\.signalstats\.([A-Z]+)=([0-9.]+)")
+_RE_SIGSTATS_BYTES = re.compile(rb"lavfi\.signalstats\.([A-Z]+)=([0-9.]+)")
+
+
+def _signalstats_averages(stats_path: str) -> dict[str, float]:
+    """Moyenne par clé des échantillons signalstats écrits par metadata=print."""
+    if np is not None:
+        arr = np.fromregex(
+            stats_path,
+            _RE_SIGSTATS_BYTES,
+            [("k", "S8"), ("v", "f4")],
+        )
+        if arr.size == 0:
+            return {}
+        keys, inv = np.unique(arr["k"], return_inverse=True)
+        sums = np.bincount(inv, weights=arr["v"])
+        counts = np.bincount(inv)
+        return {
+            k.decode("ascii"): float(s / c)
+            for k, s, c in zip(keys, sums, counts)
+            if c
+        }
+
+    # Moyenne en flux: deux accumulateurs par clé, aucune liste de floats boxés.
+    sums: dict[str, float] = {}
+    counts: dict[str, int] = {}
+    with open(stats_path, encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            m = _RE_SIGSTATS.search(line)
+            if m is None:
+                continue
+            k = m.group(1)
+            sums[k] = sums.get(k, 0.0) + float(m.group(2))
+            counts[k] = counts.get(k, 0) + 1
+    return {k: sums[k] / c for k, c in counts.items() if c}
+
+
+async def _extract_video_style(video_path: str, keyframes_only: bool = False) -> dict[str, float]:
+    """Extraction avancée du style visuel: couleurs, contraste, saturation, température, vignette.
+
+    Avec keyframes_only, seules les images clés sont décodées (-skip_frame
+    nokey): l'échantillonnage reste représentatif mais la passe d'analyse ne
+    paie plus un décodage complet du flux.
+    """
+    exe = _ffmpeg_exe()
+    fd, stats_path = tempfile.mkstemp(prefix="signalstats_", suffix=".txt")
+    os.close(fd)
+    if keyframes_only:
+        decode_opts = ["-skip_frame", "nokey"]
+        vf = f"signalstats,metadata=print:file={stats_path}"
+    else:
+        decode_opts = []
+        vf = f"select='not(mod(n,50))',signalstats,metadata=print:file={stats_path}"
+    cmd = [
+        exe,
+        "-hide_banner",
+        *decode_opts,
+        "-i",
+        video_path,
+        "-vf",
+        vf,
+        "-an",
+        "-f",
+        "null",
+        "-",
+    ]
+    try:
+        await _run_ffmpeg_async(cmd)
+        averages = _signalstats_averages(stats_path)
+    finally:
+        await _aio_remove(stats_path)
+
+    def _avg(key: str) -> float:
+        return averages.get(key, 0.0)
+
+    yavg = _avg("YAVG")
+    ylow = _avg("YLOW")
+    yhigh = _avg("YHIGH")
+    uavg = _avg("UAVG")
+    vavg = _avg("VAVG")
+    ulow = _avg("ULOW")
+    uhigh = _avg("UHIGH")
+    vlow = _avg("VLOW")
+    vhigh = _avg("VHIGH")
+
+    temp = (vavg - 128.0) / 128.0
+    tint = (uavg - 128.0) / 128.0
+
+    return {
+        "yavg": yavg,
+        "yrange": max(1.0, yhigh - ylow),
+        "crange": max(1.0, ((uhigh - ulow) + (vhigh - vlow)) / 2.0),
+        "temp": temp,
+        "tint": tint,
+        "uavg": uavg,
+        "vavg": vavg,
+    }
+
+
+async def _extract_signalstats(video_path: str) -> dict[str, float]:
+    return await _extract_video_style(video_path)
+
+
+def _compute_eq_params(src: dict[str, float], ref: dict[str, float]) -> tuple[float, float, float]:
+    b = (ref.get("yavg", 0.0) - src.get("yavg", 0.0)) / 255.0
+    b = _clamp(b, -0.35, 0.35)
+
+    c = ref.get("yrange", 1.0) / max(1.0, src.get("yrange", 1.0))
+    c = _clamp(c, 0.7, 1.6)
+
+    s = ref.get("crange", 1.0) / max(1.0, src.get("crange", 1.0))
+    s = _clamp(s, 0.6, 1.8)
+
+    return b, c, s
+
+
+# Encodeurs matériels par ordre de préférence, avec leurs réglages qualité
+# équivalents à libx264 -crf 23. libx264 reste le repli universel.
+_ENCODER_ARGS = {
+    "h264_nvenc": ["-c:v", "h264_nvenc", "-preset", "p4", "-cq", "23"],
+    "h264_qsv": ["-c:v", "h264_qsv", "-preset", "veryfast", "-global_quality", "23"],
+    "h264_videotoolbox": ["-c:v", "h264_videotoolbox", "-q:v", "60"],
+    "h264_amf": ["-c:v", "h264_amf", "-quality", "speed", "-rc", "cqp", "-qp_i", "23", "-qp_p", "23"],
+    "libx264": ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23"],
+}
+
+
+def _encoder_smoke_test(exe: str, args: list[str]) -> bool:
+    cmd = [
+        exe,
+        "-hide_banner",
+        "-f",
+        "lavfi",
+        "-i",
+        "color=black:s=128x128:d=0.1",
+        *args,
+        "-f",
+        "null",
+        "-",
+    ]
+    try:
+        p = subprocess.run(cmd, capture_output=True, timeout=20, check=False)
+    except Exception:
+        return False
+    return p.returncode == 0
+
+
+@functools.lru_cache(maxsize=1)
+def _video_encoder_args() -> tuple[str, ...]:
+    """Choisit l'encodeur H.264 le plus rapide réellement utilisable sur cette machine."""
+    exe = _ffmpeg_exe()
+    try:
+        p = subprocess.run(
+            [exe, "-hide_banner", "-encoders"],
+            capture_output=True,
+            text=True,
+            timeout=20,
+            check=False,
+        )
+        listed = p.stdout or ""
+    except Exception:
+        listed = ""
+    for name in ("h264_nvenc", "h264_qsv", "h264_videotoolbox", "h264_amf"):
+        args = _ENCODER_ARGS[name]
+        if name in listed and _encoder_smoke_test(exe, args):
+            logger.info("ffmpeg encoder: using %s", name)
+            return tuple(args)
+    # -threads 2 borne le nombre de threads par processus libx264, le
+    # parallélisme global étant géré par FFMPEG_SEMAPHORE.
+    return tuple(_ENCODER_ARGS["libx264"]) + ("-threads", "2")
+
+
+def _hwaccel_args() -> tuple[str, ...]:
+    # Décodage accéléré uniquement quand un encodeur matériel a été retenu.
+    if _video_encoder_args()[1] != "libx264":
+        return ("-hwaccel", "auto")
+    return ()
+
+
+PRESET_EFFECTS = {
+    "cinematic": {
+        "name_fr": "🎬 Cinématique",
+        "name_en": "🎬 Cinematic",
+        "desc_fr": "Teal & Orange, look film",
+        "desc_en": "Teal & Orange, film look",
+        "filters": [
+            "eq=contrast=1.15:saturation=0.9:brightness=-0.02",
+            "colorbalance=rs=0.1:gs=-0.05:bs=-0.15:rm=0.05:bm=-0.1:rh=-0.05:gh=0.02:bh=0.08",
+            "unsharp=5:5:0.8:3:3:0.4",
+        ],
+    },
+    "vintage": {
+        "name_fr": "📼 Vintage",
+        "name_en": "📼 Vintage",
+        "desc_fr": "Rétro années 70",
+        "desc_en": "Retro 70s style",
+        "filters": [
+            "eq=contrast=1.2:saturation=0.7:brightness=0.05:gamma=1.1",
+            "colorbalance=rs=0.15:gs=0.05:bs=-0.1:rm=0.1:bm=-0.05",
+        ],
+    },
+    "neon": {
+        "name_fr": "💎 Néon",
+        "name_en": "💎 Neon",
+        "desc_fr": "Cyberpunk, couleurs explosives",
+        "desc_en": "Cyberpunk, explosive colors",
+        "filters": [
+            "eq=contrast=1.3:saturation=1.8:brightness=-0.08",
+            "colorbalance=rm=0.15:bm=0.2:bs=0.15",
+            "unsharp=7:7:1.2:5:5:0.0",
+        ],
+    },
+    "bw_contrast": {
+        "name_fr": "⬛ N&B Contrasté",
+        "name_en": "⬛ High Contrast B&W",
+        "desc_fr": "Noir & blanc dramatique",
+        "desc_en": "Dramatic black & white",
+        "filters": [
+            "hue=s=0",
+            "eq=contrast=1.4:brightness=-0.03:gamma=0.9",
+        ],
+    },
+    "warm_sunset": {
+        "name_fr": "🌅 Coucher de soleil",
+        "name_en": "🌅 Warm Sunset",
+        "desc_fr": "Ambiance chaude dorée",
+        "desc_en": "Warm golden vibe",
+        "filters": [
+            "eq=contrast=1.1:saturation=1.25:brightness=0.03",
+            "colorbalance=rs=0.2:gs=0.05:bs=-0.15:rm=0.15:gm=0.02:bm=-0.1",
+        ],
+    },
+    "cool_blue": {
+        "name_fr": "❄️ Bleu Glacé",
+        "name_en": "❄️ Icy Blue",
+        "desc_fr": "Ambiance froide bleue",
+        "desc_en": "Cool blue mood",
+        "filters": [
+            "eq=contrast=1.15:saturation=0.85:brightness=-0.02",
+            "colorbalance=rs=-0.15:bs=0.2:rm=-0.1:bm=0.15:rh=-0.05:bh=0.1",
+        ],
+    },
+    "vibrant": {
+        "name_fr": "🌈 Vibrant",
+        "name_en": "🌈 Vibrant",
+        "desc_fr": "Couleurs éclatantes",
+        "desc_en": "Vivid colors boost",
+        "filters": [
+            "eq=contrast=1.2:saturation=1.5:brightness=0.02",
+            "unsharp=5:5:1.0:3:3:0.0",
+        ],
+    },
+    "soft_dream": {
+        "name_fr": "☁️ Doux Rêveur",
+        "name_en": "☁️ Soft Dream",
+        "desc_fr": "Look doux et aérien",
+        "desc_en": "Soft and dreamy look",
+        "filters": [
+            "eq=contrast=0.9:saturation=0.8:brightness=0.05:gamma=1.15",
+            "colorbalance=rs=0.05:gs=0.03:rm=0.03",
+        ],
+    },
+}
+
+
+async def _apply_preset_effect(in_path: str, out_path: str, preset: str) -> None:
+    """Applique un effet prédéfini avec filtres ffmpeg avancés."""
+    exe = _ffmpeg_exe()
+    effect = PRESET_EFFECTS.get(preset)
+    if not effect:
+        raise ValueError(f"Unknown preset: {preset}")
+
+    vf = ",".join(effect["filters"])
+    cmd = [
+        exe,
+        "-hide_banner",
+        "-y",
+        *_hwaccel_args(),
+        "-i",
+        in_path,
+        "-map",
+        "0:v:0",
+        "-map",
+        "0:a?",
+        "-vf",
+        vf,
+        *_video_encoder_args(),
+        "-c:a",
+        "aac",
+        "-b:a",
+        "128k",
+        "-movflags",
+        "+faststart",
+        out_path,
+    ]
+    await _run_ffmpeg_async(cmd, check=True)
+
+
+async def _analyze_and_apply_style(in_path: str, out_path: str, ref_style: dict[str, float]) -> None:
+    """Analyse la source puis applique le style de référence en un seul appel.
+
+    Le flux n'est décodé intégralement qu'une fois (pendant l'encodage);
+    l'analyse préalable ne touche que les images clés.
+    """
+    src_style = await _extract_video_style(in_path, keyframes_only=True)
+    await _apply_stolen_style(in_path, out_path, src_style, ref_style)
+
+
+async def _apply_stolen_style(
+    in_path: str, out_path: str, src_style: dict[str, float], ref_style: dict[str, float]
+) -> None:
+    """Applique le style 'volé' d'une vidéo de référence avec color grading avancé."""
+    exe = _ffmpeg_exe()
+
+    b = (ref_style.get("yavg", 0.0) - src_style.get("yavg", 0.0)) / 255.0
+    b = _clamp(b, -0.35, 0.35)
+
+    c = ref_style.get("yrange", 1.0) / max(1.0, src_style.get("yrange", 1.0))
+    c = _clamp(c, 0.7, 1.6)
+
+    s = ref_style.get("crange", 1.0) / max(1.0, src_style.get("crange", 1.0))
+    s = _clamp(s, 0.6, 1.8)
+
+    temp_shift = ref_style.get("temp", 0.0) - src_style.get("temp", 0.0)
+    temp_shift = _clamp(temp_shift, -0.3, 0.3)
+
+    tint_shift = ref_style.get("tint", 0.0) - src_style.get("tint", 0.0)
+    tint_shift = _clamp(tint_shift, -0.3, 0.3)
+
+    rs = temp_shift * 0.4
+    bs = -temp_shift * 0.4
+    gs = tint_shift * 0.3
+
+    filters = [
+        f"eq=brightness={b:.4f}:contrast={c:.4f}:saturation={s:.4f}",
+        f"colorbalance=rs={rs:.3f}:gs={gs:.3f}:bs={bs:.3f}",
+    ]
+
+    vf = ",".join(filters)
+    cmd = [
+        exe,
+        "-hide_banner",
+        "-y",
+        *_hwaccel_args(),
+        "-i",
+        in_path,
+        "-map",
+        "0:v:0",
+        "-map",
+        "0:a?",
+        "-vf",
+        vf,
+        *_video_encoder_args(),
+        "-c:a",
+        "aac",
+        "-b:a",
+        "128k",
+        "-movflags",
+        "+faststart",
+        out_path,
+    ]
+    await _run_ffmpeg_async(cmd, check=True)
+
+
+async def _apply_eq_filter(in_path: str, out_path: str, brightness: float, contrast: float, saturation: float) -> None:
+    exe = _ffmpeg_exe()
+    vf = f"eq=brightness={brightness:.4f}:contrast={contrast:.4f}:saturation={saturation:.4f}"
+    cmd = [
+        exe,
+        "-hide_banner",
+        "-y",
+        *_hwaccel_args(),
+        "-i",
+        in_path,
+        "-map",
+        "0:v:0",
+        "-map",
+        "0:a?",
+        "-vf",
+        vf,
+        *_video_encoder_args(),
+        "-c:a",
+        "aac",
+        "-b:a",
+        "128k",
+        "-movflags",
+        "+faststart",
+        out_path,
+    ]
+    await _run_ffmpeg_async(cmd, check=True)
+
+
+async def _download_telegram_video_to_file(
+    update: Update, context: ContextTypes.DEFAULT_TYPE, out_path: str
+) -> bool:
+    msg = update.message
+    if not msg:
+        return False
+
+    file_id = None
+    if msg.video:
+        file_id = msg.video.file_id
+    elif msg.document and msg.document.mime_type and msg.document.mime_type.startswith("video/"):
+        file_id = msg.document.file_id
+
+    if not file_id:
+        return False
+
+    tg_file = await context.bot.get_file(file_id)
+    await tg_file.download_to_drive(custom_path=out_path)
+    return os.path.exists(out_path)
+
+
+async def _download_reference_video_for_effects(
+    message,
+    url: str,
+    lang: str,
+) -> tuple[str | None, dict[str, float] | None]:
+    try:
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        if host.endswith("vm.tiktok.com") or host.endswith("vt.tiktok.com"):
+            resolved = await asyncio.to_thread(_resolve_final_url, url)
+            url = normalize_url(resolved)
+    except Exception:
+        pass
+
+    ydl_opts = {
+        **COMMON_YDL_OPTS,
+        "format": "bv*[height<=720]+ba/b[height<=720]/best[height<=720]/worst",
+        "outtmpl": str(DOWNLOAD_DIR / "effects_ref_%(id)s.%(ext)s"),
+        "noplaylist": True,
+        "merge_output_format": "mp4",
+        "socket_timeout": 60,
+        "retries": 3,
+        "fragment_retries": 3,
+        "extractor_retries": 3,
+    }
+
+    filename = None
+    progress_message = await message.reply_text(
+        "⬇️ Démarrage du téléchargement…" if lang == "fr" else "⬇️ Starting download…"
+    )
+    loop = asyncio.get_running_loop()
+    progress_hook = _make_progress_hook(loop, progress_message, lang, "video")
+    ydl_opts["progress_hooks"] = [progress_hook]
+
+    def _download() -> str | None:
+        ydl = _get_ydl(ydl_opts)
+        # download=True: une seule passe d'extraction au lieu de
+        # extract_info puis download (qui refaisait la requête page).
+        info = ydl.extract_info(url, download=True)
+        return ydl.prepare_filename(info)
+
+    try:
+        async with DOWNLOAD_SEMAPHORE:
+            filename = await loop.run_in_executor(_DOWNLOAD_EXECUTOR, _download)
+    except DownloadError as e:
+        error_text = str(e)
+        logger.info("Download error while fetching effects reference: %s", error_text)
+        try:
+            await progress_message.edit_text("❌ Erreur" if lang == "fr" else "❌ Error")
+        except Exception:
+            pass
+        if _is_youtube_antibot_error(error_text):
+            try:
+                await message.reply_text(_youtube_antibot_user_message(lang))
+            except Exception:
+                pass
+        return None, None
+    except Exception:
+        logger.exception("Unexpected error while fetching effects reference")
+        try:
+            await progress_message.edit_text("❌ Erreur" if lang == "fr" else "❌ Error")
+        except Exception:
+            pass
+        return None, None
+    finally:
+        progress_hook.stop()
+
+    if not filename or not os.path.exists(filename):
+        try:
+            await progress_message.edit_text("❌ Erreur" if lang == "fr" else "❌ Error")
+        except Exception:
+            pass
+        return None, None
+
+    try:
+        await progress_message.edit_text(
+            "🔎 Analyse de la vidéo…" if lang == "fr" else "🔎 Analyzing video…"
+        )
+    except Exception:
+        pass
+
+    async with FFMPEG_SEMAPHORE:
+        stats = await _extract_signalstats(filename)
+
+    try:
+        await progress_message.edit_text("✅ Terminé" if lang == "fr" else "✅ Done")
+    except Exception:
+        pass
+
+    return filename, stats
+
+
+_BYTE_UNITS = ("B", "KB", "MB", "GB", "TB")
+
+
+def _format_bytes(num: int | float | None) -> str:
+    if not isinstance(num, (int, float)) or num <= 0:
+        return "?"
+    e = max(0, min(int(math.log2(num)) // 10, len(_BYTE_UNITS) - 1)) if num >= 1 else 0
+    if e == 0:
+        return f"{int(num)} {_BYTE_UNITS[0]}"
+    return f"{num / (1 << (10 * e)):.1f} {_BYTE_UNITS[e]}"
+
+
+def _format_eta(seconds: int | float | None) -> str:
+    if not isinstance(seconds, (int, float)) or seconds <= 0:
+        return "?"
+    s = int(seconds)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    if h:
+        return f"{h:d}h{m:02d}m"
+    if m:
+        return f"{m:d}m{s:02d}s"
+    return f"{s:d}s"
+
+
+def _make_progress_hook(loop, progress_message, lang: str, kind: str):
+    # Le thread yt-dlp se contente d'écrire le dernier texte dans `last`;
+    # une tâche unique côté boucle le relit chaque seconde et pousse l'edit.
+    # Plus aucun run_coroutine_threadsafe ni future inter-thread par tick,
+    # et les rafales sont naturellement coalescées.
+    last = {"t": 0.0, "text": ""}
+
+    async def _flush() -> None:
+        last_sent = ""
+        while True:
+            await asyncio.sleep(1.0)
+            text = last["text"]
+            if text and text != last_sent:
+                last_sent = text
+                try:
+                    await progress_message.edit_text(text)
+                except Exception:
+                    pass
+
+    task = loop.create_task(_flush())
+
+    def _schedule(text: str) -> None:
+        if text:
+            last["text"] = text
+
+    def _stop() -> None:
+        task.cancel()
+
+    def hook(d: dict) -> None:
+        status = d.get("status")
+        if status == "downloading":
+            # Limiteur de débit avant tout formatage: la quasi-totalité des
+            # ticks est jetée, autant ne pas construire leurs chaînes.
+            now = time.monotonic()
+            if now - last["t"] < 1.0:
+                return
+            last["t"] = now
+            downloaded = d.get("downloaded_bytes")
+            total = d.get("total_bytes")
+            if total is None:
+                total = d.get("total_bytes_estimate")
+            speed = d.get("speed")
+            eta = d.get("eta")
+
+            pct = None
+            if isinstance(downloaded, (int, float)) and isinstance(total, (int, float)) and total > 0:
+                pct = int((float(downloaded) / float(total)) * 100)
+            pct_txt = f"{pct}%" if pct is not None else "?%"
+
+            if lang == "fr":
+                title = "⬇️ Téléchargement vidéo…" if kind == "video" else "⬇️ Téléchargement audio…"
+                line1 = f"{pct_txt} • {_format_bytes(downloaded)} / {_format_bytes(total)}"
+                line2 = f"⚡ {_format_bytes(speed)}/s • ⏱️ {_format_eta(eta)}"
+            else:
+                title = "⬇️ Downloading video…" if kind == "video" else "⬇️ Downloading audio…"
+                line1 = f"{pct_txt} • {_format_bytes(downloaded)} / {_format_bytes(total)}"
+                line2 = f"⚡ {_format_bytes(speed)}/s • ⏱️ {_format_eta(eta)}"
+            _schedule("\n".join([title, line1, line2]))
+            return
+
+        if status == "finished":
+            text = (
+                "✅ Téléchargement terminé. 📦 Préparation…"
+                if lang == "fr"
+                else "✅ Download finished. 📦 Preparing…"
+            )
+            _schedule(text)
+
+    hook.stop = _stop
+    return hook
+
+
+_TIKTOK_INFO_CACHE: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+_TIKTOK_INFO_CACHE_MAX = 256
+_TIKTOK_INFO_TTL = 60.0
+
+
+# Instances YoutubeDL réutilisées par thread de travail: la construction
+# recharge les extracteurs et recompile leurs tables à chaque fois (dizaines
+# de ms). yt-dlp n'étant pas thread-safe, le cache est local au thread —
+# pas de verrou, et asyncio.to_thread recycle un petit pool de threads.
+_YDL_LOCAL = threading.local()
+
+
+def _get_ydl(opts: dict) -> yt_dlp.YoutubeDL:
+    hooks = opts.get("progress_hooks")
+    key = tuple(
+        sorted((k, repr(v)) for k, v in opts.items() if k != "progress_hooks")
+    )
+    cache = getattr(_YDL_LOCAL, "cache", None)
+    if cache is None:
+        cache = _YDL_LOCAL.cache = {}
+    ydl = cache.get(key)
+    if ydl is None:
+        base = {k: v for k, v in opts.items() if k != "progress_hooks"}
+        ydl = cache[key] = yt_dlp.YoutubeDL(base)
+    # Les hooks sont propres à chaque téléchargement: injectés ici plutôt
+    # que figés à la construction.
+    ydl._progress_hooks = list(hooks) if hooks else []
+    return ydl
+
+
+def _extract_tiktok_direct_candidate(
+    url: str, quality: str
+) -> tuple[str | None, str | None, str | None]:
+    # Les retries, bascules HD/SD et reposts du même lien retombent sur les
+    # mêmes métadonnées: un petit cache TTL évite de refaire l'aller-retour
+    # réseau complet d'extract_info.
+    hit = _TIKTOK_INFO_CACHE.get(url)
+    if hit is not None and time.monotonic() - hit[0] < _TIKTOK_INFO_TTL:
+        info = hit[1]
+    else:
+        ydl_opts = {
+            **COMMON_YDL_OPTS,
+            "skip_download": True,
+            "noplaylist": True,
+        }
+
+        info = _get_ydl(ydl_opts).extract_info(url, download=False)
+        if isinstance(info, dict):
+            _TIKTOK_INFO_CACHE[url] = (time.monotonic(), info)
+            if len(_TIKTOK_INFO_CACHE) > _TIKTOK_INFO_CACHE_MAX:
+                _TIKTOK_INFO_CACHE.popitem(last=False)
+
+    if not isinstance(info, dict):
+        return None, None, None
+
+    title = info.get("title") if isinstance(info.get("title"), str) else None
+    video_id = info.get("id") if isinstance(info.get("id"), str) else None
+
+    formats = info.get("formats") or []
+    if not isinstance(formats, list):
+        formats = []
+
+    # Une seule passe sur les formats: on suit le meilleur candidat
+    # (hauteur, tbr, url) avec et sans audio — et leurs variantes <=720p
+    # pour la qualité SD — plutôt que de construire des listes
+    # intermédiaires filtrées puis de refaire max().
+    want_sd = quality == "sd"
+    best_audio: tuple[int, float, str] | None = None
+    best_any: tuple[int, float, str] | None = None
+    best_audio_sd: tuple[int, float, str] | None = None
+    best_any_sd: tuple[int, float, str] | None = None
+
+    for f in formats:
+        if not isinstance(f, dict):
+            continue
+        u = f.get("url")
+        if not (isinstance(u, str) and u.startswith("http")):
+            continue
+        protocol = (f.get("protocol") or "").lower()
+        if "m3u8" in protocol:
+            continue
+        ext = (f.get("ext") or "").lower()
+        if ext and ext != "mp4":
+            continue
+        if f.get("vcodec") in (None, "none"):
+            continue
+
+        h = f.get("height")
+        height = h if isinstance(h, int) else 0
+        t = f.get("tbr")
+        tbr = float(t) if isinstance(t, (int, float)) else 0.0
+        cand = (height, tbr, u)
+        has_audio = f.get("acodec") not in (None, "none")
+
+        if best_any is None or cand[:2] > best_any[:2]:
+            best_any = cand
+        if has_audio and (best_audio is None or cand[:2] > best_audio[:2]):
+            best_audio = cand
+        if want_sd and isinstance(h, int) and h <= 720:
+            if best_any_sd is None or cand[:2] > best_any_sd[:2]:
+                best_any_sd = cand
+            if has_audio and (best_audio_sd is None or cand[:2] > best_audio_sd[:2]):
+                best_audio_sd = cand
+
+    # Même repli qu'avant: SD seulement s'il existe au moins un format
+    # <=720p, audio de préférence sinon n'importe quel flux vidéo.
+    if want_sd and best_any_sd is not None:
+        best_audio, best_any = best_audio_sd, best_any_sd
+    best = best_audio or best_any
+    direct_url = best[2] if best else None
+    return direct_url, title, video_id
+
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not update.message:
+        return
+
+    if not BOT_USERNAME:
+        _maybe_set_bot_username(getattr(context.bot, "username", None))
+
+    lang = get_user_lang(update)
+    raw_text = (update.message.text or update.message.caption or "").strip()
+    state = _state(context)
+
+    if state.effects_waiting_ref_url:
+        url = extract_first_url(raw_text)
+        if not url:
+            await update.message.reply_text(get_message("effects_steal_intro", lang))
+            return
+
+        state.effects_waiting_ref_url = False
+
+        # L'ancienne référence se supprime pendant que la nouvelle se
+        # télécharge: aucune raison de sérialiser les deux.
+        old_ref = state.effects_ref_file
+        cleanup_task = asyncio.create_task(_aio_remove(old_ref))
+
+        has_own_video = bool(update.message.video) or bool(
+            update.message.document
+            and update.message.document.mime_type
+            and update.message.document.mime_type.startswith("video/")
+        )
+        user_task = None
+        pending_user_path = None
+        if has_own_video:
+            # Référence en légende + vidéo utilisateur dans le même message:
+            # on télécharge les deux en parallèle au lieu d'attendre le tour
+            # suivant.
+            chat_id = update.effective_chat.id if update.effective_chat else 0
+            pending_user_path = str(
+                DOWNLOAD_DIR / f"effects_user_{chat_id}_{int(time.time())}.mp4"
+            )
+            user_task = asyncio.create_task(
+                _download_telegram_video_to_file(update, context, pending_user_path)
+            )
+
+        ref_task = asyncio.create_task(
+            _download_reference_video_for_effects(update.message, url, lang)
+        )
+        if user_task is not None:
+            ref_res, user_res, _ = await asyncio.gather(
+                ref_task, user_task, cleanup_task, return_exceptions=True
+            )
+            ref_file, ref_stats = (
+                (None, None) if isinstance(ref_res, BaseException) else ref_res
+            )
+            user_ok = user_res is True
+        else:
+            ref_file, ref_stats = await ref_task
+            user_ok = False
+            await cleanup_task
+
+        if not ref_file or not ref_stats:
+            state.effects_entitlement_kind = None
+            state.effects_mode = None
+            await _aio_remove(pending_user_path)
+            await update.message.reply_text(get_message("error_try_again", lang))
+            return
+
+        state.effects_ref_file = ref_file
+        state.effects_ref_stats = ref_stats
+        state.effects_waiting_video = True
+        if not user_ok:
+            await update.message.reply_text(get_message("effects_ready", lang))
+            return
+        # La vidéo utilisateur est déjà sur disque: on enchaîne directement
+        # sur le traitement ci-dessous sans redemander d'envoi.
+        state.effects_user_file = pending_user_path
+
+    if state.effects_waiting_video:
+        pending_user = state.effects_user_file
+        state.effects_user_file = None
+        if extract_first_url(raw_text) and not pending_user:
+            state.effects_waiting_video = False
+            state.effects_ref_stats = None
+            state.effects_preset_id = None
+            state.effects_mode = None
+            state.effects_entitlement_kind = None
+            old_ref = state.effects_ref_file
+            state.effects_ref_file = None
+            await _aio_remove(old_ref)
+
+        has_video = bool(update.message.video) or bool(
+            update.message.document
+            and update.message.document.mime_type
+            and update.message.document.mime_type.startswith("video/")
+        )
+        if not has_video:
+            preset_id = state.effects_preset_id
+            if preset_id:
+                preset = PRESET_EFFECTS.get(preset_id)
+                if preset:
+                    effect_name = preset[f"name_{lang}"]
+                    effect_desc = preset[f"desc_{lang}"]
+                    await update.message.reply_text(
+                        _format_msg("effects_preset_selected", lang,
+                            effect_name=effect_name, effect_desc=effect_desc
+                        )
+                    )
+                    return
+            await update.message.reply_text(get_message("effects_ready", lang))
+            return
+
+        chat_id = update.effective_chat.id if update.effective_chat else 0
+        ts = int(time.time())
+        user_path = str(DOWNLOAD_DIR / f"effects_user_{chat_id}_{ts}.mp4")
+        out_path = str(DOWNLOAD_DIR / f"effects_out_{chat_id}_{ts}.mp4")
+
+        ok = False
+        if isinstance(pending_user, str) and os.path.exists(pending_user):
+            user_path = pending_user
+            ok = True
+        else:
+            try:
+                ok = await _download_telegram_video_to_file(update, context, user_path)
+            except Exception:
+                ok = False
+
+        if not ok:
+            await update.message.reply_text(get_message("error_try_again", lang))
+            return
+
+        progress = await update.message.reply_text(get_message("effects_processing", lang))
+
+        entitlement_kind = state.effects_entitlement_kind
+        if not isinstance(entitlement_kind, str):
+            entitlement_kind = None
+        sent_ok = False
+
+        effects_mode = state.effects_mode
+        preset_id = state.effects_preset_id
+        ref_stats = state.effects_ref_stats
+
+        try:
+            if effects_mode == "preset" and preset_id:
+                async with FFMPEG_SEMAPHORE:
+                    await _apply_preset_effect(user_path, out_path, preset_id)
+            elif effects_mode == "steal" and isinstance(ref_stats, dict):
+                async with FFMPEG_SEMAPHORE:
+                    await _analyze_and_apply_style(user_path, out_path, ref_stats)
+            else:
+                state.effects_waiting_video = False
+                state.effects_entitlement_kind = None
+                await update.message.reply_text(get_message("error_try_again", lang))
+                return
+
+            # Un seul os.stat au lieu de exists() + getsize().
+            try:
+                out_stat = os.stat(out_path)
+            except FileNotFoundError:
+                out_stat = None
+            if out_stat is not None:
+                file_size = out_stat.st_size
+                if file_size > MAX_FILE_SIZE_BYTES:
+                    size_mb = file_size / (1024 * 1024)
+                    await update.message.reply_text(
+                        _format_msg("too_big", lang, size_mb=size_mb)
+                    )
+                    return
+
+                # On passe le chemin plutôt qu'un objet fichier: PTB
+                # streame alors l'envoi depuis le disque au lieu de tout
+                # charger en mémoire.
+                sent = False
+                for attempt in range(2):
+                    try:
+                        try:
+                            await update.message.reply_video(
+                                video=out_path,
+                                read_timeout=600.0,
+                                write_timeout=600.0,
+                            )
+                        except TypeError:
+                            await update.message.reply_video(video=out_path)
+                        sent = True
+                        break
+                    except TimedOut:
+                        if attempt == 0:
+                            await asyncio.sleep(2)
+                            continue
+                        sent = False
+
+                if not sent:
+                    try:
+                        await update.message.reply_document(
+                            document=out_path,
+                            read_timeout=600.0,
+                            write_timeout=600.0,
+                        )
+                    except TypeError:
+                        await update.message.reply_document(document=out_path)
+                    sent = True
+                await update.message.reply_text(get_message("effects_done", lang))
+                sent_ok = True
+
+        except Exception:
+            logger.exception("Error while applying effects")
+            await update.message.reply_text(get_message("error_try_again", lang))
+        finally:
+            state.effects_waiting_video = False
+            state.effects_mode = None
+            state.effects_preset_id = None
+            state.effects_entitlement_kind = None
+            if sent_ok and update.effective_user:
+                try:
+                    await _finalize_effect_entitlement(update.effective_user.id, entitlement_kind)
+                except Exception:
+                    pass
+            await asyncio.to_thread(_rm_all, (user_path, out_path))
+            try:
+                await progress.edit_text("✅" if lang == "fr" else "✅")
+            except Exception:
+                pass
+        return
+
+    if not raw_text:
+        return
+
+    url = extract_first_url(raw_text)
+    if not url:
+        await update.message.reply_text(
+            get_message("prompt_send_link", lang),
+            reply_markup=_main_menu_keyboard(lang),
+            disable_web_page_preview=True,
+        )
+        return
+
+    url = normalize_url(url)
+
+    logger.info("Received URL: %s", url)
+
+    if not is_http_url(url):
+        await update.message.reply_text(get_message("invalid_url", lang))
+        return
+
+    # Sauvegarde le dernier lien et propose un choix Vidéo / Audio
+    state.last_url = url
+
+    buttons = [
+        [
+            InlineKeyboardButton("🎬 Vidéo", callback_data="type_video"),
+            InlineKeyboardButton("🎧 Audio", callback_data="type_audio"),
+        ]
+    ]
+    buttons.append(
+        [InlineKeyboardButton(get_message("effects_button", lang), callback_data="type_effects")]
+    )
+    share_url = _get_share_url(lang)
+    if share_url:
+        buttons.append(
+            [
+                InlineKeyboardButton(get_message("share_button", lang), url=share_url),
+                InlineKeyboardButton(get_message("menu_button", lang), callback_data="menu_main"),
+            ]
+        )
+    else:
+        buttons.append(
+            [InlineKeyboardButton(get_message("menu_button", lang), callback_data="menu_main")]
+        )
+    keyboard = InlineKeyboardMarkup(buttons)
+
+    await update.message.reply_text(
+        get_message("choose_type", lang),
+        reply_markup=keyboard,
+        disable_web_page_preview=True,
+    )
+
+
+async def process_url(message, url: str, lang: str, quality: str, audio_lang: str = "orig") -> None:
+    """Télécharge l'URL donnée avec la qualité choisie et envoie la vidéo."""
+
+    if not isinstance(audio_lang, str) or audio_lang not in ("orig", "fr", "en"):
+        audio_lang = "orig"
+
+    cached_file_id = _lookup_media_file_id(url, quality, audio_lang)
+    if cached_file_id:
+        try:
+            await message.reply_video(video=cached_file_id)
+            await _maybe_send_ad_after_success(message, lang)
+            await _maybe_send_share_prompt(message, lang)
+            return
+        except BadRequest:
+            # file_id périmé côté Telegram: on retombe sur le téléchargement.
+            _drop_media_file_id(url, quality, audio_lang)
+        except (TimedOut, NetworkError):
+            pass
+
+    tiktok_video_id = None
+    try:
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        if host.endswith("vm.tiktok.com") or host.endswith("vt.tiktok.com"):
+            try:
+                resolved = await asyncio.to_thread(_resolve_final_url, url)
+                url = normalize_url(resolved)
+            except Exception:  # pylint: disable=broad-except
+                pass
+            parsed = urlparse(url)
+            host = parsed.netloc.lower()
+
+        if "tiktok.com" in host and "/video/" in parsed.path and audio_lang == "orig":
+            tiktok_video_id = _tiktok_video_id_from_url(url)
+            if tiktok_video_id:
+                cached = _lookup_tiktok_file_id(tiktok_video_id)
+                if cached:
+                    try:
+                        sent = await message.reply_video(video=cached)
+                        video_obj = getattr(sent, "video", None)
+                        file_id = getattr(video_obj, "file_id", None) if video_obj else None
+                        if file_id:
+                            _cache_tiktok_file_id(tiktok_video_id, file_id)
+                        await _maybe_send_ad_after_success(message, lang)
+                        await _maybe_send_share_prompt(message, lang)
+                        return
+                    except (BadRequest, TimedOut, NetworkError):
+                        pass
+
+            direct_url = None
+            title_direct = None
+            vid_from_info = None
+            try:
+                async with DOWNLOAD_SEMAPHORE:
+                    direct_url, title_direct, vid_from_info = await asyncio.to_thread(
+                        _extract_tiktok_direct_candidate, url, quality
+                    )
+            except DownloadError as e:
+                logger.info("TikTok direct extract failed: %s", e)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.debug("TikTok direct extract failed: %s", e)
+
+            if direct_url:
+                try:
+                    sent = await message.reply_video(
+                        video=direct_url,
+                        caption=title_direct or "",
+                    )
+                    vid_key = tiktok_video_id or vid_from_info
+                    video_obj = getattr(sent, "video", None)
+                    file_id = getattr(video_obj, "file_id", None) if video_obj else None
+                    if file_id:
+                        _cache_media_file_id(url, quality, audio_lang, file_id)
+                    if vid_key and file_id:
+                        _cache_tiktok_file_id(vid_key, file_id)
+                    await _maybe_send_ad_after_success(message, lang)
+                    await _maybe_send_share_prompt(message, lang)
+                    return
+                except (BadRequest, TimedOut, NetworkError):
+                    pass
+    except Exception as e:  # pylint: disable=broad-except
+        logger.debug("TikTok instant mode skipped: %s", e)
+
+    wanted_label = None
+    if audio_lang == "fr":
+        wanted_label = "🇫🇷 Français" if lang == "fr" else "🇫🇷 French"
+    elif audio_lang == "en":
+        wanted_label = "🇬🇧 Anglais" if lang == "fr" else "🇬🇧 English"
+
+    audio_pref = "ba"
+    if audio_lang == "fr":
+        audio_pref = "ba[language~='^fr']"
+    elif audio_lang == "en":
+        audio_pref = "ba[language~='^en']"
+
+    if quality == "sd":
+        # SD: max 480p pour un bon compromis qualité / taille
+        video_format = (
+            f"bv*[height<=720]+{audio_pref}/"
+            "bv*[height<=720]+ba/b[height<=720]/best[height<=720]/worst"
+        )
+    else:  # hd par défaut
+        # HD: max 1080p pour la meilleure qualité tout en respectant la limite de taille
+        video_format = (
+            f"bv*[height<=1080]+{audio_pref}/"
+            "bv*[height<=1080]+ba/b[height<=1080]/best[height<=1080]/best"
+        )
+
+    ydl_opts = {
+        **COMMON_YDL_OPTS,
+        "format": video_format,
+        "outtmpl": str(DOWNLOAD_DIR / "%(title)s.%(ext)s"),
+        "noplaylist": True,
+        "merge_output_format": "mp4",
+    }
+
+    filename = None
+    progress_message = None
+    try:
+        progress_message = await message.reply_text(
+            "⬇️ Démarrage du téléchargement…" if lang == "fr" else "⬇️ Starting download…"
+        )
+        loop = asyncio.get_running_loop()
+        progress_hook = _make_progress_hook(loop, progress_message, lang, "video")
+        ydl_opts["progress_hooks"] = [progress_hook]
+
+        def _download() -> tuple[str | None, bool]:
+            ydl = _get_ydl(ydl_opts)
+            # Une seule passe d'extraction: has_requested_audio est
+            # calculé sur l'info renvoyée par le téléchargement lui-même.
+            info = ydl.extract_info(url, download=True)
+            has_requested_audio = True
+            if audio_lang in ("fr", "en"):
+                has_requested_audio = False
+                formats = info.get("formats") or []
+                if isinstance(formats, list):
+                    for f in formats:
+                        if not isinstance(f, dict):
+                            continue
+                        acodec = f.get("acodec")
+                        if acodec in (None, "none"):
+                            continue
+                        vcodec = f.get("vcodec")
+                        if vcodec not in (None, "none"):
+                            continue
+                        flang = f.get("language")
+                        if isinstance(flang, str) and flang.lower().startswith(audio_lang):
+                            has_requested_audio = True
+                            break
+            return ydl.prepare_filename(info), has_requested_audio
+
+        try:
+            async with DOWNLOAD_SEMAPHORE:
+                filename, has_requested_audio = await loop.run_in_executor(
+                    _DOWNLOAD_EXECUTOR, _download
+                )
+        finally:
+            progress_hook.stop()
+
+        if wanted_label and not has_requested_audio:
+            await message.reply_text(
+                _format_msg("audio_lang_unavailable", lang, wanted=wanted_label)
+            )
+
+        try:
+            await progress_message.edit_text(
+                "📤 Envoi vers Telegram…" if lang == "fr" else "📤 Sending to Telegram…"
+            )
+        except Exception:
+            pass
+
+        # Un seul os.stat au lieu de exists() + getsize().
+        try:
+            file_size = os.stat(filename).st_size if filename else None
+        except FileNotFoundError:
+            file_size = None
+        if file_size is None:
+            raise RuntimeError("Downloaded file not found")
+
+        if file_size > MAX_FILE_SIZE_BYTES:
+            size_mb = file_size / (1024 * 1024)
+            await message.reply_text(
+                _format_msg("too_big", lang, size_mb=size_mb),
+                reply_markup=_action_keyboard(lang, "video", quality),
+            )
+            if progress_message is not None:
+                try:
+                    await progress_message.edit_text(
+                        "📦 Fichier trop gros" if lang == "fr" else "📦 File too large"
+                    )
+                except Exception:
+                    pass
+            return
+
+        title = os.path.basename(filename)
+        sent = None
+        try:
+            # Chemin plutôt qu'objet fichier: envoi streamé depuis le disque.
+            try:
+                sent = await message.reply_video(
+                    video=filename,
+                    caption=title,
+                    read_timeout=600.0,
+                    write_timeout=600.0,
+                )
+            except TypeError:
+                sent = await message.reply_video(video=filename, caption=title)
+        except (TimedOut, NetworkError):
+            # L'envoi peut quand même réussir côté Telegram, on log juste pour debug
+            logger.debug("Timed out while sending video; it may still have been delivered.")
+
+        if sent is not None:
+            video_obj = getattr(sent, "video", None)
+            file_id = getattr(video_obj, "file_id", None) if video_obj else None
+            if file_id:
+                _cache_media_file_id(url, quality, audio_lang, file_id)
+                if tiktok_video_id:
+                    _cache_tiktok_file_id(tiktok_video_id, file_id)
+
+        await message.reply_text(get_message("cleaned", lang))
+        await _maybe_send_ad_after_success(message, lang)
+        await _maybe_send_share_prompt(message, lang)
+
+        try:
+            await progress_message.edit_text("✅ Terminé" if lang == "fr" else "✅ Done")
+        except Exception:
+            pass
+
+    except DownloadError as e:
+        error_text = str(e)
+        logger.info("Download error while processing URL: %s", error_text)
+        if progress_message is not None:
+            try:
+                await progress_message.edit_text(
+                    "❌ Échec du téléchargement" if lang == "fr" else "❌ Download failed"
+                )
+            except Exception:
+                pass
+        if _is_youtube_antibot_error(error_text):
+            await message.reply_text(
+                _youtube_antibot_user_message(lang),
+                reply_markup=_action_keyboard(lang, "video", quality),
+            )
+        elif "No video could be found" in error_text:
+            await message.reply_text(
+                get_message("no_video", lang),
+                reply_markup=_action_keyboard(lang, "video", quality),
+            )
+        else:
+            await message.reply_text(
+                get_message("error_try_again", lang),
+                reply_markup=_action_keyboard(lang, "video", quality),
+            )
+
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception("Error while processing URL: %s", e)
+        if progress_message is not None:
+            try:
+                await progress_message.edit_text(
+                    "❌ Erreur" if lang == "fr" else "❌ Error"
+                )
+            except Exception:
+                pass
+        await message.reply_text(
+            get_message("error_try_again", lang),
+            reply_markup=_action_keyboard(lang, "video", quality),
+        )
+    finally:
+        # Le fichier disparaît quel que soit le chemin de sortie — y compris
+        # une exception non prévue — au lieu d'un nettoyage par branche.
+        await _aio_remove(filename)
+
+
+async def process_audio_url(message, url: str, lang: str) -> None:
+    """Télécharge uniquement l'audio et l'envoie."""
+
+    cached_file_id = _lookup_media_file_id(url, "audio", "orig")
+    if cached_file_id:
+        try:
+            await _send(message.reply_audio, audio=cached_file_id)
+            await _maybe_send_ad_after_success(message, lang)
+            await _maybe_send_share_prompt(message, lang)
+            return
+        except BadRequest:
+            _drop_media_file_id(url, "audio", "orig")
+        except (TimedOut, NetworkError):
+            pass
+
+    ydl_opts = {
+        **COMMON_YDL_OPTS,
+        "format": "bestaudio/best",
+        "outtmpl": str(DOWNLOAD_DIR / "%(title)s.%(ext)s"),
+        "noplaylist": True,
+        # Évite la correction de conteneur m4a qui peut poser problème sous Windows
+        "fixup": "never",
+    }
+
+    filename = None
+    progress_message = None
+    try:
+        progress_message = await _send(message.reply_text, 
+            "⬇️ Démarrage du téléchargement…" if lang == "fr" else "⬇️ Starting download…"
+        )
+        loop = asyncio.get_running_loop()
+        progress_hook = _make_progress_hook(loop, progress_message, lang, "audio")
+        ydl_opts["progress_hooks"] = [progress_hook]
+
+        def _download() -> str | None:
+            ydl = _get_ydl(ydl_opts)
+            # Une seule passe d'extraction au lieu d'extract_info + download.
+            info = ydl.extract_info(url, download=True)
+            return ydl.prepare_filename(info)
+
+        try:
+            async with DOWNLOAD_SEMAPHORE:
+                filename = await loop.run_in_executor(_DOWNLOAD_EXECUTOR, _download)
+        finally:
+            progress_hook.stop()
+
+        try:
+            await progress_message.edit_text(
+                "📤 Envoi vers Telegram…" if lang == "fr" else "📤 Sending to Telegram…"
+            )
+        except Exception:
+            pass
+
+        # Un seul os.stat au lieu de exists() + getsize().
+        try:
+            file_size = os.stat(filename).st_size if filename else None
+        except FileNotFoundError:
+            file_size = None
+        if file_size is None:
+            raise RuntimeError("Downloaded file not found")
+
+        if file_size > MAX_FILE_SIZE_BYTES:
+            size_mb = file_size / (1024 * 1024)
+            await _send(message.reply_text, 
+                _format_msg("too_big", lang, size_mb=size_mb),
+                reply_markup=_action_keyboard(lang, "audio", None),
+            )
+            if progress_message is not None:
+                try:
+                    await progress_message.edit_text(
+                        "📦 Fichier trop gros" if lang == "fr" else "📦 File too large"
+                    )
+                except Exception:
+                    pass
+            return
+
+        title = os.path.basename(filename)
+        try:
+            # Chemin plutôt qu'objet fichier: envoi streamé depuis le disque.
+            sent = await _send(message.reply_audio, 
+                audio=filename,
+                caption=title,
+            )
+            audio_obj = getattr(sent, "audio", None)
+            file_id = getattr(audio_obj, "file_id", None) if audio_obj else None
+            if file_id:
+                _cache_media_file_id(url, "audio", "orig", file_id)
+        except (TimedOut, NetworkError):
+            logger.debug(
+                "Timed out while sending audio; it may still have been delivered."
+            )
+
+        await _send(message.reply_text, get_message("cleaned", lang))
+        await _maybe_send_ad_after_success(message, lang)
+        await _maybe_send_share_prompt(message, lang)
+
+        if progress_message is not None:
+            try:
+                await progress_message.edit_text("✅ Terminé" if lang == "fr" else "✅ Done")
+            except Exception:
+                pass
+
+    except DownloadError as e:
+        error_text = str(e)
+        logger.info("Download error while processing audio URL: %s", error_text)
+        if progress_message is not None:
+            try:
+                await progress_message.edit_text(
+                    "❌ Échec du téléchargement" if lang == "fr" else "❌ Download failed"
+                )
+            except Exception:
+                pass
+        if _is_youtube_antibot_error(error_text):
+            await _send(message.reply_text, 
+                _youtube_antibot_user_message(lang),
+                reply_markup=_action_keyboard(lang, "audio", None),
+            )
+        elif "No video could be found" in error_text:
+            await _send(message.reply_text, 
+                get_message("no_video", lang),
+                reply_markup=_action_keyboard(lang, "audio", None),
+            )
+        else:
+            await _send(message.reply_text, 
+                get_message("error_try_again", lang),
+                reply_markup=_action_keyboard(lang, "audio", None),
+            )
+
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception("Error while processing audio URL")
+        if progress_message is not None:
+            try:
+                await progress_message.edit_text(
+                    "❌ Erreur" if lang == "fr" else "❌ Error"
+                )
+            except Exception:
+                pass
+        await _send(message.reply_text, 
+            get_message("error_try_again", lang),
+            reply_markup=_action_keyboard(lang, "audio", None),
+        )
+    finally:
+        await _aio_remove(filename)
+
+
+# Regex du scraping HTML compilées une fois au chargement du module plutôt
+# qu'à chaque requête.
+_RE_META = re.compile(r"<meta[^>]+>", re.IGNORECASE)
+_RE_CONTENT = re.compile(r'content=["\']([^"\']+)["\']', re.IGNORECASE)
+_RE_TITLE = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+_RE_UNIVERSAL = re.compile(
+    r'<script[^>]+id=["\']__UNIVERSAL_DATA_FOR_REHYDRATION__["\'][^>]*>(.*?)</script>',
+    re.IGNORECASE | re.DOTALL,
+)
+_RE_SIGI = re.compile(
+    r'<script[^>]+id=["\']SIGI_STATE["\'][^>]*>(.*?)</script>',
+    re.IGNORECASE | re.DOTALL,
+)
+_RE_JS_ASSIGNMENTS = (
+    re.compile(r'^\s*window\[(?:"|\")?SIGI_STATE(?:"|\")?\]\s*=\s*', re.IGNORECASE),
+    re.compile(r"^\s*window\[(?:'|\")?SIGI_STATE(?:'|\")?\]\s*=\s*", re.IGNORECASE),
+    re.compile(
+        r"^\s*window\[(?:'|\")?__UNIVERSAL_DATA_FOR_REHYDRATION__(?:'|\")?\]\s*=\s*",
+        re.IGNORECASE,
+    ),
+    re.compile(
+        r"^\s*window\.(?:SIGI_STATE|__UNIVERSAL_DATA_FOR_REHYDRATION__)\s*=\s*",
+        re.IGNORECASE,
+    ),
+)
+
+
+# Les contenus viraux sont repartagés en boucle: mémoriser 10 minutes le
+# résultat du scraping évite de re-télécharger et re-parser la même page.
+_SCRAPE_CACHE_MAX = 512
+_SCRAPE_CACHE_TTL = 600.0
+_IMAGE_INFO_CACHE: OrderedDict[str, tuple[float, tuple[str, str | None]]] = OrderedDict()
+_TIKTOK_PHOTO_CACHE: OrderedDict[str, tuple[float, tuple[list[str], str | None]]] = (
+    OrderedDict()
+)
+
+
+def _cache_image_info(
+    page_url: str, image_url: str, title: str | None
+) -> tuple[str, str | None]:
+    _IMAGE_INFO_CACHE[page_url] = (time.monotonic(), (image_url, title))
+    if len(_IMAGE_INFO_CACHE) > _SCRAPE_CACHE_MAX:
+        _IMAGE_INFO_CACHE.popitem(last=False)
+    return image_url, title
+
+
+def _extract_image_info_from_html(page_url: str) -> tuple[str | None, str | None]:
+    hit = _IMAGE_INFO_CACHE.get(page_url)
+    if hit is not None and time.monotonic() - hit[0] < _SCRAPE_CACHE_TTL:
+        return hit[1]
+
+    # Passe par la session partagée _HTTP: keep-alive vers le même CDN,
+    # gzip et en-têtes navigateur déjà configurés.
+    try:
+        resp = _HTTP.get(page_url, timeout=15)
+        resp.raise_for_status()
+        html_text = resp.text
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Error fetching HTML for image extraction")
+        return None, None
+
+    # Parseur HTML5 en C quand selectolax est là; sinon repli sur les
+    # regex compilées.
+    if HTMLParser is not None:
+        tree = HTMLParser(html_text)
+        node = tree.css_first(
+            'meta[property="og:image"], meta[name="og:image"], '
+            'meta[property="twitter:image"], meta[name="twitter:image"], '
+            'meta[name="twitter:image:src"]'
+        )
+        image_url = node.attributes.get("content") if node else None
+        if not image_url:
+            return None, None
+        title_node = tree.css_first("title")
+        title = title_node.text().strip() if title_node else None
+        return _cache_image_info(page_url, image_url, title or None)
+
+    image_url = None
+    # finditer + break: on s'arrête à la première balise utile (og:image
+    # vit dans le <head>) sans matérialiser la liste de tous les <meta>.
+    for m in _RE_META.finditer(html_text):
+        tag = m.group(0)
+        lower_meta = tag.lower()
+        if "og:image" in lower_meta or "twitter:image" in lower_meta:
+            cm = _RE_CONTENT.search(tag)
+            if cm:
+                image_url = cm.group(1)
+                break
+
+    if not image_url:
+        return None, None
+
+    title_match = _RE_TITLE.search(html_text)
+    title = title_match.group(1).strip() if title_match else None
+    return _cache_image_info(page_url, image_url, title)
+
+
+def _download_url_to_file(download_url: str, filename: str) -> None:
+    # stream=True + écriture par blocs de 64 Ko: la mémoire reste bornée
+    # par la taille du bloc au lieu de matérialiser tout le corps.
+    with _HTTP.get(download_url, timeout=30, stream=True) as resp:
+        resp.raise_for_status()
+        with open(filename, "wb") as out_file:
+            for chunk in resp.iter_content(chunk_size=65536):
+                out_file.write(chunk)
+
+
+def _download_url_to_bytesio(
+    download_url: str, referer_url: str | None = None
+) -> io.BytesIO:
+    """Télécharge une image en mémoire: ni écriture disque, ni unlink."""
+    headers = {"Referer": referer_url} if referer_url else None
+    buf = io.BytesIO()
+    with _HTTP.get(download_url, timeout=30, headers=headers, stream=True) as resp:
+        resp.raise_for_status()
+        for chunk in resp.iter_content(chunk_size=65536):
+            buf.write(chunk)
+    buf.seek(0)
+    return buf
+
+
+def _download_url_to_file_with_referer(
+    download_url: str, filename: str, referer_url: str | None
+) -> None:
+    headers = {"Referer": referer_url} if referer_url else None
+    with _HTTP.get(download_url, timeout=30, headers=headers, stream=True) as resp:
+        resp.raise_for_status()
+        with open(filename, "wb") as out_file:
+            for chunk in resp.iter_content(chunk_size=65536):
+                out_file.write(chunk)
+
+
+# Bride le fan-out des carrousels photo: assez pour masquer la latence
+# réseau, pas au point de marteler le CDN.
+PHOTO_DOWNLOAD_SEMAPHORE = asyncio.Semaphore(4)
+
+
+async def _download_photo_batch(
+    photo_urls: list[str], safe_title: str, referer_url: str
+) -> list[str]:
+    """Télécharge jusqu'à 10 photos d'un carrousel en parallèle.
+
+    Un échec annule les téléchargements encore en vol (TaskGroup) et
+    supprime les fichiers déjà écrits avant de propager l'erreur.
+    """
+
+    async def _fetch_one(photo_url: str, out_path: str) -> str:
+        async with PHOTO_DOWNLOAD_SEMAPHORE:
+            await asyncio.to_thread(
+                _download_url_to_file_with_referer, photo_url, out_path, referer_url
+            )
+        return out_path
+
+    out_paths = []
+    for idx, photo_url in enumerate(photo_urls[:10]):
+        parsed_img = urlparse(photo_url)
+        img_ext = os.path.splitext(parsed_img.path)[1].lower().lstrip(".")
+        image_ext = img_ext if img_ext in IMAGE_EXTENSIONS else "jpg"
+        out_paths.append(str(DOWNLOAD_DIR / f"{safe_title}_{idx + 1}.{image_ext}"))
+
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tasks = [
+                tg.create_task(_fetch_one(u, p))
+                for u, p in zip(photo_urls, out_paths)
+            ]
+    except Exception:
+        await asyncio.to_thread(_rm_all, out_paths)
+        raise
+    return [t.result() for t in tasks]
+
+
+def _cache_tiktok_photos(
+    page_url: str, urls: list[str], desc: str | None
+) -> tuple[list[str], str | None]:
+    _TIKTOK_PHOTO_CACHE[page_url] = (time.monotonic(), (list(urls), desc))
+    if len(_TIKTOK_PHOTO_CACHE) > _SCRAPE_CACHE_MAX:
+        _TIKTOK_PHOTO_CACHE.popitem(last=False)
+    return urls, desc
+
+
+def _extract_tiktok_photo_urls_from_html(page_url: str) -> tuple[list[str], str | None]:
+    hit = _TIKTOK_PHOTO_CACHE.get(page_url)
+    if hit is not None and time.monotonic() - hit[0] < _SCRAPE_CACHE_TTL:
+        urls, desc = hit[1]
+        return list(urls), desc
+
+    try:
+        # Accept-Encoding: identity conservé: certaines réponses TikTok
+        # compressées arrivent tronquées.
+        resp = _HTTP.get(
+            page_url, timeout=20, headers={"Accept-Encoding": "identity"}
+        )
+        resp.raise_for_status()
+        html_bytes = resp.content
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Error fetching TikTok HTML")
+        return [], None
+
+    script_id = None
+    json_text = None
+
+    # Chemin rapide au niveau octets: repérer la balise script par find()
+    # et ne décoder que son contenu (<100 Ko) au lieu des 1-2 Mo de page.
+    for marker, candidate_id in (
+        (b'id="__UNIVERSAL_DATA_FOR_REHYDRATION__"', "__UNIVERSAL_DATA_FOR_REHYDRATION__"),
+        (b'id="SIGI_STATE"', "SIGI_STATE"),
+    ):
+        i = html_bytes.find(marker)
+        if i == -1:
+            continue
+        j = html_bytes.find(b">", i)
+        k = html_bytes.find(b"</script>", j + 1) if j != -1 else -1
+        if j != -1 and k != -1:
+            script_id = candidate_id
+            json_text = html_bytes[j + 1 : k].decode("utf-8", errors="ignore").strip()
+        break
+
+    if json_text is None:
+        # Balise introuvable par find() (attributs réordonnés, quotes
+        # simples…): repli sur le vrai parseur, sinon sur les regex.
+        html_text = html_bytes.decode("utf-8", errors="ignore")
+        if HTMLParser is not None:
+            tree = HTMLParser(html_text)
+            node = tree.css_first("script#__UNIVERSAL_DATA_FOR_REHYDRATION__")
+            if node is not None:
+                script_id = "__UNIVERSAL_DATA_FOR_REHYDRATION__"
+            else:
+                node = tree.css_first("script#SIGI_STATE")
+                if node is not None:
+                    script_id = "SIGI_STATE"
+            if node is None:
+                return [], None
+            json_text = node.text().strip()
+        else:
+            script_match = _RE_UNIVERSAL.search(html_text)
+            if not script_match:
+                script_match = _RE_SIGI.search(html_text)
+                if script_match:
+                    script_id = "SIGI_STATE"
+            else:
+                script_id = "__UNIVERSAL_DATA_FOR_REHYDRATION__"
+            if not script_match:
+                return [], None
+            json_text = script_match.group(1).strip()
+
+    def _strip_js_assignment(text: str) -> str:
+        t = text.strip()
+        for pattern in _RE_JS_ASSIGNMENTS:
+            t = pattern.sub("", t)
+        t = t.strip()
+        if t.endswith(";"):
+            t = t[:-1]
+        t = t.strip()
+        if not (t.startswith("{") or t.startswith("[")):
+            start = t.find("{")
+            end = t.rfind("}")
+            if start != -1 and end != -1 and end > start:
+                t = t[start : end + 1]
+        return t.strip()
+
+    json_text = _strip_js_assignment(json_text)
+    logger.info(
+        "TikTok embedded JSON candidate (type=%s, chars=%d)",
+        script_id,
+        len(json_text),
+    )
+    try:
+        # orjson parse le blob de réhydratation (0,5-2 Mo) bien plus vite
+        # que le json stdlib; même repli optionnel qu'ailleurs.
+        if orjson is not None:
+            data = orjson.loads(json_text)
+        else:
+            data = json.loads(json_text)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("Error parsing TikTok embedded JSON")
+        return [], None
+
+    def _urls_from_image_post_dict(image_post: dict) -> list[str]:
+        images = image_post.get("images")
+        if not isinstance(images, list):
+            return []
+        # Dédoublonnage au fil de la collecte: plus de passe dict.fromkeys
+        # côté appelant.
+        seen: set[str] = set()
+        urls: list[str] = []
+        for img in images:
+            if not isinstance(img, dict):
+                continue
+            candidates = []
+            for k in ("imageURL", "displayImage", "cover", "staticImage"):
+                v = img.get(k)
+                if isinstance(v, dict):
+                    candidates.append(v)
+            for candidate in candidates:
+                url_list = candidate.get("urlList")
+                if isinstance(url_list, list):
+                    for u in url_list:
+                        if isinstance(u, str) and u.startswith("http"):
+                            if u not in seen:
+                                seen.add(u)
+                                urls.append(u)
+                            break
+        return urls
+
+    def _walk(root) -> tuple[list[str], str | None]:
+        # Pile explicite plutôt que récursion: le payload fait des milliers
+        # de nœuds et la version récursive empilait autant de frames Python.
+        stack = [root]
+        while stack:
+            obj = stack.pop()
+            if isinstance(obj, dict):
+                image_post = obj.get("imagePost")
+                if isinstance(image_post, dict):
+                    urls = _urls_from_image_post_dict(image_post)
+                    if urls:
+                        desc = obj.get("desc")
+                        return urls, desc if isinstance(desc, str) else None
+                stack.extend(obj.values())
+            elif isinstance(obj, list):
+                stack.extend(obj)
+        return [], None
+
+    # Chemin rapide: emplacement canonique de l'imagePost dans les pages
+    # actuelles — O(1) avant de retomber sur le parcours complet.
+    item_struct = data if isinstance(data, dict) else {}
+    for key in ("__DEFAULT_SCOPE__", "webapp.video-detail", "itemInfo", "itemStruct"):
+        item_struct = item_struct.get(key)
+        if not isinstance(item_struct, dict):
+            item_struct = {}
+            break
+    if item_struct:
+        if isinstance(item_struct.get("imagePost"), dict):
+            urls = _urls_from_image_post_dict(item_struct["imagePost"])
+            if urls:
+                desc = item_struct.get("desc")
+                return _cache_tiktok_photos(
+                    page_url, urls, desc if isinstance(desc, str) else None
+                )
+
+    urls, desc = _walk(data)
+    if urls:
+        return _cache_tiktok_photos(page_url, urls, desc)
+
+    return [], None
+
+
+# Nettoyage des titres pour en faire des noms de fichiers: table de
+# translation C, bien plus rapide qu'un re.sub par caractère interdit.
+_SAFE_TITLE_TABLE = str.maketrans({c: "_" for c in '\\/:*?"<>|'})
+
+
+async def _send_photo_urls_as_media_group(message, photo_urls, title) -> bool:
+    """Envoie un carrousel en passant les URLs directement à Telegram.
+
+    Telegram va chercher les images sur le CDN lui-même: zéro
+    téléchargement/écriture/upload de notre côté. Retourne False si
+    Telegram refuse (certains CDN TikTok exigent un Referer), auquel cas
+    l'appelant retombe sur le chemin télécharger-puis-uploader.
+    """
+    media = [
+        InputMediaPhoto(media=u, caption=title if i == 0 else None)
+        for i, u in enumerate(photo_urls[:10])
+    ]
+    try:
+        await _send(message.reply_media_group, media=media)
+        return True
+    except Exception:  # pylint: disable=broad-except
+        logger.info("Direct-URL media group refused; falling back to re-upload")
+        return False
+
+
+async def process_photo_url(message, url: str, lang: str) -> None:
+    """Télécharge une photo (si disponible) et l'envoie."""
+
+    await _send(message.reply_text, get_message("photo_disabled", lang))
+    return
+
+    filename = None
+    try:
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        logger.info("Processing photo URL (host=%s): %s", host, url)
+
+        # Cas spécial X/Twitter
+        if "x.com" in host or "twitter.com" in host:
+            info = None
+
+            def _extract_twitter_info() -> dict | None:
+                ydl_opts = {
+                    "skip_download": True,
+                    "ignore_no_formats_error": True,
+                }
+                return _get_ydl(ydl_opts).extract_info(url, download=False)
+
+            try:
+                info = await asyncio.to_thread(_extract_twitter_info)
+            except DownloadError:
+                info = None
+
+            image_url = None
+            title = None
+
+            if info:
+                thumbs = info.get("thumbnails") or []
+                if thumbs:
+                    best = max(thumbs, key=lambda t: t.get("width") or 0)
+                    image_url = best.get("url")
+                title = info.get("title")
+
+            if image_url:
+                image_url = _twitter_image_url_to_orig(image_url)
+
+            if not image_url:
+                image_url, title_html = await asyncio.to_thread(
+                    _extract_image_info_from_html, url
+                )
+                title = title or title_html
+
+            if not image_url:
+                photo_urls, title_syn = await asyncio.to_thread(
+                    _extract_twitter_photo_urls_from_syndication, url
+                )
+                if photo_urls:
+                    title = title_syn or title or "image"
+                    safe_title = title.translate(_SAFE_TITLE_TABLE)
+
+                    if await _send_photo_urls_as_media_group(
+                        message, photo_urls, title
+                    ):
+                        await _send(message.reply_text, get_message("cleaned", lang))
+                        return
+
+                    downloaded_files: list[str] = []
+                    try:
+                        downloaded_files = await _download_photo_batch(
+                            photo_urls, safe_title, url
+                        )
+
+                        if not downloaded_files:
+                            await _send(message.reply_text, get_message("no_photo", lang))
+                            return
+
+                        media = [
+                            InputMediaPhoto(
+                                media=Path(fpath),
+                                caption=title if i == 0 else None,
+                            )
+                            for i, fpath in enumerate(downloaded_files)
+                        ]
+                        await _send(message.reply_media_group, media=media)
+
+                        # Nettoyage en tâche de fond: l'utilisateur n'attend pas les
+                        # unlink pour recevoir la confirmation.
+                        asyncio.create_task(asyncio.to_thread(_rm_all, downloaded_files))
+                        await _send(message.reply_text, get_message("cleaned", lang))
+                        return
+                    except Exception:  # pylint: disable=broad-except
+                        await asyncio.to_thread(_rm_all, downloaded_files)
+                        raise
+
+            if not image_url:
+                await _send(message.reply_text, get_message("no_photo", lang))
+                return
+
+            title = title or "image"
+            parsed_img = urlparse(image_url)
+            img_ext = os.path.splitext(parsed_img.path)[1].lower().lstrip(".")
+            image_ext = img_ext if img_ext in IMAGE_EXTENSIONS else "jpg"
+            safe_title = title.translate(_SAFE_TITLE_TABLE)
+            # Tout en mémoire: l'image transite par un BytesIO sans toucher
+            # le disque.
+            buf = await asyncio.to_thread(_download_url_to_bytesio, image_url)
+
+            file_size = buf.getbuffer().nbytes
+            if file_size > MAX_FILE_SIZE_BYTES:
+                size_mb = file_size / (1024 * 1024)
+                await _send(message.reply_text, 
+                    _format_msg("too_big", lang, size_mb=size_mb)
+                )
+                return
+
+            buf.name = f"{safe_title}.{image_ext}"
+            await _send(message.reply_photo, photo=buf, caption=title)
+
+            await _send(message.reply_text, get_message("cleaned", lang))
+            return
+
+        # TikTok liens courts
+        if host.endswith("vm.tiktok.com") or host.endswith("vt.tiktok.com"):
+            resolved = await asyncio.to_thread(_resolve_final_url, url)
+            resolved = normalize_url(resolved)
+            logger.info("Resolved TikTok short link: %s -> %s", url, resolved)
+            url = resolved
+            parsed = urlparse(url)
+            host = parsed.netloc.lower()
+
+        # TikTok canonique
+        if "tiktok.com" in host:
+            tiktok_path = urlparse(url).path
+            photo_urls, title_tk = await asyncio.to_thread(
+                _extract_tiktok_photo_urls_from_html, url
+            )
+            if photo_urls:
+                logger.info("TikTok photo extraction: %d image(s)", len(photo_urls))
+                title = title_tk or "image"
+                safe_title = title.translate(_SAFE_TITLE_TABLE)
+
+                if await _send_photo_urls_as_media_group(message, photo_urls, title):
+                    await _send(message.reply_text, get_message("cleaned", lang))
+                    return
+
+                downloaded_files: list[str] = []
+                try:
+                    downloaded_files = await _download_photo_batch(
+                        photo_urls, safe_title, url
+                    )
+
+                    if not downloaded_files:
+                        await _send(message.reply_text, get_message("no_photo", lang))
+                        return
+
+                    media = [
+                        InputMediaPhoto(
+                            media=Path(fpath),
+                            caption=title if i == 0 else None,
+                        )
+                        for i, fpath in enumerate(downloaded_files)
+                    ]
+                    await _send(message.reply_media_group, media=media)
+
+                    # Nettoyage en tâche de fond: l'utilisateur n'attend pas les
+                    # unlink pour recevoir la confirmation.
+                    asyncio.create_task(asyncio.to_thread(_rm_all, downloaded_files))
+                    await _send(message.reply_text, get_message("cleaned", lang))
+                    return
+                except Exception:  # pylint: disable=broad-except
+                    await asyncio.to_thread(_rm_all, downloaded_files)
+                    raise
+
+            if "/photo/" in tiktok_path:
+                image_url, title_html = await asyncio.to_thread(
+                    _extract_image_info_from_html, url
+                )
+                if image_url:
+                    title = title_html or "image"
+                    safe_title = title.translate(_SAFE_TITLE_TABLE)
+                    parsed_img = urlparse(image_url)
+                    img_ext = os.path.splitext(parsed_img.path)[1].lower().lstrip(".")
+                    image_ext = img_ext if img_ext in IMAGE_EXTENSIONS else "jpg"
+                    # Tout en mémoire: l'image transite par un BytesIO sans toucher
+                    # le disque.
+                    buf = await asyncio.to_thread(_download_url_to_bytesio, image_url)
+
+                    file_size = buf.getbuffer().nbytes
+                    if file_size > MAX_FILE_SIZE_BYTES:
+                        size_mb = file_size / (1024 * 1024)
+                        await _send(message.reply_text, 
+                            _format_msg("too_big", lang, size_mb=size_mb)
+                        )
+                        return
+
+                    buf.name = f"{safe_title}.{image_ext}"
+                    await _send(message.reply_photo, photo=buf, caption=title)
+
+                    await _send(message.reply_text, get_message("cleaned", lang))
+                    return
+
+                logger.info("TikTok photo extraction returned 0 images for photo URL")
+                await _send(message.reply_text, get_message("no_photo", lang))
+                return
+
+        # Autres sites : tentative via yt-dlp
+        info = None
+
+        def _extract_other_info() -> dict | None:
+            ydl_opts = {
+                "skip_download": True,
+            }
+            return _get_ydl(ydl_opts).extract_info(url, download=False)
+
+        info = await asyncio.to_thread(_extract_other_info)
+
+        if not info:
+            await _send(message.reply_text, get_message("no_photo", lang))
+            return
+
+        image_url = None
+        image_ext = "jpg"
+
+        # 1) Cas d'une URL qui pointe déjà directement vers une image
+        parsed = urlparse(url)
+        direct_ext = os.path.splitext(parsed.path)[1].lower().lstrip(".")
+        if direct_ext in IMAGE_EXTENSIONS:
+            image_url = url
+            image_ext = direct_ext
+        else:
+            # 2) Utiliser l'URL et l'extension issues des métadonnées yt-dlp
+            info_url = info.get("url")
+            info_ext = (info.get("ext") or "").lower()
+            if info_url and info_ext in IMAGE_EXTENSIONS:
+                image_url = info_url
+                image_ext = info_ext
+            else:
+                # 3) Chercher dans les miniatures et prendre la plus grande
+                thumbs = info.get("thumbnails") or []
+                if thumbs:
+                    best = max(thumbs, key=lambda t: t.get("width") or 0)
+                    image_url = best.get("url")
+                    if image_url:
+                        thumb_path = urlparse(image_url).path
+                        thumb_ext = os.path.splitext(thumb_path)[1].lower().lstrip(".")
+                        if thumb_ext in IMAGE_EXTENSIONS:
+                            image_ext = thumb_ext
+
+        if not image_url:
+            await _send(message.reply_text, get_message("no_photo", lang))
+            return
+
+        title = info.get("title") or "image"
+        safe_title = title.translate(_SAFE_TITLE_TABLE)
+        # Tout en mémoire: l'image transite par un BytesIO sans toucher
+        # le disque.
+        buf = await asyncio.to_thread(_download_url_to_bytesio, image_url)
+
+        file_size = buf.getbuffer().nbytes
+        if file_size > MAX_FILE_SIZE_BYTES:
+            size_mb = file_size / (1024 * 1024)
+            await _send(message.reply_text, 
+                _format_msg("too_big", lang, size_mb=size_mb)
+            )
+            return
+
+        buf.name = f"{safe_title}.{image_ext}"
+        await _send(message.reply_photo, photo=buf, caption=title)
+
+        await _send(message.reply_text, get_message("cleaned", lang))
+
+    except DownloadError as e:
+        logger.exception("Download error while processing photo URL")
+        error_text = str(e)
+        if "Unsupported URL" in error_text:
+            # Dernière tentative : lecture directe du HTML pour récupérer une image
+            image_url, title_html = await asyncio.to_thread(
+                _extract_image_info_from_html, url
+            )
+            if not image_url:
+                await _send(message.reply_text, get_message("no_photo", lang))
+            else:
+                image_ext = "jpg"
+                parsed_img = urlparse(image_url)
+                img_ext = os.path.splitext(parsed_img.path)[1].lower().lstrip(".")
+                if img_ext in IMAGE_EXTENSIONS:
+                    image_ext = img_ext
+
+                title = title_html or "image"
+                safe_title = title.translate(_SAFE_TITLE_TABLE)
+
+                try:
+                    buf = await asyncio.to_thread(
+                        _download_url_to_bytesio, image_url
+                    )
+
+                    file_size = buf.getbuffer().nbytes
+                    if file_size > MAX_FILE_SIZE_BYTES:
+                        size_mb = file_size / (1024 * 1024)
+                        await _send(message.reply_text, 
+                            _format_msg("too_big", lang, size_mb=size_mb)
+                        )
+                        return
+
+                    buf.name = f"{safe_title}.{image_ext}"
+                    await _send(message.reply_photo, photo=buf, caption=title)
+
+                    await _send(message.reply_text, get_message("cleaned", lang))
+
+                except Exception as inner_e:  # pylint: disable=broad-except
+                    logger.exception("Error while processing HTML photo fallback")
+                    await _send(message.reply_text, 
+                        _format_msg("error", lang, error=str(inner_e))
+                    )
+        else:
+            await _send(message.reply_text, 
+                _format_msg("error", lang, error=error_text)
+            )
+
+    except Exception as e:  # pylint: disable=broad-except
+        logger.exception("Error while processing photo URL")
+        await _send(message.reply_text, 
+            _format_msg("error", lang, error=str(e))
+        )
+    finally:
+        await _aio_remove(filename)
+
+
+@callback_preamble
+async def quality_callback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Callback pour le choix de qualité HD/SD."""
+
+    query = update.callback_query
+    state = _state(context)
+    lang = state.lang
+    url = state.last_url
+    if not url:
+        await query.message.reply_text(get_message("no_url_saved", lang))
+        return
+
+    data = query.data or ""
+    quality = "hd" if data == "quality_hd" else "sd"
+
+    state.last_action = "video"
+    state.last_quality = quality
+    if state.last_audio_lang is None:
+        state.last_audio_lang = "orig"
+
+    await query.message.reply_text(
+        get_message("choose_audio_lang", lang),
+        reply_markup=_audio_lang_keyboard(lang),
+        disable_web_page_preview=True,
+    )
+
+
+@callback_preamble
+async def audio_lang_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    state = _state(context)
+    lang = state.lang
+    url = state.last_url
+    if not url:
+        await query.message.reply_text(get_message("no_url_saved", lang))
+        return
+
+    quality = state.last_quality
+    if quality not in ("hd", "sd"):
+        quality = "hd"
+
+    data = query.data or ""
+    audio_lang = "orig"
+    if data == "alang_fr":
+        audio_lang = "fr"
+    elif data == "alang_en":
+        audio_lang = "en"
+
+    state.last_audio_lang = audio_lang
+    flag = f"inflight_{data}"
+    if not _begin_inflight(context, flag):
+        return
+    try:
+        await process_url(query.message, url, lang, quality, audio_lang)
+    finally:
+        _end_inflight(context, flag)
+
+
+@callback_preamble
+async def type_callback(
+    update: Update, context: ContextTypes.DEFAULT_TYPE
+) -> None:
+    """Callback pour le choix Vidéo / Audio."""
+
+    query = update.callback_query
+    state = _state(context)
+    lang = state.lang
+    url = state.last_url
+    if not url:
+        await query.message.reply_text(get_message("no_url_saved", lang))
+        return
+
+    data = query.data or ""
+    logger.info("Type callback: %s (url=%s)", data, url)
+    if data == "type_video":
+        state.last_action = "video"
+        await query.message.reply_text(
+            get_message("choose_quality", lang), reply_markup=_QUALITY_KEYBOARD
+        )
+    elif data == "type_audio":
+        state.last_action = "audio"
+        state.last_quality = None
+        if not _begin_inflight(context, "inflight_type_audio"):
+            return
+        try:
+            await process_audio_url(query.message, url, lang)
+        finally:
+            _end_inflight(context, "inflight_type_audio")
+    elif data == "type_effects":
+        if update.effective_user:
+            kind = await _plan_effect_entitlement(update.effective_user.id)
+            if kind is None:
+                await query.message.reply_text(
+                    get_message("premium_need_more", lang),
+                    reply_markup=_premium_keyboard(lang),
+                )
+                return
+            state.effects_entitlement_kind = kind
+        
+        await query.message.reply_text(
+            get_message("effects_intro", lang), reply_markup=_effects_mode_keyboard(lang)
+        )
+    elif data == "type_photo":
+        await query.message.reply_text(get_message("photo_disabled", lang))
+
+
+@callback_preamble
+async def effect_mode_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Callback pour choix du mode effet: preset ou vol de style."""
+    query = update.callback_query
+    state = _state(context)
+    lang = state.lang
+    data = query.data or ""
+
+    if data == "effect_mode_preset":
+        await query.message.reply_text(
+            get_message("effects_choose_preset", lang),
+            reply_markup=_effect_preset_keyboard(lang),
+        )
+
+    elif data == "effect_mode_steal":
+        state.effects_mode = "steal"
+        state.effects_waiting_ref_url = True
+        await query.message.reply_text(get_message("effects_steal_intro", lang))
+
+
+@callback_preamble
+async def effect_preset_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Callback pour sélection d'un effet prédéfini."""
+    query = update.callback_query
+    state = _state(context)
+    lang = state.lang
+    data = query.data or ""
+
+    if not data.startswith("effect_preset_"):
+        return
+
+    preset_id = data.split("_", 2)[2]
+    preset = PRESET_EFFECTS.get(preset_id)
+    if not preset:
+        await query.message.reply_text(get_message("error_try_again", lang))
+        return
+
+    state.effects_mode = "preset"
+    state.effects_preset_id = preset_id
+    state.effects_waiting_video = True
+
+    effect_name = preset[f"name_{lang}"]
+    effect_desc = preset[f"desc_{lang}"]
+    await query.message.reply_text(
+        _format_msg("effects_preset_selected", lang,
+            effect_name=effect_name, effect_desc=effect_desc
+        )
+    )
+
+
+@callback_preamble
+async def retry_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    state = _state(context)
+    lang = state.lang
+    url = state.last_url
+    if not url:
+        await query.message.reply_text(get_message("no_url_saved", lang))
+        return
+
+    data = query.data or ""
+    if data.startswith("retry_video_"):
+        quality = data.split("_", 2)[2]
+        if quality not in ("hd", "sd"):
+            quality = "hd"
+        state.last_action = "video"
+        state.last_quality = quality
+        audio_lang = state.last_audio_lang
+        if not isinstance(audio_lang, str) or audio_lang not in ("orig", "fr", "en"):
+            audio_lang = "orig"
+        flag = f"inflight_{data}"
+        if not _begin_inflight(context, flag):
+            return
+        try:
+            await process_url(query.message, url, lang, quality, audio_lang)
+        finally:
+            _end_inflight(context, flag)
+        return
+
+    if data == "retry_audio":
+        state.last_action = "audio"
+        state.last_quality = None
+        if not _begin_inflight(context, "inflight_retry_audio"):
+            return
+        try:
+            await process_audio_url(query.message, url, lang)
+        finally:
+            _end_inflight(context, "inflight_retry_audio")
+        return
+
+
+@functools.lru_cache(maxsize=None)
+def _premium_keyboard(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton(
+                    get_message("premium_buy_month", lang), callback_data="premium_buy_month"
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    get_message("premium_buy_credits10", lang),
+                    callback_data="premium_buy_credits10",
+                ),
+                InlineKeyboardButton(
+                    get_message("premium_buy_credits50", lang),
+                    callback_data="premium_buy_credits50",
+                ),
+            ],
+            [
+                InlineKeyboardButton(
+                    get_message("premium_my_ref", lang), callback_data="premium_my_ref"
+                )
+            ],
+            [InlineKeyboardButton(get_message("menu_button", lang), callback_data="menu_main")],
+        ]
+    )
+
+
+async def _send_premium_menu(message, update: Update, lang: str) -> None:
+    if not message or not update.effective_user:
+        return
+    rec = await _get_user_record(update.effective_user.id)
+    now = int(time.time())
+    until_i = _int_or(rec, "premium_until")
+    credits = _get_credits(rec)
+    if until_i > now:
+        status_line = _format_msg("premium_status_active", lang,
+            until=_format_premium_until(until_i, lang)
+        )
+    else:
+        status_line = get_message("premium_status_free", lang)
+    credits_line = _format_msg("premium_credits_line", lang, credits=credits)
+    ref_link = _ref_link_for_user(update.effective_user.id)
+    ref_line = (
+        _format_msg("premium_ref_line", lang, link=ref_link) if ref_link else ""
+    )
+    text = get_message("premium_menu_title", lang) + "\n\n" + status_line + "\n" + credits_line
+    if ref_line:
+        text += "\n\n" + ref_line
+    await message.reply_text(text, reply_markup=_premium_keyboard(lang), disable_web_page_preview=True)
+
+
+async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not BOT_USERNAME:
+        _maybe_set_bot_username(getattr(context.bot, "username", None))
+    lang = get_user_lang(update)
+    msg = update.message or update.effective_message
+    if not msg:
+        return
+    await _send_premium_menu(msg, update, lang)
+
+
+# Bouton d'achat -> (produit, label de prix, montant, clés titre/description).
+_INVOICES = {
+    "premium_buy_month": (
+        "premium_30d",
+        "Premium 30d",
+        PREMIUM_30D_STARS,
+        "invoice_premium_title",
+        "invoice_premium_desc",
+    ),
+    "premium_buy_credits10": (
+        "credits_10",
+        "10 credits",
+        CREDITS_10_STARS,
+        "invoice_credits10_title",
+        "invoice_credits_desc",
+    ),
+    "premium_buy_credits50": (
+        "credits_50",
+        "50 credits",
+        CREDITS_50_STARS,
+        "invoice_credits50_title",
+        "invoice_credits_desc",
+    ),
+}
+
+
+async def _send_invoice_quiet(bot_obj, **kwargs) -> None:
+    try:
+        await bot_obj.send_invoice(**kwargs)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("send_invoice failed")
+
+
+@callback_preamble
+async def premium_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    lang = _state(context).lang
+    data = query.data or ""
+    user = update.effective_user
+    chat = update.effective_chat
+    if not user or not chat:
+        return
+
+    if data == "premium_my_ref":
+        ref_link = _ref_link_for_user(user.id)
+        if not ref_link:
+            await query.message.reply_text(get_message("error_try_again", lang))
+            return
+        await query.message.reply_text(ref_link, disable_web_page_preview=True)
+        return
+
+    entry = _INVOICES.get(data)
+    if entry is None:
+        return
+    product, label, amount, title_key, desc_key = entry
+    # Telegram n'exige pas que l'envoi de la facture soit attendu avant de
+    # rendre la main: le handler répond tout de suite, l'appel part en fond.
+    asyncio.create_task(
+        _send_invoice_quiet(
+            context.bot,
+            chat_id=chat.id,
+            title=get_message(title_key, lang),
+            description=get_message(desc_key, lang),
+            payload=f"cx|{product}|{user.id}",
+            provider_token="",
+            currency="XTR",
+            prices=[LabeledPrice(label=label, amount=amount)],
+        )
+    )
+
+
+async def precheckout_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = getattr(update, "pre_checkout_query", None)
+    if not query:
+        return
+    payload = getattr(query, "invoice_payload", None)
+    ok = isinstance(payload, str) and payload.startswith("cx|")
+    try:
+        await query.answer(ok=ok, error_message=(None if ok else "Invalid invoice"))
+    except Exception:
+        pass
+
+
+# Produit payé -> (coroutine d'attribution, clé de message de confirmation).
+_PAYMENT_PRODUCTS = {
+    "premium_30d": (
+        lambda uid: _grant_premium(uid, PREMIUM_DURATION_SECONDS),
+        "premium_activated",
+    ),
+    "credits_10": (lambda uid: _add_credits(uid, 10), "credits_added_10"),
+    "credits_50": (lambda uid: _add_credits(uid, 50), "credits_added_50"),
+}
+
+
+async def successful_payment_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    msg = update.message or update.effective_message
+    if not msg or not update.effective_user:
+        return
+    sp = getattr(msg, "successful_payment", None)
+    if not sp:
+        return
+    payload = getattr(sp, "invoice_payload", None)
+    if not isinstance(payload, str) or not payload.startswith("cx|"):
+        return
+    parts = payload.split("|")
+    if len(parts) < 3:
+        return
+    product = parts[1]
+    try:
+        target_user_id = int(parts[2])
+    except Exception:
+        target_user_id = update.effective_user.id
+
+    lang = get_user_lang(update)
+    if target_user_id != update.effective_user.id:
+        target_user_id = update.effective_user.id
+
+    entry = _PAYMENT_PRODUCTS.get(product)
+    if entry is None:
+        return
+    grant, msg_key = entry
+    await grant(target_user_id)
+    await msg.reply_text(
+        get_message(msg_key, lang),
+        reply_markup=_main_menu_keyboard(lang),
+    )
+
+
+# Préfixe de callback_data -> handler. Un seul CallbackQueryHandler avec des
+# startswith remplace huit handlers à motif regex évalués en séquence par PTB.
+_CALLBACK_DISPATCH = (
+    ("menu_", menu_callback),
+    ("retry_", retry_callback),
+    ("alang_", audio_lang_callback),
+    ("type_", type_callback),
+    ("effect_mode_", effect_mode_callback),
+    ("effect_preset_", effect_preset_callback),
+    ("quality_", quality_callback),
+    ("premium_", premium_callback),
+)
+
+
+async def _root_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    data = (query.data or "") if query else ""
+    for prefix, handler in _CALLBACK_DISPATCH:
+        if data.startswith(prefix):
+            await handler(update, context)
+            return
+
+
+def main() -> None:
+    # uvloop (si présent) remplace le selector asyncio par libuv: appels
+    # socket et scheduling de tâches nettement moins chers, ce qui domine le
+    # CPU d'un bot qui fait surtout de petites requêtes réseau concurrentes.
+    try:
+        import uvloop  # pylint: disable=import-outside-toplevel
+
+        uvloop.install()
+    except ImportError:
+        pass
+
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    if not token:
+        raise RuntimeError(
+            "TELEGRAM_BOT_TOKEN environment variable is not set. "
+            "Please set it to your bot token from BotFather."
+        )
+
+    # En mode webhook, PORT appartient au serveur d'updates; le healthcheck
+    # maison ne démarre qu'en mode polling.
+    public_url = os.getenv("PUBLIC_URL")
+    if not public_url:
+        _start_healthcheck_server_if_needed()
+    try:
+        _cleanup_download_dir_if_needed()
+    except Exception:
+        logger.exception("Startup cleanup failed")
+
+    async def _post_init(app: Application) -> None:
+        # Exécuteur par défaut dimensionné pour la charge to_thread (unlinks,
+        # requêtes HTTP de scraping, chargement du store): le défaut asyncio
+        # (min(32, cpu+4)) s'étrangle sur les petites machines alors que ces
+        # tâches sont presque purement I/O. Les threads sont créés à la
+        # demande, un plafond large ne coûte rien au repos.
+        asyncio.get_running_loop().set_default_executor(
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=_int_env("BOT_IO_THREADS", 64),
+                thread_name_prefix="cxbot-io",
+            )
+        )
+        # Sonde des encodeurs ffmpeg chauffée hors event loop dès le
+        # démarrage: lancée paresseusement depuis un handler d'effets, elle
+        # exécuterait -encoders plus jusqu'à quatre smoke tests (20 s de
+        # timeout chacun) en synchrone sur la loop et gèlerait tout le bot.
+        await asyncio.to_thread(_hwaccel_args)
+        app.create_task(_store_flusher())
+        app.create_task(_ephemeral_store_flusher())
+        if CLEANUP_DOWNLOADS_INTERVAL_SECONDS > 0:
+            app.create_task(_periodic_download_cleanup())
+        if BOT_USERNAME:
+            # Username fourni via l'env: pas besoin de l'aller-retour get_me
+            # à chaque (re)démarrage d'instance.
+            return
+        try:
+            me = await app.bot.get_me()
+            _maybe_set_bot_username(getattr(me, "username", None))
+        except Exception:
+            logger.exception("Bot post_init failed")
+
+    async def _post_shutdown(app: Application) -> None:
+        _ = app
+        try:
+            await _flush_user_store_now()
+        except Exception:
+            logger.exception("Final user store flush failed")
+
+    # 64 connexions au lieu de la poignée par défaut: uploads, invoices et
+    # acks ne se sérialisent plus derrière la même connexion. HTTP/2 (si h2
+    # est installé) multiplexe en prime ces appels sur un seul TCP+TLS, et un
+    # pool_timeout court fait remonter la contre-pression en erreur au lieu
+    # de laisser les requêtes s'empiler.
+    request = HTTPXRequest(
+        connection_pool_size=64,
+        http_version="2" if _HTTP2_AVAILABLE else "1.1",
+        read_timeout=600.0,
+        write_timeout=600.0,
+        connect_timeout=10.0,
+        pool_timeout=1.0,
+    )
+
+    application = (
+        Application.builder()
+        .token(token)
+        .request(request)
+        .concurrent_updates(True)
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
+
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("menu", menu_command))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("premium", premium_command))
+    application.add_handler(CallbackQueryHandler(_root_callback, block=False))
+    application.add_handler(PreCheckoutQueryHandler(precheckout_callback))
+    application.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment_handler))
+    application.add_handler(
+        MessageHandler(filters.ALL & ~filters.COMMAND, handle_message, block=False)
+    )
+
+    async def _error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        _ = update
+        err = getattr(context, "error", None)
+        if err is None:
+            return
+        if isinstance(err, (TimedOut, NetworkError, BadRequest)):
+            logger.debug("Telegram error suppressed: %s", err.__class__.__name__)
+            return
+        logger.error("Telegram handler error: %s", err, exc_info=err)
+
+    application.add_error_handler(_error_handler)
+
+    logger.info("Bot started. Press Ctrl+C to stop.")
+    if public_url:
+        # Telegram pousse les updates: latence plus basse et zéro long-poll
+        # getUpdates permanent. PUBLIC_URL non défini = polling pour le dev
+        # local et les déploiements sans endpoint exposé.
+        secret_path = os.getenv("WEBHOOK_SECRET_PATH", token)
+        application.run_webhook(
+            listen="0.0.0.0",
+            port=int(os.getenv("PORT", "8080")),
+            url_path=secret_path,
+            webhook_url=f"{public_url.rstrip('/')}/{secret_path}",
+            secret_token=os.getenv("WEBHOOK_SECRET") or None,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+
+if __name__ == "__main__":
+    main()